@@ -0,0 +1,158 @@
+# Copyright IBM Corp. 2024
+# This software is available to you under a BSD 3-Clause License.
+# The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
+
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class EventJournal:
+    """Append-only journal of the events received by Sunfish.
+
+    Every event is stored with a sequence number in a set of JSON lines segment files. Segments are rotated when
+    they grow beyond segment_bytes, or when the journal grows beyond max_bytes, and the oldest ones are deleted
+    when the journal is larger than max_bytes or when they are older than max_age seconds. The journal can be replayed from any sequence number still retained.
+    """
+
+    def __init__(self, path: str, segment_bytes: int = 4 * 1024 * 1024, max_bytes: int = 64 * 1024 * 1024,
+                 max_age: float = None):
+        """
+        Args:
+            path: directory holding the journal segments.
+            segment_bytes: size after which a new segment is started.
+            max_bytes: maximum size of the whole journal.
+            max_age: maximum age (in seconds) of the retained events, None to retain events regardless of their age.
+        """
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        self.last_sequence = 0
+        self._segment_path = None
+        segments = self._segments()
+        if segments:
+            self._segment_path = segments[-1][1]
+            self._recover(self._segment_path)
+            if self.last_sequence == 0:
+                self.last_sequence = segments[-1][0] - 1
+        self._total_bytes = sum(os.path.getsize(segment_path) for _, segment_path in segments)
+
+    def _recover(self, segment_path: str):
+        # reads the last sequence number written, removing the event left incomplete by a crash while appending
+        complete = 0
+        with open(segment_path, 'rb+') as segment:
+            for line in segment:
+                if not line.endswith(b"\n"):
+                    break
+                complete += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    self.last_sequence = json.loads(line)["Sequence"]
+                except (ValueError, KeyError):
+                    logger.warning(f"Skipping a corrupted event in the journal segment {segment_path}")
+            if complete < os.path.getsize(segment_path):
+                logger.warning(f"Removing an incomplete event from the journal segment {segment_path}")
+                segment.truncate(complete)
+
+    def _segments(self) -> list:
+        # segments are named after the first sequence number they contain
+        segments = []
+        for name in os.listdir(self.path):
+            if name.endswith(".jsonl"):
+                segments.append((int(name[:-len(".jsonl")]), os.path.join(self.path, name)))
+        return sorted(segments)
+
+    def append(self, payload: dict) -> list:
+        """Records the events of a payload.
+
+        Args:
+            payload (dict): the Event received.
+
+        Returns:
+            list: the sequence numbers assigned to the events.
+        """
+        header = {key: value for key, value in payload.items() if key != "Events"}
+        sequences = []
+        with self._lock:
+            # the segment being written is never deleted, so it is rotated also when the journal is too large
+            rotate = self._segment_path is None or os.path.getsize(self._segment_path) >= self.segment_bytes or \
+                self._total_bytes > self.max_bytes
+            if rotate:
+                self._segment_path = os.path.join(self.path, f"{self.last_sequence + 1:020d}.jsonl")
+            with open(self._segment_path, 'a') as segment:
+                for event in payload.get("Events", []):
+                    self.last_sequence += 1
+                    record = {
+                        "Sequence": self.last_sequence,
+                        "Timestamp": time.time(),
+                        "Header": header,
+                        "Event": event
+                    }
+                    line = json.dumps(record) + "\n"
+                    segment.write(line)
+                    self._total_bytes += len(line)
+                    sequences.append(self.last_sequence)
+            if rotate:
+                self._apply_retention()
+        return sequences
+
+    def _apply_retention(self):
+        segments = self._segments()
+        sizes = [os.path.getsize(segment_path) for _, segment_path in segments]
+        total = sum(sizes)
+        now = time.time()
+        # the segment being written is never deleted
+        for (first_sequence, segment_path), size in zip(segments[:-1], sizes[:-1]):
+            expired = self.max_age is not None and os.path.getmtime(segment_path) < now - self.max_age
+            if total <= self.max_bytes and not expired:
+                break
+            logger.debug(f"Removing journal segment starting at event {first_sequence}")
+            os.remove(segment_path)
+            total -= size
+        self._total_bytes = total
+
+    def replay(self, from_sequence: int = 0, event_filter=None):
+        """Generator returning the journaled events following a sequence number.
+
+        Args:
+            from_sequence (int): events with a sequence number greater than this one are returned.
+            event_filter: optional callable receiving an event and returning True if it has to be replayed.
+
+        Yields:
+            tuple: (sequence number, Event payload containing the journaled event)
+        """
+        segments = self._segments()
+        for index, (first_sequence, segment_path) in enumerate(segments):
+            if index + 1 < len(segments) and segments[index + 1][0] <= from_sequence + 1:
+                # all the events of this segment precede from_sequence
+                continue
+            try:
+                segment = open(segment_path, 'r')
+            except FileNotFoundError:
+                # removed by the retention policy in the meantime
+                continue
+            with segment:
+                for line in segment:
+                    if not line.endswith("\n"):
+                        # the event is still being written
+                        break
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if record["Sequence"] <= from_sequence:
+                        continue
+                    if self.max_age is not None and record["Timestamp"] < time.time() - self.max_age:
+                        continue
+                    if event_filter is not None and not event_filter(record["Event"]):
+                        continue
+                    payload = dict(record["Header"])
+                    payload["Events"] = [record["Event"]]
+                    yield record["Sequence"], payload
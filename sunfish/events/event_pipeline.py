@@ -0,0 +1,183 @@
+# Copyright IBM Corp. 2024
+# This software is available to you under a BSD 3-Clause License.
+# The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
+
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class EventIngestionPipeline:
+    """Asynchronous ingestion queue for the incoming Redfish events.
+
+    Payloads are acknowledged as soon as they are queued and are processed by a pool of worker threads.
+    Payloads are assigned to the workers by aggregation source (the payload "Context"): the payloads of an agent
+    go to the same worker as long as some of them are still queued, so they are processed in the order they were
+    received, while a new agent goes to the least loaded worker. So the agents onboarded at the same time (e.g.,
+    at a rack power-on) are inspected in parallel. Events redelivered by an agent are recognised by their EventId
+    and dropped.
+    """
+
+    def __init__(self, handler, workers: int = 4, dedupe_window: int = 4096, max_queue_size: int = 0):
+        """
+        Args:
+            handler: callable processing one event payload (e.g., Core.handle_event).
+            workers: number of worker threads.
+            dedupe_window: number of most recent EventIds remembered for detecting redeliveries.
+            max_queue_size: maximum number of payloads queued on each worker, 0 for unbounded queues.
+        """
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.dedupe_window = dedupe_window
+        self.max_queue_size = max_queue_size
+        self._queues = []
+        self._threads = []
+        # payloads queued or being processed on each worker
+        self._loads = []
+        # "Context": [worker index, payloads queued or being processed]
+        self._contexts = {}
+        self._seen_events = OrderedDict()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._metrics = {
+            "submitted": 0,
+            "duplicates": 0,
+            "processed": 0,
+            "failed": 0,
+            "latency_last": 0.0,
+            "latency_max": 0.0,
+            "latency_total": 0.0
+        }
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                worker_queue = queue.Queue(maxsize=self.max_queue_size)
+                thread = threading.Thread(target=self._worker, args=(index, worker_queue),
+                                          name=f"sunfish-events-{index}", daemon=True)
+                self._queues.append(worker_queue)
+                self._loads.append(0)
+                self._threads.append(thread)
+                thread.start()
+
+    def stop(self, timeout: float = None):
+        """Stops the workers once the payloads already queued have been processed."""
+        with self._lock:
+            queues, threads = list(self._queues), list(self._threads)
+        for worker_queue in queues:
+            worker_queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
+        # the routing state is reset only once the workers are done with it
+        with self._lock:
+            self._queues, self._threads = [], []
+            self._loads, self._contexts = [], {}
+
+    def submit(self, payload: dict) -> bool:
+        """Queues an event payload for processing.
+
+        Args:
+            payload (dict): the Event received.
+
+        Returns:
+            bool: True if the payload was queued, False if all its events were already received.
+
+        The EventIds are remembered as soon as the payload is queued, so the redeliveries received while it is
+        processed are dropped, and forgotten if the processing fails, so a later redelivery is processed again.
+        """
+        context = payload.get("Context", "")
+        events = [event for event in payload.get("Events", []) if not self._is_duplicate(context, event)]
+        if payload.get("Events") and not events:
+            with self._lock:
+                self._metrics["duplicates"] += 1
+            logger.debug(f"Dropping redelivered events from '{context}'")
+            return False
+        if len(events) != len(payload.get("Events", [])):
+            payload = dict(payload)
+            payload["Events"] = events
+
+        self.start()
+        with self._lock:
+            self._pending += 1
+            self._metrics["submitted"] += 1
+            assignment = self._contexts.get(context)
+            if assignment is None:
+                worker = min(range(len(self._loads)), key=self._loads.__getitem__)
+                assignment = self._contexts[context] = [worker, 0]
+            assignment[1] += 1
+            self._loads[assignment[0]] += 1
+            worker_queue = self._queues[assignment[0]]
+        worker_queue.put((time.monotonic(), context, payload))
+        return True
+
+    def _is_duplicate(self, context: str, event: dict) -> bool:
+        if "EventId" not in event:
+            return False
+        key = (context, event["EventId"])
+        with self._lock:
+            if key in self._seen_events:
+                self._seen_events.move_to_end(key)
+                return True
+            self._seen_events[key] = None
+            if len(self._seen_events) > self.dedupe_window:
+                self._seen_events.popitem(last=False)
+        return False
+
+    def _worker(self, index: int, worker_queue: queue.Queue):
+        while True:
+            item = worker_queue.get()
+            if item is None:
+                return
+            enqueued_at, context, payload = item
+            failed = False
+            try:
+                self.handler(payload)
+            except BaseException as e:
+                if isinstance(e, (KeyboardInterrupt, SystemExit)):
+                    raise
+                failed = True
+                logger.error(f"Failed processing event payload: {repr(e)}")
+            latency = time.monotonic() - enqueued_at
+            with self._lock:
+                if failed:
+                    for event in payload.get("Events", []):
+                        if "EventId" in event:
+                            self._seen_events.pop((context, event["EventId"]), None)
+                self._metrics["failed" if failed else "processed"] += 1
+                self._metrics["latency_last"] = latency
+                self._metrics["latency_max"] = max(self._metrics["latency_max"], latency)
+                self._metrics["latency_total"] += latency
+                self._pending -= 1
+                if index < len(self._loads) and self._contexts.get(context, [None])[0] == index:
+                    self._loads[index] -= 1
+                    self._contexts[context][1] -= 1
+                    if self._contexts[context][1] == 0:
+                        del self._contexts[context]
+                if self._pending == 0:
+                    self._idle.notify_all()
+
+    def join(self, timeout: float = None) -> bool:
+        """Waits until all the queued payloads have been processed.
+
+        Returns:
+            bool: False if the timeout expired before the queue was drained.
+        """
+        with self._lock:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def metrics(self) -> dict:
+        """Returns the queue depth and processing latency (in seconds) of the pipeline."""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["queue_depth"] = sum(worker_queue.qsize() for worker_queue in self._queues)
+            metrics["in_flight"] = self._pending
+        done = metrics["processed"] + metrics["failed"]
+        metrics["latency_avg"] = metrics.pop("latency_total") / done if done else 0.0
+        return metrics
@@ -0,0 +1,100 @@
+# Copyright IBM Corp. 2024
+# This software is available to you under a BSD 3-Clause License.
+# The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
+
+import logging
+import threading
+import weakref
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class EventRingBuffer:
+    """Bounded buffer of the most recent events, read by the Server-Sent Events (SSE) clients.
+
+    Every published event gets a monotonically increasing id that SSE clients send back in the Last-Event-ID
+    header to resume a stream. Once the buffer is full the oldest events are discarded, a client resuming from
+    an event that is no longer buffered restarts from the oldest event available.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._entries = deque(maxlen=capacity)
+        self._last_id = 0
+        self._cond = threading.Condition()
+        self._readers = 0
+
+    @property
+    def last_id(self) -> int:
+        return self._last_id
+
+    @property
+    def readers(self) -> int:
+        """Number of streams open."""
+        return self._readers
+
+    def publish(self, payload: dict, subscribers=()) -> int:
+        """Appends an event to the buffer and wakes up the waiting clients.
+
+        Args:
+            payload (dict): the Event to be streamed.
+            subscribers: Ids of the SSE subscriptions the event matched.
+
+        Returns:
+            int: the id assigned to the event.
+        """
+        with self._cond:
+            self._last_id += 1
+            self._entries.append((self._last_id, payload, frozenset(subscribers)))
+            self._cond.notify_all()
+            return self._last_id
+
+    def _entries_after(self, event_id: int) -> list:
+        if not self._entries:
+            return []
+        first_id = self._entries[0][0]
+        if event_id < first_id - 1:
+            logger.warning(f"Events {event_id + 1} to {first_id - 1} are no longer available for streaming")
+            event_id = first_id - 1
+        return [self._entries[index] for index in range(event_id - first_id + 1, len(self._entries))]
+
+    def stream(self, subscription_id: str = None, last_event_id=None, timeout: float = None):
+        """Returns a generator of the events, as they are published.
+
+        Args:
+            subscription_id (str): Id of the SSE subscription reading the stream, None to receive every event.
+            last_event_id: value of the Last-Event-ID header sent by the client, None to receive only new events.
+            timeout (float): seconds to wait for a new event before ending the stream, None to wait forever.
+
+        Yields:
+            tuple: (event id, event payload)
+        """
+        try:
+            cursor = int(last_event_id)
+        except (TypeError, ValueError):
+            cursor = self._last_id
+        if cursor > self._last_id:
+            # the client is resuming a stream opened before a restart, send everything still buffered
+            cursor = 0
+        # the starting point is fixed here, so events published before the first read are not lost
+        stream = self._stream(subscription_id, cursor, timeout)
+        # the stream is counted as open until the generator is released, even if it is never read
+        with self._cond:
+            self._readers += 1
+        weakref.finalize(stream, self._release)
+        return stream
+
+    def _release(self):
+        with self._cond:
+            self._readers -= 1
+
+    def _stream(self, subscription_id: str, cursor: int, timeout: float):
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: self._last_id > cursor, timeout):
+                    return
+                entries = self._entries_after(cursor)
+            for event_id, payload, subscribers in entries:
+                cursor = event_id
+                if subscription_id is None or subscription_id in subscribers:
+                    yield event_id, payload
@@ -3,11 +3,20 @@
 # The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
 
 import json
+import logging
 import os
 import string
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 from sunfish.events.subscription_handler_interface import SubscriptionHandlerInterface
 from sunfish.lib.exceptions import *
+from sunfish.lib.file_lock import FileLock
+
+logger = logging.getLogger(__name__)
 
 # Missing:
 ## EventType not handle because Event is considered as the only value for the property
@@ -16,33 +25,406 @@ from sunfish.lib.exceptions import *
 ## Heartbeat events
 ## IncludeOriginOfCondition
 
-subscriptions = {
-    "RegistryPrefixes": {
-        # "RegistryPrefix": {
-        # "to_send": [ ],
-        # "exclude": [ ]
-        # }, ...
-    },
-    "MessageIds": {
-        # "ResourceEvent": {
-        # "to_send": [ ],
-        # "exclude": [ ]
-        # }, ...
-    },
-    "ResourceTypes": {
-        # "Type": [
-        #    "id_1",
-        #    "id_n"
-        # ], ...
-    },
-    #  if "SubordinateResources": true -> save OriginResource with /* at the end
-    "OriginResources": {
-        # "OriginResource": [
-        #    "id_1",
-        #    "id_n"
-        # ], ...
-    }
-}
+# properties of the EventDestination objects needed for routing and delivering the events
+ROUTING_PROPERTIES = ["Id", "Destination", "Context", "HttpHeaders", "SubscriptionType", "Status", "RegistryPrefixes",
+                      "ExcludeRegistryPrefixes", "MessageIds", "ExcludeMessageIds", "ResourceTypes", "OriginResources",
+                      "SubordinateResources"]
+
+
+# files modified within this time (in nanoseconds) from when their version was recorded may be modified again
+# without changing their mtime, so their version is not trusted
+RACY_WINDOW_NS = 2 * 10 ** 9
+
+
+def file_version(stat: os.stat_result) -> list:
+    """Returns the version of a file used to detect its changes, None if the version can't be trusted yet."""
+    if stat.st_mtime_ns > time.time_ns() - RACY_WINDOW_NS:
+        return None
+    return [stat.st_ino, stat.st_mtime_ns, stat.st_size]
+
+
+def routing_properties(payload: dict) -> dict:
+    """Returns the compact form of an EventDestination object, holding only the ROUTING_PROPERTIES."""
+    return {key: payload[key] for key in ROUTING_PROPERTIES if key in payload}
+
+
+class SubscriptionRoutingTable:
+    """Compiled form of the subscriptions used for routing the incoming events.
+
+    Every subscription is assigned a dense integer slot, and every routing key (RegistryPrefix, MessageId,
+    ResourceType and OriginResource) is mapped to a bitset, stored as a python int, where the bits of the
+    subscriptions interested in that key are set. Routing an event is then reduced to a handful of ORs and
+    AND-NOTs over these bitsets, no matter how many subscriptions are registered.
+    """
+
+    def __init__(self):
+        self._slots = {}  # subscription Id -> slot
+        self._ids = []  # slot -> subscription Id (None if the slot is free)
+        self._free_slots = []
+        # "key": [to_send, exclude]
+        self.registry_prefixes = {}
+        self.message_ids = {}
+        # "key": to_send
+        self.resource_types = {}
+        self.origin_resources = {}
+        # OriginResources of the subscriptions with "SubordinateResources": true
+        self.subordinate_resources = {}
+        # subscriptions delivered through Server-Sent Events instead of HTTP POST
+        self.sse = 0
+        # reverse index, so a subscription is removed by visiting only its own keys
+        # subscription Id -> {("table name", "key"), ...}
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, sub_id):
+        return sub_id in self._slots
+
+    def _allocate_slot(self, sub_id) -> int:
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._ids[slot] = sub_id
+        else:
+            slot = len(self._ids)
+            self._ids.append(sub_id)
+        self._slots[sub_id] = slot
+        return slot
+
+    def add(self, sub_id, payload: dict):
+        """Compiles the subscription into the routing bitsets.
+
+        Args:
+            sub_id (str): Id of the subscription.
+            payload (dict): the EventDestination object.
+        """
+        if sub_id in self._slots:
+            self.remove(sub_id)
+        bit = 1 << self._allocate_slot(sub_id)
+        keys = self._keys[sub_id] = set()
+
+        for prefix in payload.get("RegistryPrefixes", []):
+            self.registry_prefixes.setdefault(prefix, [0, 0])[0] |= bit
+            keys.add(("registry_prefixes", prefix))
+        for prefix in payload.get("ExcludeRegistryPrefixes", []):
+            self.registry_prefixes.setdefault(prefix, [0, 0])[1] |= bit
+            keys.add(("registry_prefixes", prefix))
+        for msg_id in payload.get("MessageIds", []):
+            self.message_ids.setdefault(msg_id, [0, 0])[0] |= bit
+            keys.add(("message_ids", msg_id))
+        for msg_id in payload.get("ExcludeMessageIds", []):
+            self.message_ids.setdefault(msg_id, [0, 0])[1] |= bit
+            keys.add(("message_ids", msg_id))
+        for resource_type in payload.get("ResourceTypes", []):
+            self.resource_types[resource_type] = self.resource_types.get(resource_type, 0) | bit
+            keys.add(("resource_types", resource_type))
+        if payload.get("SubscriptionType") == "SSE":
+            self.sse |= bit
+
+        if payload.get("SubordinateResources"):
+            table_name = "subordinate_resources"
+        else:
+            table_name = "origin_resources"
+        origins = getattr(self, table_name)
+        for origin in payload.get("OriginResources", []):
+            origin = origin["@odata.id"].rstrip('/')
+            origins[origin] = origins.get(origin, 0) | bit
+            keys.add((table_name, origin))
+
+    def remove(self, sub_id):
+        """Removes the subscription from its routing bitsets and frees its slot.
+
+        Args:
+            sub_id (str): Id of the subscription.
+        """
+        slot = self._slots.pop(sub_id, None)
+        if slot is None:
+            return
+        bit = 1 << slot
+        for table_name, key in self._keys.pop(sub_id):
+            table = getattr(self, table_name)
+            if isinstance(table[key], list):
+                table[key][0] &= ~bit
+                table[key][1] &= ~bit
+                if table[key] == [0, 0]:
+                    del table[key]
+            else:
+                table[key] &= ~bit
+                if table[key] == 0:
+                    del table[key]
+        self.sse &= ~bit
+        self._ids[slot] = None
+        self._free_slots.append(slot)
+
+    def match(self, message_id: str, resource_type: str = None, origin: str = None) -> int:
+        """Computes the bitset of the subscriptions interested in an event.
+
+        Args:
+            message_id (str): MessageId of the event.
+            resource_type (str): type of the event's OriginOfCondition, if any.
+            origin (str): @odata.id of the event's OriginOfCondition, if any.
+
+        Returns:
+            int: bitset of the matching subscriptions' slots.
+        """
+        to_send = 0
+        exclude = 0
+        prefix_masks = self.registry_prefixes.get(message_id.split('.')[0])
+        if prefix_masks:
+            to_send |= prefix_masks[0]
+            exclude |= prefix_masks[1]
+        msg_masks = self.message_ids.get(message_id)
+        if msg_masks:
+            to_send |= msg_masks[0]
+            exclude |= msg_masks[1]
+        if resource_type is not None:
+            to_send |= self.resource_types.get(resource_type, 0)
+        if origin is not None:
+            node = origin.rstrip('/')
+            to_send |= self.origin_resources.get(node, 0)
+            # SubordinateResources subscriptions match the origin and all the resources below it
+            while node:
+                to_send |= self.subordinate_resources.get(node, 0)
+                node = node.rsplit('/', 1)[0]
+        return to_send & ~exclude
+
+    def mask(self, sub_id) -> int:
+        """Returns the bitset containing only the given subscription, 0 if the subscription is not registered."""
+        slot = self._slots.get(sub_id)
+        return 0 if slot is None else 1 << slot
+
+    def ids(self, mask: int) -> list:
+        """Translates a bitset back into the list of subscription Ids."""
+        ids = []
+        while mask:
+            low_bit = mask & -mask
+            ids.append(self._ids[low_bit.bit_length() - 1])
+            mask ^= low_bit
+        return ids
+
+
+class SubscriptionRegistry:
+    """Subscriptions known to a subscription handler, compiled for routing and delivering the events.
+
+    The registry is owned by one handler instance and can be used concurrently by multiple threads: the updates
+    are serialized and the routing never observes a subscription half registered.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # "Id": EventDestination object, restricted to the ROUTING_PROPERTIES
+        self.subscriptions = {}
+        self.routing_table = SubscriptionRoutingTable()
+        # delivery details of every subscription, so forwarding the events needs no storage reads
+        # "Id": {"Destination": ..., "Context": ..., "HttpHeaders": {...}}
+        self.records = {}
+        # "Destination": {"Id_1", "Id_n"}
+        self.destinations = {}
+
+    def __len__(self):
+        with self._lock:
+            self._sync()
+            return len(self.subscriptions)
+
+    def __contains__(self, id):
+        with self._lock:
+            self._sync()
+            return id in self.subscriptions
+
+    @contextmanager
+    def transaction(self):
+        """Groups several updates, other threads don't see the registry until all of them are applied."""
+        with self._lock:
+            yield self
+
+    def _sync(self):
+        # private registries are always up to date
+        pass
+
+    def _reset(self):
+        self.subscriptions = {}
+        self.routing_table = SubscriptionRoutingTable()
+        self.records = {}
+        self.destinations = {}
+
+    def _index(self, payload: dict):
+        id = payload["Id"]
+        self._unindex(id)
+        self.subscriptions[id] = routing_properties(payload)
+        headers = {}
+        # HttpHeaders is an array of objects, each one containing one or more headers
+        for header in payload.get("HttpHeaders", []):
+            headers.update(header)
+        destination = payload.get("Destination", "")
+        self.records[id] = {
+            "Destination": destination,
+            "Context": payload.get("Context", ""),
+            "HttpHeaders": headers
+        }
+        self.destinations.setdefault(destination, set()).add(id)
+        if payload.get("Status", {}).get("State") not in ["Disabled", "StandbyOffline"]:
+            # suspended subscriptions are not sent any event until they are enabled again
+            self.routing_table.add(id, payload)
+
+    def _unindex(self, id):
+        self.routing_table.remove(id)
+        self.subscriptions.pop(id, None)
+        record = self.records.pop(id, None)
+        if record is not None:
+            ids = self.destinations[record["Destination"]]
+            ids.discard(id)
+            if not ids:
+                del self.destinations[record["Destination"]]
+
+    def add(self, payload: dict):
+        """Registers a subscription, replacing the one with the same Id if any.
+
+        Args:
+            payload (dict): the EventDestination object.
+        """
+        with self.transaction():
+            self._index(payload)
+
+    def remove(self, id):
+        with self.transaction():
+            self._unindex(id)
+
+    def clear(self):
+        """Removes all the subscriptions."""
+        with self.transaction():
+            self._reset()
+
+    def suspend(self, id, status: dict):
+        """Stops routing events to a subscription and records its new Status."""
+        with self.transaction():
+            if id not in self.subscriptions:
+                return
+            payload = dict(self.subscriptions[id])
+            payload["Status"] = status
+            self._index(payload)
+
+    def get(self, id) -> dict:
+        """Returns the routing properties of a subscription.
+
+        Raises:
+            ResourceNotFound: if the subscription is not registered.
+        """
+        with self._lock:
+            self._sync()
+            if id not in self.subscriptions:
+                raise ResourceNotFound(id)
+            return self.subscriptions[id]
+
+    def get_record(self, id) -> dict:
+        """Returns the delivery details (Destination, Context and HttpHeaders) of a subscription.
+
+        Raises:
+            ResourceNotFound: if the subscription is not registered.
+        """
+        with self._lock:
+            self._sync()
+            if id not in self.records:
+                raise ResourceNotFound(id)
+            return self.records[id]
+
+    def find_destination_context(self, destination: str) -> str:
+        with self._lock:
+            self._sync()
+            for id in self.destinations.get(destination, []):
+                if self.records[id]["Context"]:
+                    return self.records[id]["Context"]
+            return ""
+
+    def has_sse(self) -> bool:
+        """Checks if any Server-Sent Events subscription is routed events."""
+        with self._lock:
+            self._sync()
+            return self.routing_table.sse != 0
+
+    def match(self, message_id: str, resource_type: str = None, origin: str = None, sse: bool = False) -> list:
+        """Finds the Ids of the subscriptions interested in an event.
+
+        Args:
+            message_id (str): MessageId of the event.
+            resource_type (str): type of the event's OriginOfCondition, if any.
+            origin (str): @odata.id of the event's OriginOfCondition, if any.
+            sse (bool): True to match the Server-Sent Events subscriptions, False to match the other ones.
+
+        Returns:
+            list: Ids of the matching subscriptions.
+        """
+        with self._lock:
+            self._sync()
+            table = self.routing_table
+            mask = table.match(message_id, resource_type=resource_type, origin=origin)
+            return table.ids(mask & table.sse if sse else mask & ~table.sse)
+
+
+class SharedSubscriptionRegistry(SubscriptionRegistry):
+    """Subscription registry shared by all the worker processes of a deployment through a file.
+
+    Updates are applied under an inter-process lock and the file is replaced atomically. Before routing an event
+    every process checks if the file changed and, if so, recompiles its routing table from the routing
+    properties stored in the file, without reparsing the subscription objects. Every update stores a new
+    generation in the file, so the changes are detected also when they don't alter the file's inode, mtime or
+    size (e.g., two updates within the mtime granularity of the filesystem).
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: file holding the shared registry.
+        """
+        super().__init__()
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file_lock = FileLock(f"{path}.lock")
+        self._version = None
+        self._generation = None
+        self._depth = 0
+
+    @contextmanager
+    def transaction(self):
+        with self._lock, self._file_lock:
+            self._depth += 1
+            try:
+                if self._depth == 1:
+                    self._sync()
+                yield self
+            except BaseException:
+                # reload the last consistent registry before the next use
+                self._version = None
+                self._generation = None
+                raise
+            finally:
+                self._depth -= 1
+            if self._depth == 0:
+                self._store()
+
+    def _sync(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if self._version is not None and file_version(stat) == self._version:
+            return
+        with open(self.path, 'r') as registry_file:
+            content = json.load(registry_file)
+        generation = content.get("Generation")
+        if generation is None or generation != self._generation:
+            self._reset()
+            for payload in content.get("Subscriptions", {}).values():
+                self._index(payload)
+            self._generation = generation
+        self._version = file_version(stat)
+
+    def _store(self):
+        self._generation = uuid.uuid4().hex
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as registry_file:
+            json.dump({"Generation": self._generation, "Subscriptions": self.subscriptions}, registry_file)
+        os.replace(tmp_path, self.path)
+        self._version = file_version(os.stat(self.path))
 
 
 class RedfishSubscriptionHandler(SubscriptionHandlerInterface):
@@ -58,87 +440,106 @@ class RedfishSubscriptionHandler(SubscriptionHandlerInterface):
         self.fs_root = core.conf["backend_conf"]["fs_root"]
         self.subscribers_root = core.conf["backend_conf"]["subscribers_root"]
         self.backend = core.storage_backend
+        # The "subscription_registry" section of the configuration enables a registry shared by all the worker
+        # processes of the deployment, by default every handler has its own.
+        registry_conf = core.conf.get("subscription_registry", {})
+        if registry_conf.get("shared", False):
+            registry_path = registry_conf.get("path", os.path.join(os.getcwd(), core.conf["backend_conf"]["fs_private"],
+                                                                   "subscriptions_registry.json"))
+            self.registry = SharedSubscriptionRegistry(registry_path)
+        else:
+            self.registry = SubscriptionRegistry()
+        # At startup the subscriptions are read by a pool of threads. Their routing properties are saved in a
+        # snapshot so the following restarts parse only the subscriptions modified in the meantime.
+        self.load_workers = registry_conf.get("load_workers", 8)
+        self.snapshot_path = None
+        if registry_conf.get("snapshot", True):
+            self.snapshot_path = registry_conf.get("snapshot_path", os.path.join(
+                os.getcwd(), core.conf["backend_conf"]["fs_private"], "subscriptions_snapshot.json"))
         self.load_subscriptions()
 
+    @property
+    def routing_table(self) -> SubscriptionRoutingTable:
+        return self.registry.routing_table
+
     # Loads the subscriptions already stored
     def load_subscriptions(self):
         path = os.path.join(os.getcwd(), self.fs_root, self.subscribers_root)
-        if not os.path.exists(path):
-            return
-        dirs = os.listdir(path)
-        for sub in dirs:
-            sub_path = ''
-            if os.path.isdir(os.path.join(path, sub)):
-                try:
-                    sub_path = os.path.join(path, sub, 'index.json')
-                    json_data = open(sub_path)
-                    data: json = json.load(json_data)
-                    self.new_subscription(data)
-                except FileNotFoundError as e:
-                    raise ResourceNotFound(sub_path)
+        with self.registry.transaction():
+            # the registry is always rebuilt from the stored subscriptions, so a shared registry left by a previous
+            # run doesn't keep the subscriptions deleted in the meantime
+            self.registry.clear()
+            if not os.path.exists(path):
+                return
+            snapshot = self._read_snapshot()
+            # "subscription folder": {"Version": [inode, mtime, size], "Subscription": {routing properties}}
+            entries = {}
+            to_parse = []
+            with os.scandir(path) as dirs:
+                for sub in dirs:
+                    if not sub.is_dir():
+                        continue
+                    sub_path = os.path.join(sub.path, 'index.json')
+                    try:
+                        stat = os.stat(sub_path)
+                    except FileNotFoundError:
+                        raise ResourceNotFound(sub_path)
+                    # a subscription whose version can't be trusted yet is parsed again at the next startup too
+                    version = file_version(stat)
+                    if version is not None and sub.name in snapshot and snapshot[sub.name]["Version"] == version:
+                        entries[sub.name] = snapshot[sub.name]
+                    else:
+                        to_parse.append((sub.name, sub_path, version))
+
+            if to_parse:
+                with ThreadPoolExecutor(max_workers=self.load_workers) as executor:
+                    for name, version, payload in executor.map(self._read_subscription, to_parse):
+                        # check if sub has colliding properties
+                        if self.validate_subscription(payload) is False:
+                            raise IllegalSubscription
+                        entries[name] = {"Version": version, "Subscription": routing_properties(payload)}
+
+            for name in sorted(entries):
+                self.registry.add(entries[name]["Subscription"])
+            if to_parse or len(entries) != len(snapshot):
+                self._write_snapshot(entries)
         return
 
+    @staticmethod
+    def _read_subscription(item) -> tuple:
+        name, sub_path, version = item
+        try:
+            with open(sub_path, 'r') as json_data:
+                return name, version, json.load(json_data)
+        except FileNotFoundError:
+            raise ResourceNotFound(sub_path)
+
+    def _read_snapshot(self) -> dict:
+        if self.snapshot_path is None:
+            return {}
+        try:
+            with open(self.snapshot_path, 'r') as snapshot_file:
+                return json.load(snapshot_file)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning(f"Ignoring the corrupted subscriptions snapshot {self.snapshot_path}")
+            return {}
+
+    def _write_snapshot(self, entries: dict):
+        if self.snapshot_path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_path)), exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as snapshot_file:
+            json.dump(entries, snapshot_file)
+        os.replace(tmp_path, self.snapshot_path)
+
     def new_subscription(self, payload: dict):
         # check if sub has colliding properties
         if self.validate_subscription(payload) is False:
             raise IllegalSubscription
-
-        if "RegistryPrefixes" in payload:
-            for prefix in payload["RegistryPrefixes"]:
-                if prefix in subscriptions["RegistryPrefixes"]:
-                    subscriptions["RegistryPrefixes"][prefix]["to_send"].append(payload["Id"])
-                else:
-                    subscriptions["RegistryPrefixes"][prefix] = {
-                        "to_send": [payload["Id"]],
-                        "exclude": []
-                    }
-
-        if "ExcludeRegistryPrefixes" in payload:
-            for exclude_prefix in payload["ExcludeRegistryPrefixes"]:
-                if exclude_prefix in subscriptions["RegistryPrefixes"]:
-                    subscriptions["RegistryPrefixes"][exclude_prefix]["exclude"].append(payload["Id"])
-                else:
-                    subscriptions["RegistryPrefixes"][exclude_prefix] = {
-                        "to_send": [],
-                        "exclude": [payload["Id"]]
-                    }
-
-        if "MessageIds" in payload:
-            for msgId in payload["MessageIds"]:
-                if msgId in subscriptions["MessageIds"]:
-                    subscriptions["MessageIds"][msgId]["to_send"].append(payload["Id"])
-                else:
-                    subscriptions["MessageIds"][msgId] = {
-                        "to_send": [payload["Id"]],
-                        "exclude": []
-                    }
-
-        if "ExcludeMessageIds" in payload:
-            for exclude_msgId in payload["ExcludeMessageIds"]:
-                if exclude_msgId in subscriptions["MessageIds"]:
-                    subscriptions["MessageIds"][exclude_msgId]["exclude"].append(payload["Id"])
-                else:
-                    subscriptions["MessageIds"][exclude_msgId] = {
-                        "to_send": [],
-                        "exclude": [payload["Id"]]
-                    }
-
-        if "OriginResources" in payload:
-            for prefix in payload["OriginResources"]:
-                origin = prefix["@odata.id"]
-                if "SubordinateResources" in payload and payload["SubordinateResources"]:
-                    origin = os.path.join(origin, '*')
-                if origin in subscriptions["OriginResources"]:
-                    subscriptions["OriginResources"][origin].append(payload["Id"])
-                else:
-                    subscriptions["OriginResources"][origin] = [payload["Id"]]
-
-        if "ResourceTypes" in payload:
-            for type in payload["ResourceTypes"]:
-                if type in subscriptions["ResourceTypes"]:
-                    subscriptions["ResourceTypes"][type].append(payload["Id"])
-                else:
-                    subscriptions["ResourceTypes"][type] = [payload["Id"]]
+        self.registry.add(payload)
         return
 
     def validate_subscription(self, payload: dict):
@@ -168,22 +569,97 @@ class RedfishSubscriptionHandler(SubscriptionHandlerInterface):
                             check = False
         return check
 
+    def get_subscription(self, id):
+        """Returns the delivery details (Destination, Context and HttpHeaders) of a subscription.
+
+        Raises:
+            ResourceNotFound: if the subscription is not registered.
+        """
+        return self.registry.get_record(id)
+
+    def find_destination_context(self, destination: str) -> str:
+        """Returns the Context of the subscriptions to the given Destination, an empty string if there is none."""
+        return self.registry.find_destination_context(destination)
+
+    def route(self, message_id: str, resource_type: str = None, origin: str = None) -> list:
+        """Finds the Ids of the subscribers interested in an event.
+
+        Args:
+            message_id (str): MessageId of the event.
+            resource_type (str): type of the event's OriginOfCondition, if any.
+            origin (str): @odata.id of the event's OriginOfCondition, if any.
+
+        Returns:
+            list: Ids of the subscriptions the event has to be forwarded to.
+        """
+        return self.registry.match(message_id, resource_type=resource_type, origin=origin)
+
+    def route_sse(self, message_id: str, resource_type: str = None, origin: str = None) -> list:
+        """Finds the Ids of the Server-Sent Events subscribers ("SubscriptionType": "SSE") interested in an event.
+
+        Args:
+            message_id (str): MessageId of the event.
+            resource_type (str): type of the event's OriginOfCondition, if any.
+            origin (str): @odata.id of the event's OriginOfCondition, if any.
+
+        Returns:
+            list: Ids of the SSE subscriptions the event has to be streamed to.
+        """
+        return self.registry.match(message_id, resource_type=resource_type, origin=origin, sse=True)
+
+    def has_sse_subscriptions(self) -> bool:
+        """Checks if any enabled subscription is delivered through Server-Sent Events."""
+        return self.registry.has_sse()
+
+    def event_filter(self, subscription):
+        """Builds a filter selecting the events a subscription is interested in, e.g. for replaying the events journal.
+
+        Args:
+            subscription: Id of a registered subscription, or an EventDestination object with the filtering properties
+                (RegistryPrefixes, MessageIds, ResourceTypes, OriginResources, ...).
+
+        Returns:
+            callable: function receiving an event and returning True if it matches the subscription.
+        """
+        if isinstance(subscription, dict):
+            if self.validate_subscription(subscription) is False:
+                raise IllegalSubscription
+        else:
+            subscription = self.registry.get(subscription)
+        # the filter has its own table, so it is not affected by later changes of the registry
+        table = SubscriptionRoutingTable()
+        table.add("filter", subscription)
+        types = {}
+
+        def matches(event: dict) -> bool:
+            type = None
+            origin = None
+            if "OriginOfCondition" in event:
+                origin = event["OriginOfCondition"]["@odata.id"]
+                if origin not in types:
+                    try:
+                        types[origin] = self.core.event_handler.check_data_type(origin)
+                    except ResourceNotFound:
+                        # the resource has been removed since the event was received
+                        types[origin] = None
+                type = types[origin]
+            return bool(table.match(event["MessageId"], resource_type=type, origin=origin))
+
+        return matches
+
+    def suspend_subscription(self, id):
+        """Stops routing events to a subscription and marks it as suspended ("State": "StandbyOffline").
+        The subscription is resumed by setting its State back to "Enabled".
+        """
+        status = {"State": "StandbyOffline", "Health": "Critical"}
+        self.registry.suspend(id, status)
+        path = os.path.join(self.redfish_root, 'EventService', 'Subscriptions', id)
+        try:
+            self.backend.patch(path, {"Status": status})
+        except ResourceNotFound:
+            pass
+
     # Deletes from the subscriptions data structure the ID of the subs deleted
     def delete_subscription(self, id):
-        for prefix in subscriptions["OriginResources"]:
-            if id in subscriptions["OriginResources"][prefix]:
-                subscriptions["OriginResources"][prefix].remove(id)
-        for prefix in subscriptions["ResourceTypes"]:
-            if id in subscriptions["ResourceTypes"][prefix]:
-                subscriptions["ResourceTypes"][prefix].remove(id)
-        for prefix in subscriptions["RegistryPrefixes"]:
-            if id in subscriptions["RegistryPrefixes"][prefix]["to_send"]:
-                subscriptions["RegistryPrefixes"][prefix]["to_send"].remove(id)
-            if id in subscriptions["RegistryPrefixes"][prefix]["exclude"]:
-                subscriptions["RegistryPrefixes"][prefix]["exclude"].remove(id)
-        for prefix in subscriptions["MessageIds"]:
-            if id in subscriptions["MessageIds"][prefix]["to_send"]:
-                subscriptions["MessageIds"][prefix]["to_send"].remove(id)
-            if id in subscriptions["MessageIds"][prefix]["exclude"]:
-                subscriptions["MessageIds"][prefix]["exclude"].remove(id)
+        self.registry.remove(id)
         return
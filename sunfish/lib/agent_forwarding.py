@@ -0,0 +1,219 @@
+# Copyright IBM Corp. 2024
+# This software is available to you under a BSD 3-Clause License.
+# The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from sunfish.lib.exceptions import AgentForwardingFailure
+
+logger = logging.getLogger(__name__)
+
+
+class AgentLimiter:
+    """Admission control for the requests sent to one agent.
+
+    At most max_concurrent requests are in flight at the same time, the following ones wait in a queue of at most
+    max_queued requests and are rejected when the queue is full. If a rate is set, requests are also spaced out
+    by a token bucket allowing bursts of burst requests.
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_queued: int = 64, rate: float = None, burst: int = 1,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queued = max_queued
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        # requests submitted asynchronously waiting for a free slot
+        self._pending = deque()
+        self._bucket_lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = clock()
+
+    def acquire(self, timeout: float = None):
+        """Waits for a free slot.
+
+        Raises:
+            AgentForwardingFailure: if the queue is full or the timeout expires.
+        """
+        with self._cond:
+            if self.active >= self.max_concurrent:
+                if self.waiting >= self.max_queued:
+                    raise AgentForwardingFailure("queueing request", 503, "Too many requests queued for the agent")
+                self.waiting += 1
+                try:
+                    if not self._cond.wait_for(lambda: self.active < self.max_concurrent, timeout):
+                        raise AgentForwardingFailure("queueing request", 503, "Timed out waiting for the agent")
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+        self.take_token()
+
+    def enqueue(self, item) -> bool:
+        """Takes a free slot for an asynchronous request, or queues the request if there is none.
+
+        Raises:
+            AgentForwardingFailure: if the queue is full.
+
+        Returns:
+            bool: True if the request got a slot and can be started, False if it was queued.
+        """
+        with self._cond:
+            if self.active < self.max_concurrent:
+                self.active += 1
+                return True
+            if self.waiting >= self.max_queued:
+                raise AgentForwardingFailure("queueing request", 503, "Too many requests queued for the agent")
+            self.waiting += 1
+            self._pending.append(item)
+            return False
+
+    def release(self):
+        """Frees a slot.
+
+        Returns:
+            the queued asynchronous request taking over the slot, None if there is none.
+        """
+        with self._cond:
+            if self._pending:
+                self.waiting -= 1
+                return self._pending.popleft()
+            self.active -= 1
+            self._cond.notify()
+            return None
+
+    def take_token(self):
+        if not self.rate:
+            return
+        with self._bucket_lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # the token is reserved right away, the request waits until it is actually available
+            self._tokens -= 1
+            delay = 0 if self._tokens >= 0 else -self._tokens / self.rate
+        if delay:
+            self._sleep(delay)
+
+    def status(self) -> dict:
+        with self._cond:
+            return {"Active": self.active, "Queued": self.waiting}
+
+
+class AgentForwardingExecutor:
+    """Executes the requests forwarded to the agents, limiting the load put on every agent.
+
+    Each agent has its own AgentLimiter, so a burst of requests against one agent is queued without delaying the
+    requests to the other agents. Requests can be executed synchronously in the calling thread (run), submitted
+    to a pool of threads (submit) or awaited by asyncio callers (run_async).
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_queued: int = 64, rate: float = None, burst: int = 1,
+                 queue_timeout: float = None, workers: int = 16):
+        """
+        Args:
+            max_concurrent: maximum number of requests in flight to the same agent.
+            max_queued: maximum number of requests waiting for the same agent.
+            rate: maximum number of requests per second sent to the same agent, None for no limit.
+            burst: number of requests that can be sent at once before the rate limit applies.
+            queue_timeout: seconds a request can wait for the agent before failing, None to wait forever.
+            workers: number of threads executing the requests submitted asynchronously.
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.rate = rate
+        self.burst = burst
+        self.queue_timeout = queue_timeout
+        self.workers = workers
+        self._limiters = {}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def limiter(self, agent_id: str) -> AgentLimiter:
+        with self._lock:
+            if agent_id not in self._limiters:
+                self._limiters[agent_id] = AgentLimiter(self.max_concurrent, self.max_queued, self.rate, self.burst)
+            return self._limiters[agent_id]
+
+    def run(self, agent_id: str, function, *args, **kwargs):
+        """Executes a request to an agent in the calling thread, once the agent can accept it.
+
+        Args:
+            agent_id (str): @odata.id of the AggregationSource of the agent.
+            function: callable sending the request (e.g., Agent.forward_request).
+
+        Raises:
+            AgentForwardingFailure: if the request cannot be queued for the agent, or the request itself fails.
+
+        Returns:
+            the result of function.
+        """
+        limiter = self.limiter(agent_id)
+        limiter.acquire(self.queue_timeout)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self._release(limiter)
+
+    def submit(self, agent_id: str, function, *args, **kwargs) -> Future:
+        """Submits a request to an agent to the pool of threads.
+        The requests waiting for a busy agent are kept in its queue, so they don't hold any thread of the pool.
+
+        Raises:
+            AgentForwardingFailure: if the queue of the agent is full.
+
+        Returns:
+            concurrent.futures.Future: the future result of function.
+        """
+        limiter = self.limiter(agent_id)
+        item = (Future(), function, args, kwargs)
+        if limiter.enqueue(item):
+            self._start(limiter, item)
+        return item[0]
+
+    def _start(self, limiter: AgentLimiter, item):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sunfish-agents")
+            pool = self._pool
+        pool.submit(self._execute, limiter, item)
+
+    def _execute(self, limiter: AgentLimiter, item):
+        future, function, args, kwargs = item
+        if future.set_running_or_notify_cancel():
+            try:
+                limiter.take_token()
+                future.set_result(function(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+        self._release(limiter)
+
+    def _release(self, limiter: AgentLimiter):
+        next_item = limiter.release()
+        if next_item is not None:
+            self._start(limiter, next_item)
+
+    async def run_async(self, agent_id: str, function, *args, **kwargs):
+        """Coroutine executing a request to an agent without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(agent_id, function, *args, **kwargs))
+
+    def status(self) -> dict:
+        """Returns the number of requests in flight and queued for every agent."""
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {agent_id: limiter.status() for agent_id, limiter in limiters.items()}
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
@@ -0,0 +1,133 @@
+# Copyright IBM Corp. 2024
+# This software is available to you under a BSD 3-Clause License.
+# The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
+
+import logging
+import threading
+
+import requests
+
+from sunfish.lib.circuit_breaker import CircuitBreaker
+from sunfish.lib.exceptions import AgentForwardingFailure
+
+logger = logging.getLogger(__name__)
+
+
+class AgentHealthMonitor:
+    """Tracks the health of the agents (aggregation sources) with a circuit breaker per agent.
+
+    The breakers are updated passively with the outcome of the requests forwarded to the agents and actively by
+    a background thread probing the service root of every known agent every probe_period seconds. Requests to an
+    agent whose breaker is open fail immediately instead of waiting for the connection to time out, and the breaker
+    closes again as soon as a request or a probe to the agent succeeds.
+    """
+
+    def __init__(self, failure_threshold: int = 3, error_window: float = 60.0, probe_interval: float = 30.0,
+                 probe_period: float = 30.0, probe_timeout: float = 5.0, redfish_root: str = "/redfish/v1/"):
+        """
+        Args:
+            failure_threshold: failures within error_window seconds after which an agent is considered down.
+            error_window: seconds the failures are counted for.
+            probe_interval: seconds after which a request is let through to an agent considered down.
+            probe_period: seconds between two active probes of the agents, 0 to disable the active probes.
+            probe_timeout: timeout in seconds of the active probes.
+            redfish_root: path of the service root requested by the active probes.
+        """
+        self.failure_threshold = failure_threshold
+        self.error_window = error_window
+        self.probe_interval = probe_interval
+        self.probe_period = probe_period
+        self.probe_timeout = probe_timeout
+        self.redfish_root = redfish_root
+        self._breakers = {}
+        # "agent @odata.id": HostName
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def breaker(self, agent_id: str) -> CircuitBreaker:
+        with self._lock:
+            if agent_id not in self._breakers:
+                self._breakers[agent_id] = CircuitBreaker(self.failure_threshold, self.error_window,
+                                                          self.probe_interval)
+            return self._breakers[agent_id]
+
+    def track(self, agent_id: str, hostname: str):
+        """Adds an agent to the ones actively probed."""
+        with self._lock:
+            self._hosts[agent_id] = hostname
+            start = self.probe_period and self._thread is None
+            if start:
+                self._thread = threading.Thread(target=self._probe_loop, name="sunfish-agents-health", daemon=True)
+        if start:
+            self._thread.start()
+
+    def untrack(self, agent_id: str):
+        """Stops probing an agent and drops its breaker, e.g. after the agent is removed."""
+        with self._lock:
+            self._hosts.pop(agent_id, None)
+            self._breakers.pop(agent_id, None)
+
+    def check(self, agent_id: str):
+        """Checks that a request can be sent to an agent.
+
+        Raises:
+            AgentForwardingFailure: if the agent is considered down.
+        """
+        if not self.breaker(agent_id).allow_request():
+            raise AgentForwardingFailure(f"forwarding request to {agent_id}", 503, "The agent is unreachable")
+
+    def release_probe(self, agent_id: str):
+        """Releases the probe let through by check when the outcome of the request is not recorded."""
+        self.breaker(agent_id).release_probe()
+
+    def record_success(self, agent_id: str):
+        breaker = self.breaker(agent_id)
+        if breaker.state != CircuitBreaker.CLOSED:
+            logger.info(f"Agent {agent_id} is reachable again")
+        breaker.record_success()
+
+    def record_failure(self, agent_id: str):
+        breaker = self.breaker(agent_id)
+        breaker.record_failure()
+        if breaker.state == CircuitBreaker.OPEN:
+            logger.warning(f"Agent {agent_id} is unreachable, failing the requests to it")
+
+    def probe(self, agent_id: str) -> bool:
+        """Sends a lightweight request (GET of the service root) to an agent and records the outcome."""
+        with self._lock:
+            hostname = self._hosts.get(agent_id)
+        if hostname is None:
+            return False
+        try:
+            r = requests.get(f"{hostname}{self.redfish_root}", timeout=self.probe_timeout)
+            healthy = r.status_code < 500
+        except requests.exceptions.RequestException:
+            healthy = False
+        if healthy:
+            self.record_success(agent_id)
+        else:
+            self.record_failure(agent_id)
+        return healthy
+
+    def _probe_loop(self):
+        while not self._stop.wait(self.probe_period):
+            with self._lock:
+                agents = list(self._hosts)
+            for agent_id in agents:
+                self.probe(agent_id)
+
+    def stop(self, timeout: float = None):
+        """Stops the active probes."""
+        self._stop.set()
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def status(self) -> dict:
+        """Returns the circuit breaker status of every agent."""
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {agent_id: breaker.status() for agent_id, breaker in breakers.items()}
@@ -0,0 +1,150 @@
+# Copyright IBM Corp. 2024
+# This software is available to you under a BSD 3-Clause License.
+# The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
+
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import weakref
+
+from sunfish.lib.uri_translator import URITranslator
+
+logger = logging.getLogger(__name__)
+
+# open databases, whose pending changes are written when the interpreter exits
+_open_databases = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_at_exit():
+    for alias_db in list(_open_databases):
+        try:
+            alias_db.flush()
+        except OSError as e:
+            logger.error(f"could not write the alias file {alias_db.path}: {e}")
+
+
+class AliasDB:
+    """Database of the URIs renamed by Sunfish (aliases) and of the boundary ports of the agents.
+
+    The database is loaded once and then read and modified in memory, the changes are written back to the file
+    in the background (write-behind): a change marked with changed() is written, together with the ones following
+    it, at most flush_interval seconds later, replacing the file atomically.
+
+    The content is the dictionary data:
+        {
+            "Agents_xref_URIs": {"agent id": {"aliases": {"agent URI": "Sunfish URI"}, "boundaryPorts": {}}},
+            "Sunfish_xref_URIs": {"aliases": {"Sunfish URI": ["agent URI"]}}
+        }
+    which must be read and modified holding lock.
+
+    The file is only read when the database is opened, so it must not be used by more than one process at a time:
+    the changes written by another process are overwritten by the next flush (a warning is logged when they are
+    detected).
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0, lock=None):
+        """
+        Args:
+            path (str): file persisting the database, created the first time the database changes if missing.
+            flush_interval (float): seconds the changes are kept in memory before being written, 0 to write them
+                immediately.
+            lock: reentrant lock protecting the database, e.g. the lock shared with other data changed together
+                with the aliases. A new threading.RLock if None.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = lock if lock is not None else threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._dirty = False
+        self._timer = None
+        # URITranslators built from the current aliases, keyed by agent id (None for the Sunfish URIs)
+        self._translators = {}
+        self._file_version = None
+        self.data = self._load()
+        _open_databases.add(self)
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load(self) -> dict:
+        data = {}
+        try:
+            with open(self.path, 'r') as f:
+                self._file_version = self._stat()
+                data = json.load(f)
+        except FileNotFoundError:
+            logger.info(f"alias file {self.path} not found, starting with no aliases")
+        except ValueError:
+            logger.warning(f"alias file {self.path} is corrupted, starting with no aliases")
+        data.setdefault("Agents_xref_URIs", {})
+        data.setdefault("Sunfish_xref_URIs", {}).setdefault("aliases", {})
+        return data
+
+    def changed(self):
+        """Marks the database as changed, it is written within flush_interval seconds."""
+        with self.lock:
+            self._dirty = True
+            self._translators.clear()
+            if self.flush_interval > 0:
+                if self._timer is None:
+                    self._timer = threading.Timer(self.flush_interval, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def translator(self, agent_id: str = None) -> URITranslator:
+        """Returns a URITranslator of the URIs of an agent to the Sunfish ones or, if agent_id is None, of the
+        Sunfish URIs to the ones of the agents. The translator is a snapshot of the aliases, built again only
+        after they change, so it can be used without holding lock.
+        """
+        with self.lock:
+            translator = self._translators.get(agent_id)
+            if translator is None:
+                if agent_id is None:
+                    aliases = {sunfish_uri: agent_uris[0] for sunfish_uri, agent_uris
+                               in self.data["Sunfish_xref_URIs"]["aliases"].items() if agent_uris}
+                else:
+                    aliases = dict(self.data["Agents_xref_URIs"].get(agent_id, {}).get("aliases", {}))
+                translator = self._translators[agent_id] = URITranslator(aliases)
+            return translator
+
+    def flush(self):
+        """Writes the pending changes, if any, to the file."""
+        with self._flush_lock:
+            with self.lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                text = json.dumps(self.data, sort_keys=True)
+                self._dirty = False
+            if self._stat() != self._file_version:
+                logger.warning(f"the alias file {self.path} was modified by another process, overwriting it")
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(self.path)}.")
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(text)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                with self.lock:
+                    self._dirty = True
+                raise
+            self._file_version = self._stat()
+
+    def close(self):
+        """Writes the pending changes, the database is not written at exit anymore."""
+        self.flush()
+        _open_databases.discard(self)
@@ -0,0 +1,118 @@
+# Copyright IBM Corp. 2024
+# This software is available to you under a BSD 3-Clause License.
+# The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
+
+import threading
+import time
+from collections import deque
+
+
+class CircuitBreaker:
+    """Circuit breaker tracking the health of a remote endpoint (an event destination, an agent, ...).
+
+    The breaker starts closed and lets every request through. When the endpoint fails failure_threshold times
+    within error_window seconds the breaker opens and requests are rejected without contacting the endpoint.
+    After probe_interval seconds the breaker becomes half-open and lets a single probe request through: the
+    breaker closes again if the probe succeeds, otherwise it stays open for another probe_interval. A probe whose
+    outcome is neither a success nor a failure (e.g., the request could not be built) must be released with
+    release_probe, otherwise no other probe is let through.
+    """
+    CLOSED = "Closed"
+    OPEN = "Open"
+    HALF_OPEN = "HalfOpen"
+
+    def __init__(self, failure_threshold: int = 3, error_window: float = 60.0, probe_interval: float = 30.0,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.error_window = error_window
+        self.probe_interval = probe_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = deque()
+        self._state = self.CLOSED
+        self._opened_at = None
+        self._next_probe = None
+        self._probing = False
+        self.last_failure = None
+        self.last_success = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self._clock() >= self._next_probe:
+                return self.HALF_OPEN
+            return self._state
+
+    def open_for(self) -> float:
+        """Returns for how many seconds the breaker has been continuously open (0 if closed)."""
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return self._clock() - self._opened_at
+
+    def allow_request(self) -> bool:
+        """Checks if a request can be sent to the endpoint. In half-open state only one probe is allowed."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and self._clock() >= self._next_probe:
+                self._state = self.HALF_OPEN
+                self._probing = False
+            if self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def release_probe(self):
+        """Gives up the probe let through by allow_request without recording its outcome, so another request can
+        probe the endpoint. Does nothing if the outcome was already recorded.
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probing = False
+
+    def reset(self):
+        """Closes the breaker and forgets the recent failures, as for an endpoint never contacted before."""
+        with self._lock:
+            self._failures.clear()
+            self._state = self.CLOSED
+            self._opened_at = None
+            self._next_probe = None
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.last_success = self._clock()
+            self._failures.clear()
+            self._state = self.CLOSED
+            self._opened_at = None
+            self._next_probe = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            now = self._clock()
+            self.last_failure = now
+            if self._state == self.HALF_OPEN:
+                # the probe failed, wait for the next one
+                self._state = self.OPEN
+                self._next_probe = now + self.probe_interval
+                self._probing = False
+                return
+            self._failures.append(now)
+            while self._failures and self._failures[0] < now - self.error_window:
+                self._failures.popleft()
+            if self._state == self.CLOSED and len(self._failures) >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = now
+                self._next_probe = now + self.probe_interval
+
+    def status(self) -> dict:
+        """Returns a summary of the breaker state."""
+        state = self.state
+        with self._lock:
+            return {
+                "State": state,
+                "RecentFailures": len(self._failures),
+                "OpenForSeconds": 0.0 if self._opened_at is None else self._clock() - self._opened_at
+            }
@@ -4,13 +4,23 @@
 
 import os
 import string
+import threading
 import uuid
 import logging
 import pdb
 
-from sunfish.lib.exceptions import CollectionNotSupported, ResourceNotFound, AgentForwardingFailure, PropertyNotFound
+from sunfish.lib.exceptions import CollectionNotSupported, ResourceNotFound, AgentForwardingFailure, PropertyNotFound, \
+    ActionNotAllowed
 
 from sunfish.events.redfish_subscription_handler import RedfishSubscriptionHandler
+from sunfish.events.event_pipeline import EventIngestionPipeline
+from sunfish.events.event_stream import EventRingBuffer
+from sunfish.events.event_journal import EventJournal
+from sunfish.lib.resource_ownership import ResourceOwnershipIndex
+from sunfish.lib.agent_forwarding import AgentForwardingExecutor
+from sunfish.lib.agent_health import AgentHealthMonitor
+from sunfish.lib.read_through_cache import ReadThroughCache
+from sunfish.lib.alias_db import AliasDB
 from sunfish.models.types import *
 import sunfish.models.plugins as plugin_modules
 logger = logging.getLogger(__name__)
@@ -106,6 +116,49 @@ class Core:
             storage_cl = plugin_modules.load_plugin(plugins_default["storage_backend"])
         self.storage_backend = storage_cl(self.conf)
 
+        # Agents managing the resources, kept up to date by the storage backend as the resources are written
+        self.resource_ownership = ResourceOwnershipIndex(self.storage_backend, conf["redfish_root"])
+        self.storage_backend.add_listener(self.resource_ownership.storage_changed)
+
+        # Agents are inspected concurrently by the threads of the events pipeline, but the steps touching the names,
+        # the aliases and the boundary ports shared by all the agents hold this lock. The lock (like the alias
+        # database it protects) is private to this process, so the agents of a fs_private are onboarded by a single
+        # process.
+        fs_private = os.path.join(os.getcwd(), conf["backend_conf"]["fs_private"])
+        os.makedirs(fs_private, exist_ok=True)
+        self.cross_agent_lock = threading.RLock()
+
+        # URI aliases and boundary ports of the agents, loaded once and written back in the background
+        self.alias_db = AliasDB(os.path.join(fs_private, "URI_aliases.json"),
+                                flush_interval=conf.get("alias_db", {}).get("flush_interval", 1.0),
+                                lock=self.cross_agent_lock)
+
+        # Requests forwarded to the agents are limited per agent by the "agent_forwarding" section of the configuration
+        forwarding_conf = conf.get("agent_forwarding", {})
+        self.agent_forwarding = AgentForwardingExecutor(max_concurrent=forwarding_conf.get("max_concurrent", 4),
+                                                        max_queued=forwarding_conf.get("max_queued", 64),
+                                                        rate=forwarding_conf.get("rate"),
+                                                        burst=forwarding_conf.get("burst", 1),
+                                                        queue_timeout=forwarding_conf.get("queue_timeout"),
+                                                        workers=forwarding_conf.get("workers", 16))
+        health_conf = conf.get("agent_health", {})
+        self.agent_health = AgentHealthMonitor(failure_threshold=health_conf.get("failure_threshold", 3),
+                                               error_window=health_conf.get("error_window", 60),
+                                               probe_interval=health_conf.get("probe_interval", 30),
+                                               probe_period=health_conf.get("probe_period", 30),
+                                               probe_timeout=health_conf.get("probe_timeout", 5),
+                                               redfish_root=conf["redfish_root"])
+
+        # The "agent_read_through" section of the configuration enables reading the agent managed resources from the
+        # agents, through a cache, instead of serving the copy stored by Sunfish
+        self.read_through_cache = None
+        read_through_conf = conf.get("agent_read_through", {})
+        if read_through_conf.get("enabled", False):
+            self.read_through_cache = ReadThroughCache(ttl=read_through_conf.get("ttl", 5),
+                                                       ttl_per_type=read_through_conf.get("ttl_per_type"),
+                                                       max_entries=read_through_conf.get("max_entries", 4096))
+            self.resource_ownership.add_listener(self.read_through_cache.invalidate)
+
         # Default event_handler plugin loaded if nothing is specified in the configuration
         # or if the configuration is not correct
         if "events_handler" not in conf:
@@ -151,6 +204,28 @@ class Core:
         if conf['handlers']['subscription_handler'] == 'redfish':
             self.subscription_handler = RedfishSubscriptionHandler(self)
 
+        # Most recent events, served to the Server-Sent Events clients by stream_events
+        self.event_stream = EventRingBuffer(conf.get("event_stream", {}).get("capacity", 1024))
+
+        # The events journal is enabled by the "event_journal" section of the configuration
+        self.event_journal = None
+        if "event_journal" in conf:
+            journal_conf = conf["event_journal"]
+            journal_path = journal_conf.get("path", os.path.join(os.getcwd(), conf["backend_conf"]["fs_private"],
+                                                                 "EventJournal"))
+            self.event_journal = EventJournal(journal_path,
+                                              segment_bytes=journal_conf.get("segment_bytes", 4 * 1024 * 1024),
+                                              max_bytes=journal_conf.get("max_bytes", 64 * 1024 * 1024),
+                                              max_age=journal_conf.get("max_age"))
+
+        # Events submitted through submit_event are processed asynchronously by a pool of workers.
+        # The workers are started when the first event is submitted.
+        pipeline_conf = conf.get("event_pipeline", {})
+        self.event_pipeline = EventIngestionPipeline(self.handle_event,
+                                                     workers=pipeline_conf.get("workers", 4),
+                                                     dedupe_window=pipeline_conf.get("dedupe_window", 4096),
+                                                     max_queue_size=pipeline_conf.get("max_queue_size", 0))
+
     def get_object(self, path: string):
         """Calls the correspondent read function from the backend implementation and checks that the path is valid.
 
@@ -163,6 +238,15 @@ class Core:
         Returns:
             str|exception: str of the requested resource or an exception in case of fault. 
         """
+        if self.read_through_cache is not None and self.resource_ownership.resolve(path):
+            try:
+                agent_response = self.objects_manager.forward_to_manager(SunfishRequestType.GET, path)
+                if agent_response:
+                    return agent_response
+            except AgentForwardingFailure as e:
+                logger.warning(f"Serving the stored copy of {path}: {e.message}")
+            except Exception as e:
+                logger.warning(f"Serving the stored copy of {path}: {repr(e)}")
         try:
             logger.debug(f"Getting object {path}")
             return self.storage_backend.read(path)
@@ -322,10 +406,62 @@ class Core:
 
         # 4. persist change in Sunfish tree
         self.storage_backend.remove(path)
+        # e.g., an AggregationSource, the agent is not probed anymore
+        self.agent_health.untrack(path)
         return f"Object {path} deleted"
 
+    def get_agent_health(self) -> dict:
+        """Returns the health (circuit breaker state) of the agents Sunfish forwarded requests to."""
+        return self.agent_health.status()
+
+    def get_agent_resources(self, agent_path: str) -> list:
+        """Lists the resources uploaded by an agent.
+
+        Args:
+            agent_path (str): @odata.id of the AggregationSource of the agent.
+
+        Returns:
+            list: the @odata.id of the resources.
+        """
+        return self.resource_ownership.resources(agent_path)
+
+    def remove_agent_resources(self, agent_path: str) -> list:
+        """Removes from the Sunfish tree all the resources uploaded by an agent in a single batch, e.g. when the agent
+        is removed or before it is registered again. The requests are not forwarded to the agent.
+
+        Args:
+            agent_path (str): @odata.id of the AggregationSource of the agent.
+
+        Returns:
+            list: the @odata.id of the resources removed.
+        """
+        resources = self.resource_ownership.resources(agent_path)
+        removed = self.storage_backend.remove_many(resources)
+        self.resource_ownership.remove_agent(agent_path)
+        # the agent is tracked again if requests are forwarded to it after it is registered again
+        self.agent_health.untrack(agent_path)
+        try:
+            aggregation_source = self.storage_backend.read(agent_path)
+            aggregation_source.setdefault("Links", {})["ResourcesAccessed"] = []
+            self.storage_backend.replace(aggregation_source)
+        except ResourceNotFound:
+            logger.debug(f"The aggregation source {agent_path} does not exist anymore")
+        logger.info(f"Removed {len(removed)} resources of the agent {agent_path}")
+        return removed
+
+    def shutdown(self):
+        """Stops the background threads (events pipeline, agent probes and request forwarding) and writes the
+        pending changes of the alias database, e.g. before the application exits.
+        """
+        self.event_pipeline.stop()
+        self.agent_health.stop()
+        self.agent_forwarding.shutdown()
+        self.alias_db.close()
+
     def handle_event(self, payload):
 
+        if self.event_journal is not None:
+            self.event_journal.append(payload)
         if "Context" in payload:
             context = payload["Context"]
         else:
@@ -341,6 +477,64 @@ class Core:
                 raise e
         return self.event_handler.new_event(payload)
 
+    def submit_event(self, payload):
+        """Queues a Redfish event for asynchronous processing and returns immediately.
+        Events coming from the same aggregation source are processed in order and events already received
+        (same EventId) are dropped.
+
+        Args:
+            payload (dict): the Event received.
+
+        Returns:
+            bool: True if the event was queued, False if it was a duplicate.
+        """
+        return self.event_pipeline.submit(payload)
+
+    def stream_events(self, subscription_id: str = None, last_event_id=None, timeout: float = None):
+        """Generator serving the events to a Server-Sent Events client.
+
+        Args:
+            subscription_id (str): Id of the subscription ("SubscriptionType": "SSE") opening the stream. If None, all
+                the events are streamed as for the EventService ServerSentEventUri.
+            last_event_id: the Last-Event-ID sent by the client to resume the stream, None to receive only new events.
+            timeout (float): seconds to wait for a new event before ending the stream, None to wait forever.
+
+        Yields:
+            tuple: (event id, event payload), the event id is the one to be sent as SSE "id" field.
+        """
+        return self.event_stream.stream(subscription_id=subscription_id, last_event_id=last_event_id,
+                                        timeout=timeout)
+
+    def replay_events(self, from_sequence: int = 0, subscription=None):
+        """Replays the events recorded in the events journal.
+
+        Args:
+            from_sequence (int): only the events recorded after this sequence number are replayed.
+            subscription: Id of a subscription, or an EventDestination object, used to filter the events replayed
+                in the same way they are filtered when forwarded to the subscribers. If None all the events are replayed.
+
+        Raises:
+            ActionNotAllowed: if the events journal is not enabled.
+
+        Returns:
+            generator: (sequence number, Event payload) for every event replayed.
+        """
+        if self.event_journal is None:
+            raise ActionNotAllowed()
+        event_filter = None
+        if subscription is not None:
+            event_filter = self.subscription_handler.event_filter(subscription)
+        return self.event_journal.replay(from_sequence, event_filter=event_filter)
+
+    def get_event_delivery_health(self):
+        """Returns the circuit breaker state of every event destination: "Closed" when healthy, "Open" when events
+        are not being sent to the destination and "HalfOpen" when the destination is being probed again."""
+        return self.event_handler.delivery_health()
+
+    def get_event_pipeline_metrics(self):
+        """Returns the queue depth and the processing latency of the asynchronous events pipeline."""
+        return self.event_pipeline.metrics()
+
     def _get_type(self, payload: dict, path: str = None):
         # controlla odata.type
         if "@odata.type" in payload:
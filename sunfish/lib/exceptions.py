@@ -138,5 +138,8 @@ class AgentForwardingFailure(BaseException):
             reason: The reason for failure reported by the agent HTTP server
         """
         message = f"Agent forwarding failure while {operation}. Error code: {error_code}. Reason: {reason}"
+        self.operation = operation
+        self.error_code = error_code
+        self.reason = reason
         self.message = message
         super().__init__(self.message)
@@ -0,0 +1,154 @@
+# Copyright IBM Corp. 2024
+# This software is available to you under a BSD 3-Clause License.
+# The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
+
+import codecs
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+_STRUCTURAL = re.compile(r'["{}\[\],:]')
+# the characters of a string up to its closing quote, or up to the end of the buffer
+_STRING_BODY = re.compile(r'(?:[^"\\]|\\.)*', re.S)
+_SPACES = re.compile(r'\s*')
+_DECODER = json.JSONDecoder()
+
+
+def load_json_stream(chunks, on_member=None, array_key: str = "Members"):
+    """Decodes a JSON document read in chunks (e.g., requests' Response.iter_content), without ever holding the
+    whole document in memory.
+
+    The elements of the array_key array of the top level object are decoded one at a time as soon as they are
+    read and handed to on_member, whose return value replaces the element in the decoded object. So only the rest
+    of the document, the element being read and what on_member keeps of the other elements are held in memory.
+
+    Args:
+        chunks: iterable of bytes.
+        on_member: callable receiving every element of the array, None to keep the elements as they are.
+        array_key (str): property of the top level object holding the array to stream.
+
+    Raises:
+        ValueError: if the document is not valid JSON.
+
+    Returns:
+        the decoded document.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    # text of the document without the elements of the array
+    envelope = []
+    members = []
+    depth = 0
+    # last string read at depth 1 and key whose value is being read at depth 1
+    last_string = None
+    value_of = None
+    in_array = False
+    array_found = False
+    # length the buffer must reach before trying again to decode an element not complete yet
+    retry_length = 0
+    # length of the string at the start of the buffer already scanned, when the string spans several chunks
+    string_scanned = 0
+
+    def scan(buffer, final):
+        # returns the position up to which the buffer was consumed
+        nonlocal depth, last_string, value_of, in_array, array_found, retry_length, string_scanned
+        position = 0
+        segment_start = 0
+        while position < len(buffer):
+            if in_array:
+                position = _SPACES.match(buffer, position).end()
+                if position == len(buffer):
+                    break
+                if buffer[position] == ',':
+                    position += 1
+                    continue
+                if buffer[position] == ']':
+                    in_array = False
+                    depth -= 1
+                    segment_start = position
+                    position += 1
+                    continue
+                if not final and len(buffer) < retry_length:
+                    break
+                try:
+                    member, end = _DECODER.raw_decode(buffer, position)
+                except ValueError:
+                    if final:
+                        raise
+                    end = None
+                if end is None or (end == len(buffer) and not final):
+                    # the element (e.g., a number) may continue in the next chunk
+                    retry_length = 2 * (len(buffer) - position)
+                    break
+                retry_length = 0
+                members.append(on_member(member) if on_member else member)
+                position = end
+                continue
+
+            match = _STRUCTURAL.search(buffer, position)
+            if match is None:
+                position = len(buffer)
+                break
+            index = match.start()
+            char = match.group()
+            if char == '"':
+                # a string continuing from the previous chunks is scanned from where it was left
+                body_end = _STRING_BODY.match(buffer, max(index + 1, string_scanned)).end()
+                string_scanned = 0
+                if body_end == len(buffer) or buffer[body_end] != '"':
+                    if not final:
+                        # the string continues in the next chunk, which is appended to the buffer starting at index
+                        string_scanned = body_end - index
+                        position = index
+                        break
+                    position = len(buffer)
+                else:
+                    position = body_end + 1
+                if depth == 1:
+                    last_string = buffer[index + 1:position - 1]
+                continue
+
+            position = index + 1
+            if char == ':' and depth == 1:
+                value_of = last_string
+            elif char == ',' and depth == 1:
+                value_of = None
+            elif char == '[' and depth == 1 and value_of == array_key and not array_found:
+                envelope.append(buffer[segment_start:position])
+                in_array = array_found = True
+                depth += 1
+            elif char in '{[':
+                depth += 1
+            elif char in '}]':
+                depth -= 1
+        if not in_array:
+            envelope.append(buffer[segment_start:position])
+        return position
+
+    buffer = ""
+    for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        buffer = buffer[scan(buffer, False):]
+    buffer += decoder.decode(b"", final=True)
+    scan(buffer, True)
+
+    obj = json.loads("".join(envelope))
+    if array_found and type(obj) == dict:
+        obj[array_key] = members
+    return obj
+
+
+def load_response(response, on_member=None, array_key: str = "Members", stream_threshold: int = 1 << 20):
+    """Decodes the JSON body of a requests' Response sent with stream=True.
+
+    Bodies larger than stream_threshold bytes, or of unknown size, are decoded with load_json_stream, the others
+    are read at once.
+    """
+    length = response.headers.get("Content-Length")
+    if length is not None and int(length) <= stream_threshold:
+        obj = json.loads(response.content)
+        if on_member and type(obj) == dict and type(obj.get(array_key)) == list:
+            obj[array_key] = [on_member(member) for member in obj[array_key]]
+        return obj
+    return load_json_stream(response.iter_content(chunk_size=65536), on_member, array_key)
@@ -0,0 +1,82 @@
+# Copyright IBM Corp. 2024
+# This software is available to you under a BSD 3-Clause License.
+# The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
+
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def resource_type(obj: dict) -> str:
+    """Returns the type of a Redfish object, e.g. "Port" for "#Port.v1_4_0.Port"."""
+    return obj.get("@odata.type", "").lstrip("#").split(".")[0]
+
+
+class CacheEntry:
+    def __init__(self, obj: dict, etag: str, expires: float):
+        self.obj = obj
+        self.etag = etag
+        self.expires = expires
+
+
+class ReadThroughCache:
+    """Cache of the agent managed resources read from the agents.
+
+    Every resource is kept for a time to live that depends on its type. Once expired the resource is revalidated
+    against the agent with its ETag (If-None-Match), so an unchanged resource is not transferred again.
+    """
+
+    def __init__(self, ttl: float = 5.0, ttl_per_type: dict = None, max_entries: int = 4096, clock=time.monotonic):
+        """
+        Args:
+            ttl: default time to live in seconds.
+            ttl_per_type: time to live of specific resource types, e.g. {"Port": 1, "Fabric": 60}.
+            max_entries: maximum number of resources cached, the least recently used ones are evicted first.
+        """
+        self.ttl = ttl
+        self.ttl_per_type = ttl_per_type or {}
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _ttl(self, obj: dict) -> float:
+        return self.ttl_per_type.get(resource_type(obj), self.ttl)
+
+    def lookup(self, path: str):
+        """Finds a cached resource.
+
+        Returns:
+            tuple: (resource, ETag, fresh) where fresh is False if the resource has to be revalidated,
+                (None, None, False) if the resource is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(path.rstrip('/'))
+            if entry is None:
+                return None, None, False
+            self._entries.move_to_end(path.rstrip('/'))
+            return copy.deepcopy(entry.obj), entry.etag, self._clock() < entry.expires
+
+    def store(self, path: str, obj: dict, etag: str = None):
+        with self._lock:
+            path = path.rstrip('/')
+            self._entries[path] = CacheEntry(copy.deepcopy(obj), etag, self._clock() + self._ttl(obj))
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def refresh(self, path: str):
+        """Restarts the time to live of a resource revalidated by the agent."""
+        with self._lock:
+            entry = self._entries.get(path.rstrip('/'))
+            if entry is not None:
+                entry.expires = self._clock() + self._ttl(entry.obj)
+
+    def invalidate(self, path: str):
+        """Drops a resource, e.g. after it is modified through Sunfish."""
+        with self._lock:
+            self._entries.pop(path.rstrip('/'), None)
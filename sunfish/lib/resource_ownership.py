@@ -0,0 +1,226 @@
+# Copyright IBM Corp. 2024
+# This software is available to you under a BSD 3-Clause License.
+# The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
+
+import logging
+import threading
+from typing import Optional
+
+from sunfish.lib.exceptions import ResourceNotFound
+
+logger = logging.getLogger(__name__)
+
+
+def managing_agent(obj: dict) -> Optional[str]:
+    """Returns the @odata.id of the agent marked as Oem.Sunfish_RM.ManagingAgent of a resource, if any."""
+    try:
+        return obj["Oem"]["Sunfish_RM"]["ManagingAgent"]["@odata.id"]
+    except (KeyError, TypeError):
+        return None
+
+
+class ResourceOwnershipIndex:
+    """Index of the agents managing the resources of the Sunfish tree.
+
+    A resource is managed by the agent marked as ManagingAgent on the longest prefix of its path, the top level
+    collections (e.g., /redfish/v1/Systems) are never managed by an agent. The resources are read from the storage
+    backend the first time they are resolved and indexed again whenever the storage notifies a change (see
+    storage_changed), so deciding whether a request is to be forwarded to an agent costs no I/O once the index is
+    warm. A resource missing from the storage is not managed, its absence is not cached: the requests for paths
+    that do not exist would grow the index without bound.
+
+    The index also keeps the set of resources uploaded by every agent (the Links.ResourcesAccessed of its
+    AggregationSource), so all the resources of an agent can be listed or removed at once.
+    """
+
+    def __init__(self, storage_backend, redfish_root: str):
+        self.storage_backend = storage_backend
+        self.redfish_root = redfish_root.rstrip('/')
+        # "path": agent @odata.id, None if the resource is not marked with a ManagingAgent
+        self._owners = {}
+        # "agent @odata.id": {"path_1", "path_n"}, loaded from the AggregationSource the first time it is used
+        self._owned = {}
+        # "path": agent @odata.id, reverse of _owned
+        self._owned_by = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Registers a callable receiving the path of every resource written or removed."""
+        self._listeners.append(listener)
+
+    def _notify(self, path: str):
+        for listener in self._listeners:
+            listener(path)
+
+    def _normalize(self, path: str) -> str:
+        path = path.rstrip('/')
+        if not path.startswith(self.redfish_root):
+            path = f"{self.redfish_root}/{path.lstrip('/')}"
+        return path
+
+    def _level(self, path: str) -> int:
+        relative = path[len(self.redfish_root):].strip('/')
+        return len(relative.split('/')) if relative else 0
+
+    def resolve(self, path: str) -> Optional[str]:
+        """Finds the agent managing a resource.
+
+        Args:
+            path (str): path of the resource, or of a collection in which a resource is to be created.
+
+        Returns:
+            str: @odata.id of the AggregationSource of the managing agent, None if neither the resource nor any of
+                its parents is managed, or stored.
+        """
+        node = self._normalize(path)
+        while self._level(node) > 1:
+            with self._lock:
+                known = node in self._owners
+                agent = self._owners.get(node)
+            if not known:
+                try:
+                    agent = managing_agent(self.storage_backend.read(node))
+                    with self._lock:
+                        self._owners[node] = agent
+                except ResourceNotFound:
+                    # e.g., a collection not stored on its own
+                    agent = None
+            if agent:
+                return agent
+            node = node.rsplit('/', 1)[0]
+        return None
+
+    def storage_changed(self, path: str, obj: dict = None):
+        """Listener of the storage backend, indexes the resources written and drops the ones removed.
+
+        Args:
+            path (str): @odata.id of the resource changed.
+            obj (dict): the new content of the resource, None if it was removed.
+        """
+        if obj is None:
+            self.forget(path)
+        else:
+            self.record(obj)
+
+    def record(self, obj: dict):
+        """Indexes a resource just written."""
+        if "@odata.id" not in obj:
+            return
+        path = self._normalize(obj["@odata.id"])
+        with self._lock:
+            self._owners[path] = managing_agent(obj)
+        self._notify(path)
+
+    def forget(self, path: str, subtree: bool = False):
+        """Drops a resource (and optionally all the resources below it) from the index, e.g. after it is patched or
+        removed. The resource is read again from the storage the next time it is resolved.
+        """
+        path = self._normalize(path)
+        with self._lock:
+            self._owners.pop(path, None)
+            self._discard_owned(path)
+            if subtree:
+                prefix = f"{path}/"
+                for key in [key for key in self._owners if key.startswith(prefix)]:
+                    del self._owners[key]
+                for key in [key for key in self._owned_by if key.startswith(prefix)]:
+                    self._discard_owned(key)
+        self._notify(path)
+
+    def _discard_owned(self, path: str):
+        agent = self._owned_by.pop(path, None)
+        if agent is not None:
+            self._owned[agent].discard(path)
+
+    def _owned_set(self, agent: str, aggregation_source: dict = None) -> set:
+        # must be called holding the lock
+        if agent not in self._owned:
+            if aggregation_source is None:
+                try:
+                    aggregation_source = self.storage_backend.read(agent)
+                except ResourceNotFound:
+                    aggregation_source = {}
+            resources = set()
+            for resource in aggregation_source.get("Links", {}).get("ResourcesAccessed", []):
+                resource = self._normalize(resource)
+                resources.add(resource)
+                self._owned_by[resource] = agent
+            self._owned[agent] = resources
+        return self._owned[agent]
+
+    def add_resource(self, aggregation_source: dict, path: str) -> bool:
+        """Records a resource uploaded by an agent. A resource uploaded before by another agent is removed from the
+        ResourcesAccessed of the AggregationSource of that agent.
+
+        Args:
+            aggregation_source (dict): the AggregationSource of the agent.
+            path (str): @odata.id of the resource.
+
+        Returns:
+            bool: True if the resource was not known to be uploaded by the agent yet.
+        """
+        agent = self._normalize(aggregation_source["@odata.id"])
+        path = self._normalize(path)
+        with self._lock:
+            resources = self._owned_set(agent, aggregation_source)
+            if path in resources:
+                return False
+            previous_agent = self._owned_by.get(path)
+            if previous_agent is not None:
+                self._owned[previous_agent].discard(path)
+            resources.add(path)
+            self._owned_by[path] = agent
+        if previous_agent is not None:
+            self._release(previous_agent, path)
+        return True
+
+    def _release(self, agent: str, path: str):
+        # removes a resource from the ResourcesAccessed stored in the AggregationSource of an agent
+        try:
+            aggregation_source = self.storage_backend.read(agent)
+        except ResourceNotFound:
+            return
+        links = aggregation_source.get("Links", {})
+        accessed = links.get("ResourcesAccessed", [])
+        remaining = [resource for resource in accessed if self._normalize(resource) != path]
+        if len(remaining) != len(accessed):
+            logger.info(f"{path} is now uploaded by another agent, removing it from the resources of {agent}")
+            links["ResourcesAccessed"] = remaining
+            self.storage_backend.replace(aggregation_source)
+
+    def owns(self, agent: str, path: str) -> bool:
+        """Checks whether a resource was uploaded by an agent."""
+        agent = self._normalize(agent)
+        path = self._normalize(path)
+        with self._lock:
+            return path in self._owned_set(agent)
+
+    def resources(self, agent: str) -> list:
+        """Lists the resources uploaded by an agent.
+
+        Args:
+            agent (str): @odata.id of the AggregationSource of the agent.
+        """
+        agent = self._normalize(agent)
+        with self._lock:
+            return sorted(self._owned_set(agent))
+
+    def remove_agent(self, agent: str) -> list:
+        """Drops from the index the agent and all its resources, e.g. after they are removed from the storage.
+
+        Returns:
+            list: the resources of the agent.
+        """
+        agent = self._normalize(agent)
+        with self._lock:
+            resources = self._owned_set(agent)
+            del self._owned[agent]
+            for path in resources:
+                self._owned_by.pop(path, None)
+            for path in [path for path, owner in self._owners.items() if path in resources or owner == agent]:
+                del self._owners[path]
+        for path in resources:
+            self._notify(path)
+        self._notify(agent)
+        return sorted(resources)
@@ -0,0 +1,64 @@
+# Copyright IBM Corp. 2024
+# This software is available to you under a BSD 3-Clause License.
+# The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
+
+
+class URITranslator:
+    """Translates URIs according to a map of aliases, e.g. the URIs of an agent to the Sunfish ones.
+
+    A URI is translated by its longest prefix, ending at a path segment, found in the aliases: the alias of
+    /redfish/v1/Fabrics/CXL also translates /redfish/v1/Fabrics/CXL/Switches/1 to the same subtree, unless
+    /redfish/v1/Fabrics/CXL/Switches/1 has an alias of its own. So the links to resources renamed together with
+    their parent are translated even if they are not listed in the aliases.
+    """
+
+    def __init__(self, aliases: dict, prefixes: bool = True):
+        """
+        Args:
+            aliases (dict): "URI": "translated URI", used as is (not copied).
+            prefixes (bool): translate also the URIs below the aliased ones.
+        """
+        self.aliases = aliases
+        self.prefixes = prefixes
+
+    def translate(self, uri: str) -> str:
+        """Returns the translation of a URI, the URI itself if it is not aliased."""
+        alias = self.aliases.get(uri)
+        if alias is not None:
+            return alias
+        if self.prefixes and self.aliases:
+            end = uri.rfind('/')
+            while end > 0:
+                alias = self.aliases.get(uri[:end])
+                if alias is not None:
+                    return alias + uri[end:]
+                end = uri.rfind('/', 0, end)
+        return uri
+
+    def rewrite(self, obj: dict) -> list:
+        """Translates in place, visiting the object once, the @odata.id links nested in a Redfish object. The
+        @odata.id of the object itself and the Sunfish_RM properties are left unchanged.
+
+        Returns:
+            list: the paths (e.g., "[Links][ConnectedPorts][0]") of the links rewritten.
+        """
+        rewritten = []
+        if self.aliases:
+            self._rewrite(obj, "", rewritten)
+        return rewritten
+
+    def _rewrite(self, obj, path: str, rewritten: list):
+        if type(obj) == dict:
+            for key, value in obj.items():
+                if key == '@odata.id':
+                    if path and type(value) == str:
+                        translated = self.translate(value)
+                        if translated != value:
+                            obj[key] = translated
+                            rewritten.append(path)
+                elif key != "Sunfish_RM" and type(value) in (dict, list):
+                    self._rewrite(value, f"{path}[{key}]", rewritten)
+        else:
+            for index, entry in enumerate(obj):
+                if type(entry) in (dict, list):
+                    self._rewrite(entry, f"{path}[{index}]", rewritten)
@@ -5,6 +5,8 @@
 
 from abc import abstractmethod
 
+from sunfish.lib.exceptions import ResourceNotFound
+
 class BackendInterface():
     @abstractmethod
     def read():
@@ -25,6 +27,30 @@ class BackendInterface():
     def remove():
         pass
 
+    def add_listener(self, listener):
+        """Registers a callable notified of every change of the stored resources, so the indexes and caches kept on
+        top of the storage stay consistent whoever writes it. The listener receives the @odata.id of the resource
+        changed and its new content, None if the resource was removed.
+        """
+        self.__dict__.setdefault("_listeners", []).append(listener)
+
+    def _notify(self, path: str, obj: dict = None):
+        # called by the backends after every write, replace, patch and removal
+        for listener in self.__dict__.get("_listeners", ()):
+            listener(path, obj)
+
+    def remove_many(self, paths: list):
+        """Deletes several objects. Backends can override it with a more efficient batched removal."""
+        removed = []
+        for path in sorted(paths):
+            try:
+                self.remove(path)
+            except ResourceNotFound:
+                # already removed together with its parent
+                continue
+            removed.append(path)
+        return removed
+
     @abstractmethod
     def reset_resources():
         pass
@@ -0,0 +1,389 @@
+# Copyright IBM Corp. 2024
+# This software is available to you under a BSD 3-Clause License.
+# The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
+
+import hashlib
+import heapq
+import json
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# response of an agent to a GET: status code, decoded body (None if the request failed) and ETag header
+AgentResponse = namedtuple("AgentResponse", ["status_code", "body", "etag"], defaults=[None])
+
+
+def write_json(path: str, obj):
+    """Writes a json file atomically, so a crash never leaves it half written."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as data_json:
+        json.dump(obj, data_json)
+    os.replace(tmp_path, path)
+
+
+def missing_ancestors(uri: str, visited) -> list:
+    """Returns the ancestors of a resource below the top level collection (e.g. /redfish/v1/Fabrics/CXL and
+    /redfish/v1/Fabrics/CXL/Switches for /redfish/v1/Fabrics/CXL/Switches/1) that were not visited yet.
+    """
+    path_nodes = uri.split("/")
+    missing = []
+    for node_position in range(4, len(path_nodes) - 1):
+        redfish_path = f'/redfish/v1/{"/".join(path_nodes[3:node_position + 1])}'
+        if redfish_path not in visited:
+            missing.append(redfish_path)
+    return missing
+
+
+def nested_links(obj) -> list:
+    """Returns the @odata.id of the resources referenced by an object, skipping its own @odata.id and the
+    Sunfish_RM properties (they are in the Sunfish namespace, not in the agent one).
+    """
+    links = []
+
+    def handle_nested_object(nested):
+        if type(nested) == list:
+            for entry in nested:
+                if type(entry) == list or type(entry) == dict:
+                    handle_nested_object(entry)
+        elif type(nested) == dict:
+            for key, value in nested.items():
+                if key == '@odata.id':
+                    links.append(value)
+                elif key != "Sunfish_RM" and (type(value) == list or type(value) == dict):
+                    handle_nested_object(value)
+
+    for key, value in obj.items():
+        if key != '@odata.id' and (type(value) == list or type(value) == dict):
+            handle_nested_object(value)
+    return links
+
+
+def expand_query(service_root: dict, levels: int = 1) -> Optional[str]:
+    """Returns the $expand query parameter fetching a resource with its subordinate resources inline, according to
+    the ProtocolFeaturesSupported.ExpandQuery of the agent service root, None if the agent does not support it.
+    """
+    features = service_root.get("ProtocolFeaturesSupported", {}).get("ExpandQuery", {})
+    # "." expands the subordinate resources only, the hyperlinks (e.g., Links) are left as they are
+    if not features.get("NoLinks"):
+        return None
+    if features.get("Levels"):
+        levels = min(levels, features.get("MaxLevels", levels))
+        return f"$expand=.($levels={levels})"
+    return "$expand=."
+
+
+def split_expanded(obj: dict) -> list:
+    """Replaces the resources expanded inline in obj with references to them.
+
+    Returns:
+        list: the resources expanded, including the ones expanded inside them. Collections whose members are not
+            expanded are replaced but not returned, so they are fetched on their own with their members expanded.
+    """
+    resources = []
+
+    def is_resource(nested):
+        return type(nested) == dict and '@odata.id' in nested and '@odata.type' in nested
+
+    def handle_nested_object(nested) -> bool:
+        # returns True if any resource was found expanded in nested
+        expanded = False
+        if type(nested) == list:
+            for index, entry in enumerate(nested):
+                if is_resource(entry):
+                    handle_resource(entry)
+                    nested[index] = {'@odata.id': entry['@odata.id']}
+                    expanded = True
+                elif type(entry) == list or type(entry) == dict:
+                    expanded = handle_nested_object(entry) or expanded
+        elif type(nested) == dict:
+            for key, value in nested.items():
+                if key == "Sunfish_RM":
+                    continue
+                if is_resource(value):
+                    handle_resource(value)
+                    nested[key] = {'@odata.id': value['@odata.id']}
+                    expanded = True
+                elif type(value) == list or type(value) == dict:
+                    expanded = handle_nested_object(value) or expanded
+        return expanded
+
+    def handle_resource(resource):
+        members_expanded = handle_nested_object(resource)
+        if 'Collection' not in resource['@odata.type'] or members_expanded or not resource.get('Members'):
+            resources.append(resource)
+
+    handle_nested_object(obj)
+    return resources
+
+
+class InspectionSyncState:
+    """Versions of the resources of an agent at its last inspection, kept in fs_private.
+
+    For every resource the state keeps its ETag, the hash of its content, the path of its Sunfish copy and the
+    links followed from it, so an incremental inspection can skip the resources that did not change (or were
+    not modified according to If-None-Match) and still follow their links.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # "agent URI": {"ETag": str, "Hash": str, "Sunfish": str, "Links": list}
+        self.resources = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as data_json:
+                    self.resources = json.load(data_json)
+            except ValueError:
+                logger.warning(f"Sync state {path} is corrupted, the agent will be inspected from scratch")
+
+    @staticmethod
+    def content_hash(body: dict) -> str:
+        return hashlib.sha256(json.dumps(body, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+    def etag(self, uri: str) -> Optional[str]:
+        return self.resources.get(uri, {}).get("ETag")
+
+    def unchanged(self, uri: str, response: AgentResponse) -> bool:
+        """Checks whether an agent returned the same version of a resource as at the last inspection."""
+        entry = self.resources.get(uri)
+        if entry is None:
+            return False
+        if response.status_code == 304:
+            return True
+        if response.status_code != 200 or type(response.body) != dict:
+            return False
+        etag = response.etag or response.body.get("@odata.etag")
+        if etag and etag == entry.get("ETag"):
+            return True
+        return self.content_hash(response.body) == entry.get("Hash")
+
+    def sunfish_uri(self, uri: str) -> Optional[str]:
+        return self.resources.get(uri, {}).get("Sunfish")
+
+    def links_of(self, uri: str) -> dict:
+        """Returns an object carrying the links followed from a resource at the last inspection."""
+        entry = self.resources[uri]
+        return {"@odata.id": entry["Sunfish"], "Links": [{"@odata.id": link} for link in entry["Links"]]}
+
+    def update(self, uri: str, response: AgentResponse, body_hash: str, redfish_obj: dict):
+        """Records the version of a resource just processed.
+
+        Args:
+            uri (str): URI of the resource in the agent.
+            response (AgentResponse): the response of the agent.
+            body_hash (str): the content_hash of the body returned by the agent.
+            redfish_obj (dict): the resource as created in Sunfish.
+        """
+        self.resources[uri] = {
+            "ETag": response.etag or response.body.get("@odata.etag"),
+            "Hash": body_hash,
+            "Sunfish": redfish_obj["@odata.id"],
+            "Links": nested_links(redfish_obj)
+        }
+
+    def forget(self, uri: str):
+        self.resources.pop(uri, None)
+
+    def save(self):
+        write_json(self.path, self.resources)
+
+
+class InspectionCheckpoint:
+    """Last checkpoint of the inspection of an agent, kept in fs_private until the inspection completes."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self, root_id: str) -> Optional[dict]:
+        """Returns the state of an interrupted inspection starting from root_id, None if there is none."""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'r') as data_json:
+                state = json.load(data_json)
+        except ValueError:
+            logger.warning(f"Inspection checkpoint {self.path} is corrupted, ignoring it")
+            return None
+        return state if state.get("Root") == root_id else None
+
+    def save(self, state: dict):
+        write_json(self.path, state)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class InspectionEngine:
+    """Breadth first inspection of the resources of an agent.
+
+    Starting from a resource, the engine follows every @odata.id found in the resources returned by the agent.
+    The resources are processed (i.e., created in the Sunfish tree) by the calling thread in ascending URI order,
+    and a resource is processed only once all its ancestors were, so parents are always created before their
+    children and the writes to the storage and to the alias DB stay serialized.
+    The GET requests are instead sent ahead of time by a pool of workers for the first resources of the frontier,
+    so the time spent inspecting an agent is its latency divided by the number of workers.
+
+    The frontier is a heap and the visited resources are kept in a hash table, so every resource costs
+    O(log n) to schedule whatever the size of the agent.
+
+    If the agent returns the resources with their subordinate resources expanded ($expand), the expanded resources
+    are split from their parent and processed on their own without being requested again, so a collection costs a
+    single request.
+
+    The progress of the inspection (frontier and visited resources) is handed to a checkpoint callable every
+    checkpoint_every resources and when the inspection fails, so an interrupted inspection can be resumed.
+    """
+
+    def __init__(self, fetch, process, workers: int = 8, prefetch: int = None, expanded: bool = False,
+                 checkpoint=None, checkpoint_every: int = 1000):
+        """
+        Args:
+            fetch: callable sending the GET of a URI to the agent, called by the workers. It returns an AgentResponse.
+            process: callable receiving a URI and the AgentResponse returned by fetch, returning the resource
+                created in Sunfish or None if the agent did not return the resource.
+            workers: number of GET requests sent to the agent concurrently.
+            prefetch: maximum number of responses fetched in advance, 4 * workers by default.
+            expanded: True if fetch returns the resources with their subordinate resources expanded.
+            checkpoint: callable receiving the state of the inspection to persist, see state().
+            checkpoint_every: number of resources processed between two checkpoints.
+        """
+        self.fetch = fetch
+        self.process = process
+        self.workers = max(1, workers)
+        self.prefetch = prefetch or 4 * self.workers
+        self.expanded = expanded
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        # "URI": resource received expanded in the response of another resource
+        self.embedded = {}
+        self.root_id = None
+        self.frontier = []
+        # dict used as an insertion ordered set
+        self.visited = {}
+        self.fetched = []
+        self.notfound = []
+
+    def state(self) -> dict:
+        """Returns the progress of the inspection, all the resources visited and not in the frontier were
+        processed.
+        """
+        return {
+            "Root": self.root_id,
+            "Frontier": sorted(self.frontier),
+            "Visited": list(self.visited),
+            "Fetched": self.fetched,
+            "NotFound": self.notfound
+        }
+
+    def run(self, root_id: str, resume: dict = None) -> list:
+        """Inspects all the resources reachable from root_id.
+
+        Args:
+            root_id (str): URI the inspection starts from.
+            resume (dict): state() of an interrupted inspection of root_id to resume.
+
+        Returns:
+            list: the URIs visited.
+        """
+        self.root_id = root_id
+        frontier = self.frontier
+        # heap of the resources discovered whose GET was not sent yet
+        to_fetch = []
+        # "URI": future response of the GET sent by a worker
+        in_flight = {}
+        processed = set()
+        # "URI": resources whose GET waits for their parent to be processed, as it may return them expanded
+        waiting = {}
+        # resource being processed, put back in the frontier if the inspection fails
+        current = None
+        since_checkpoint = 0
+
+        def visit(uri):
+            self.visited[uri] = None
+            heapq.heappush(frontier, uri)
+            heapq.heappush(to_fetch, uri)
+
+        if resume:
+            self.visited = dict.fromkeys(resume["Visited"])
+            self.fetched = list(resume["Fetched"])
+            self.notfound = list(resume["NotFound"])
+            frontier.extend(resume["Frontier"])
+            heapq.heapify(frontier)
+            to_fetch.extend(frontier)
+            processed = set(self.visited).difference(frontier)
+            logger.info(f"Resuming the inspection of {root_id}: {len(processed)} resources already processed")
+        else:
+            visit(root_id)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sunfish-inspection") as pool:
+            try:
+                while frontier:
+                    current = None
+                    if self.checkpoint and since_checkpoint >= self.checkpoint_every:
+                        self.checkpoint(self.state())
+                        since_checkpoint = 0
+                    while to_fetch and len(in_flight) < self.prefetch:
+                        uri = heapq.heappop(to_fetch)
+                        if uri in processed or uri in self.embedded:
+                            continue
+                        parent = uri.rsplit('/', 1)[0]
+                        # the parents below the top level collections are always inspected before their children
+                        if self.expanded and len(parent.split('/')) > 4 and parent not in processed:
+                            waiting.setdefault(parent, []).append(uri)
+                            continue
+                        in_flight[uri] = pool.submit(self.fetch, uri)
+                    id = heapq.heappop(frontier)
+                    missing = missing_ancestors(id, self.visited)
+                    if missing:
+                        # the ancestors sort before id, so they are processed first
+                        for redfish_path in missing:
+                            logger.info(f"Inspect redfish path: {redfish_path}")
+                            visit(redfish_path)
+                        heapq.heappush(frontier, id)
+                        continue
+
+                    current = id
+                    future = in_flight.pop(id, None)
+                    if id in self.embedded:
+                        if future is not None:
+                            future.cancel()
+                        response = AgentResponse(200, self.embedded.pop(id))
+                    elif future is not None:
+                        response = future.result()
+                    else:
+                        # a resource discovered after the prefetched ones is fetched right away
+                        response = self.fetch(id)
+                    processed.add(id)
+                    if self.expanded and response.status_code == 200 and type(response.body) == dict:
+                        for resource in split_expanded(response.body):
+                            if resource['@odata.id'] not in processed:
+                                self.embedded.setdefault(resource['@odata.id'], resource)
+                    for uri in waiting.pop(id, []):
+                        heapq.heappush(to_fetch, uri)
+                    redfish_obj = self.process(id, response)
+                    since_checkpoint += 1
+                    self.fetched.append(id)
+                    if redfish_obj is None:  # we failed to locate it in the agent
+                        self.notfound.append(id)
+                    if redfish_obj is None or type(redfish_obj) != dict:
+                        logger.info(f"Resource - {id} - not available")
+                        continue
+
+                    for link in nested_links(redfish_obj):
+                        if link not in self.visited:
+                            visit(link)
+            except BaseException:
+                if self.checkpoint:
+                    if current is not None:
+                        heapq.heappush(frontier, current)
+                    logger.warning(f"Inspection of {root_id} interrupted, {len(frontier)} resources left")
+                    self.checkpoint(self.state())
+                raise
+            finally:
+                for future in in_flight.values():
+                    future.cancel()
+        return list(self.visited)
@@ -2,6 +2,7 @@
 # Copyright Hewlett Packard Enterprise Development LP 2024
 # This software is available to you under a BSD 3-Clause License. 
 # The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
+import itertools
 import json
 import logging
 import os
@@ -11,10 +12,16 @@ import shutil
 from uuid import uuid4
 import pdb
 
+import threading
+
 import requests
 from sunfish.events.event_handler_interface import EventHandlerInterface
-from sunfish.events.redfish_subscription_handler import subscriptions
+from sunfish.lib.circuit_breaker import CircuitBreaker
 from sunfish.lib.exceptions import *
+from sunfish.lib.json_stream import load_response
+from sunfish.lib.resource_ownership import managing_agent
+from sunfish_plugins.events_handlers.redfish.inspection import AgentResponse, InspectionCheckpoint, \
+    InspectionEngine, InspectionSyncState, expand_query
 
 logger = logging.getLogger("RedfishEventHandler")
 logging.basicConfig(level=logging.DEBUG)
@@ -98,13 +105,11 @@ class RedfishEventHandlersTable:
             raise PropertyNotFound("Cannot find aggregation source; file does not exist")
         # fetch the actual resource to be created from agent
         hostname = aggregation_source["HostName"]
-        response = requests.get(f"{hostname}/{id}")
-
-        if response.status_code != 200:
-            raise ResourceNotFound("Aggregation source read from Agent failed") 
-        response = response.json()
-        logger.info(f"new resource is \n")
-        logger.info(json.dumps(response, indent=4))
+        with requests.get(f"{hostname}/{id}", stream=True) as response:
+            if response.status_code != 200:
+                raise ResourceNotFound("Aggregation source read from Agent failed")
+            response = load_response(response)
+        logger.info(f"new resource is {response.get('@odata.id')}")
 
         # here we are assuming that we are getting a fully populated redfish
         # object from the agent.  Add real tests here!
@@ -130,7 +135,8 @@ class RedfishEventHandlersTable:
         # patch the aggregation_source object in storage with all the new resources found
         #pdb.set_trace()
         event_handler.core.storage_backend.patch(agg_src_path, aggregation_source)
-        logger.debug(f"\n{json.dumps(aggregation_source, indent=4)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"\n{json.dumps(aggregation_source, indent=4)}")
         return 200
 
     @classmethod
@@ -213,6 +219,23 @@ class RedfishEventHandler(EventHandlerInterface):
         self.fs_root = core.conf["backend_conf"]["fs_root"]
         self.fs_SunfishPrivate = core.conf["backend_conf"]["fs_private"]
         self.subscribers_root = core.conf["backend_conf"]["subscribers_root"]
+        # one circuit breaker for each event destination, so unreachable listeners are skipped without
+        # waiting for a connection timeout on every event
+        delivery_conf = core.conf.get("event_delivery", {})
+        self.delivery_timeout = delivery_conf.get("timeout", 5)
+        self.delivery_breaker_conf = {
+            "failure_threshold": delivery_conf.get("failure_threshold", 3),
+            "error_window": delivery_conf.get("error_window", 60),
+            "probe_interval": delivery_conf.get("probe_interval", 30)
+        }
+        # subscriptions whose destination stays unreachable longer than this are suspended
+        self.delivery_suspend_after = delivery_conf.get("suspend_after", 3600)
+        self.destinations_health = {}
+        self._destinations_lock = threading.Lock()
+        # $expand query supported by every agent, read once from its service root
+        # ("agent @odata.id", "HostName", levels): query, None if the agent does not support $expand
+        self.expand_queries = {}
+
     @classmethod
     def dispatch(cls, message_id: str, event_handler: EventHandlerInterface, event: dict, context: str):
         if message_id in cls.dispatch_table:
@@ -222,54 +245,64 @@ class RedfishEventHandler(EventHandlerInterface):
 
     def new_event(self, payload):
         """Compares event's information with the subsribtions data structure to find the Ids of the subscribers for that event.
-        
+        Every event of the payload is routed on its own, and each subscriber receives a single payload containing
+        only the events it is interested in.
+
         Args:
             payload (dict): event received.
+
+        Returns:
+            list: list of all the reachable subcribers for the events.
         """
-        for event in payload["Events"]:
-            prefix = event["MessageId"].split('.')[0]
+        types = {}
+        subscribers_events = {}
+        # the events are buffered for streaming only if someone may read them
+        streaming = self.core.subscription_handler.has_sse_subscriptions() or self.core.event_stream.readers > 0
+        for index, event in enumerate(payload["Events"]):
             messageId = event["MessageId"]
-            origin = 'not_specified'
-
-            to_forward = []
-            to_exclude = []
+            type = None
+            origin = None
 
-            if prefix in subscriptions["RegistryPrefixes"]:
-                for id in subscriptions["RegistryPrefixes"][prefix]["exclude"]:
-                    to_exclude.extend(id)
-            if messageId in subscriptions["MessageIds"]:
-                for id in subscriptions["MessageIds"][messageId]["exclude"]:
-                    to_exclude.append(id)
-            
             """ ResourceTypes, OriginResources and SubordinateResources are checked only if the event
                 contains OriginOfConditions because they refer to @odata.id
             """
             if "OriginOfCondition" in event:
                 origin = event["OriginOfCondition"]["@odata.id"]
-                try:
-                    type = self.check_data_type(origin)
-                except ResourceNotFound as e:
-                    raise ResourceNotFound(e.resource_id)
-                if type in subscriptions["ResourceTypes"]:
-                    to_forward.extend(subscriptions["ResourceTypes"][type])
-                if origin in subscriptions["OriginResources"]:
-                    to_forward.extend(subscriptions["OriginResources"][origin])
-                sub = self.check_subdirs(origin)
-                to_forward.extend(sub)
-
-            if prefix in subscriptions["RegistryPrefixes"]:
-                for id in subscriptions["RegistryPrefixes"][prefix]["to_send"]:
-                    to_forward.append(id)
-            if messageId in subscriptions["MessageIds"]:
-                for id in subscriptions["MessageIds"][messageId]["to_send"]:
-                    to_forward.append(id)
-            
-            set1 = set(to_forward)
-            set2 = set(to_exclude)
-            to_forward = list(set1 - set2)
+                # events in the same payload often share the origin, resolve its type only once
+                if origin not in types:
+                    try:
+                        types[origin] = self.check_data_type(origin)
+                    except ResourceNotFound as e:
+                        raise ResourceNotFound(e.resource_id)
+                type = types[origin]
+
+            for id in self.core.subscription_handler.route(messageId, resource_type=type, origin=origin):
+                subscribers_events.setdefault(id, []).append(index)
+
+            # Server-Sent Events subscribers read the events from the stream buffer
+            if streaming:
+                sse_subscribers = self.core.subscription_handler.route_sse(messageId, resource_type=type,
+                                                                           origin=origin)
+                if sse_subscribers or self.core.event_stream.readers > 0:
+                    streamed = dict(payload)
+                    streamed["Events"] = [event]
+                    self.core.event_stream.publish(streamed, sse_subscribers)
+
+        # subscribers interested in the same events share the same forwarded payload
+        deliveries = {}
+        for id, events in subscribers_events.items():
+            deliveries.setdefault(tuple(events), []).append(id)
+
+        forwarded = []
+        for events, ids in deliveries.items():
+            if len(events) == len(payload["Events"]):
+                to_send = payload
+            else:
+                to_send = dict(payload)
+                to_send["Events"] = [payload["Events"][index] for index in events]
+            forwarded.extend(self.forward_event(ids, to_send))
+        return forwarded
 
-            return self.forward_event(to_forward, payload)
-        
     def check_data_type(self, origin):
         length = len(self.redfish_root)
         resource = origin[length:]
@@ -284,6 +317,8 @@ class RedfishEventHandler(EventHandlerInterface):
     def forward_event(self, list, payload):
         """ Get Destination from the list of the subscribers' Ids and forwards the event.
             If the destination is not reachable, the Id is deleted from the list.
+            Destinations that keep failing are not contacted until their circuit breaker allows a new attempt,
+            and their subscriptions are suspended if they stay unreachable for too long.
         Args:
             list (_type_): list of the subscribers Ids interested in that event
             payload (_type_): event details
@@ -294,111 +329,190 @@ class RedfishEventHandler(EventHandlerInterface):
         Returns:
             list: list of all the reachable subcribers for the event.
         """
-        
+        forwarded = []
         for id in list:
             path = os.path.join(self.redfish_root, 'EventService', 'Subscriptions', id)
             try:
-                data = self.core.storage_backend.read(path)
-                resp = requests.post(data['Destination'], json=payload)
-                resp.raise_for_status()
-            except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as e:
-                logger.warning(f"Unable to contact event destination {id} for event , skipping.")
-                logger.warning(f"Event log: \n{json.dumps(payload, indent=2)}")
-                list.remove(id)
+                data = self.core.subscription_handler.get_subscription(id)
             except ResourceNotFound:
                 raise ResourceNotFound(path)
+            breaker = self.destination_breaker(data['Destination'])
+            if not breaker.allow_request():
+                logger.debug(f"Event destination {id} is unreachable, skipping.")
+                self.check_subscription_suspension(id, breaker)
+                continue
+            try:
+                resp = requests.post(data['Destination'], json=payload, headers=data['HttpHeaders'],
+                                     timeout=self.delivery_timeout)
+                resp.raise_for_status()
+                breaker.record_success()
+                forwarded.append(id)
+            except (requests.exceptions.RequestException) as e:
+                logger.warning(f"Unable to contact event destination {id} for event , skipping.")
+                logger.debug(f"Event log: \n{json.dumps(payload, indent=2)}")
+                breaker.record_failure()
+                self.check_subscription_suspension(id, breaker)
+            finally:
+                # no-op if the outcome was recorded
+                breaker.release_probe()
 
         # if forwarding status is okay it returns the list of subscribers to whom the event was forwarded
-        return list
-
-    def check_subdirs(self, origin):
-        keylist = list(subscriptions["OriginResources"].keys())
-        to_forward = []
-        for el in keylist:
-            if '/*' in el:
-                base_origin = el.replace("/*", "")
-                if base_origin in origin:
-                        for id in subscriptions["OriginResources"][el]:
-                            to_forward.append(id)
-        
-        return to_forward
+        return forwarded
+
+    def destination_breaker(self, destination: str) -> CircuitBreaker:
+        with self._destinations_lock:
+            if destination not in self.destinations_health:
+                self.destinations_health[destination] = CircuitBreaker(**self.delivery_breaker_conf)
+            return self.destinations_health[destination]
+
+    def reset_destination(self, destination: str):
+        """Closes the circuit breaker of an event destination, e.g. when its suspended subscription is enabled again."""
+        with self._destinations_lock:
+            breaker = self.destinations_health.get(destination)
+        if breaker is not None:
+            breaker.reset()
+
+    def check_subscription_suspension(self, id, breaker: CircuitBreaker):
+        if breaker.open_for() > self.delivery_suspend_after:
+            logger.warning(f"Event destination of subscription {id} unreachable for too long, suspending it.")
+            self.core.subscription_handler.suspend_subscription(id)
+
+    def delivery_health(self) -> dict:
+        """Returns the health of every event destination contacted so far."""
+        with self._destinations_lock:
+            destinations = dict(self.destinations_health)
+        return {destination: breaker.status() for destination, breaker in destinations.items()}
 
     def find_subscriber_context(self, destination):
         # look up the subscriber's "Context" for the given event Destination
-        #pdb.set_trace()
-        context = ""
-        try:
-            subscribers_list = self.storage_backend.read(
-                    os.path.join(self.conf["redfish_root"],
-                    "EventService", "Subscriptions")
-                    )
-            logger.debug(f"subscribers: {subscribers_list}")
-            for member in subscribers_list['Members']:
-                logger.debug(f"checking {member}")
-                subscriber = self.storage_backend.read(member["@odata.id"])
-                if subscriber['Destination'] == destination:
-                    context=subscriber['Context']
-                    logger.info(f"Found matching Destination in {member}")
-
-        except Exception:
+        context = self.subscription_handler.find_destination_context(destination)
+        if context:
+            logger.info(f"Found matching Destination {destination}")
+        else:
             logger.info(f"failed to find a matching Destination")
-
         return context
 
 
     def bfsInspection(self, node, aggregation_source):
-        queue = []
-        visited = []
-        fetched = []
-        notfound = []
-        uploaded = []
-        visited.append(node['@odata.id'])
-        queue.append(node['@odata.id'])
-
-        def handleNestedObject(self, obj):
-            if type(obj) == list:
-                for entry in obj:
-                    if type(entry) == list or type(entry) == dict:
-                        handleNestedObject(self, entry)
-            if type(obj) == dict:
-                for key,value in obj.items():
-                    if key == '@odata.id':
-                        RedfishEventHandler.handleEntryIfNotVisited(self, value, visited, queue)
-                    elif key != "Sunfish_RM" and (type(value) == list or type(value) == dict):
-                        handleNestedObject(self, value) # need to ignore Sunfish_RM paths; they are wrong namespace
-
-        while queue:
-            queue = sorted(queue)
-            id = queue.pop(0)
-            redfish_obj = RedfishEventHandler.fetchResourceAndTree(self, id, aggregation_source, \
-                          visited, queue, fetched)
-
-            if redfish_obj is None:  # we failed to locate it in aggregation_source
-                notfound.append(id)
-            if redfish_obj is None or type(redfish_obj) != dict:
-                logger.info(f"Resource - {id} - not available")
-                continue
+        # the GETs to the agent are sent in parallel by the inspection engine, the resources returned are
+        # processed one at a time, parents first, by this thread
+        inspection_conf = self.conf.get("inspection", {})
+        # agents supporting $expand return the collections with their members inline
+        expand = None
+        if inspection_conf.get("expand", False):
+            expand = RedfishEventHandler.agentExpandQuery(self, aggregation_source,
+                                                          inspection_conf.get("expand_levels", 1))
 
-            for key, val in redfish_obj.items():
-                if key == '@odata.id':
-                    pass
-                #  keep extracting nested @odata.id references from the currently fetched object
-                elif type(val) == list or type(val) == dict:
-                    handleNestedObject(self, val)
-        logger.info("\n\nattempted to fetch the following URIs:\n")
-        logger.info(json.dumps(sorted(fetched),indent = 4))
-        logger.info("\n\nAgent did not return objects for the following URIs:\n")
-        logger.info(json.dumps(sorted(notfound),indent = 4))
-        
-        # now need to revisit all uploaded objects and update any links renamed after
-        # the uploaded object was written
-        RedfishEventHandler.updateAllAliasedLinks(self,aggregation_source)
-        # now we need to re-direct any boundary port link references
-        # this needs to be done on ALL agents, not just the one we just uploaded
-        RedfishEventHandler.updateAllAgentsRedirectedLinks(self)
+        owning_agent_id = aggregation_source["@odata.id"].split("/")[-1]
+        state_dir = os.path.join(self.conf["backend_conf"]["fs_private"], "InspectionState")
+        # the incremental inspection only writes the resources new or changed since the last inspection
+        sync = None
+        # "URI": True if the resource is a boundary port, for the resources written by the incremental inspection
+        affected = {}
+        if inspection_conf.get("incremental", False):
+            sync = InspectionSyncState(os.path.join(state_dir, f"{owning_agent_id}.json"))
+
+        # an interrupted inspection starting from the same resource is resumed from its last checkpoint, the
+        # checkpoints are only worth their writes for the agents too large to be inspected in one go
+        checkpoint = None
+        resume = None
+        checkpoint_every = inspection_conf.get("checkpoint_every", 0)
+        if checkpoint_every:
+            checkpoint = InspectionCheckpoint(os.path.join(state_dir, f"{owning_agent_id}.checkpoint.json"))
+            resume = checkpoint.load(node['@odata.id'])
+            if resume:
+                affected.update(resume.get("Affected", {}))
+
+        def save_checkpoint(state):
+            # the resources uploaded so far are saved in the AggregationSource, so they are still known as owned
+            # by the agent after a restart
+            self.storage_backend.replace(aggregation_source)
+            if sync is not None:
+                sync.save()
+            state["Affected"] = affected
+            checkpoint.save(state)
+
+        # large agent responses are decoded member by member while they are read
+        max_expanded_members = inspection_conf.get("max_expanded_members", 1000)
+
+        def fetch(obj_id, conditional=True):
+            resource_endpoint = aggregation_source["HostName"] + obj_id
+            if expand:
+                resource_endpoint = f"{resource_endpoint}?{expand}"
+            headers = {}
+            if conditional and sync is not None and sync.etag(obj_id):
+                headers["If-None-Match"] = sync.etag(obj_id)
+            logger.info(f"fetch: {resource_endpoint}")
+            on_member = None
+            if expand:
+                kept = itertools.count()
+
+                def on_member(member):
+                    # the members expanded beyond the budget are fetched on their own later, instead of being
+                    # held in memory with the collection
+                    if next(kept) < max_expanded_members or type(member) != dict or "@odata.id" not in member:
+                        return member
+                    return {"@odata.id": member["@odata.id"]}
+            with requests.get(resource_endpoint, headers=headers, stream=True) as response:
+                body = load_response(response, on_member) if response.status_code == 200 else None
+                return AgentResponse(response.status_code, body, response.headers.get("ETag"))
+
+        def process(obj_id, fetched):
+            if sync is None:
+                return RedfishEventHandler.fetchResource(self, obj_id, aggregation_source, fetched=fetched)
+            return RedfishEventHandler.syncResource(self, obj_id, aggregation_source, fetched, fetch, sync, affected)
+
+        engine = InspectionEngine(fetch, process, workers=inspection_conf.get("workers", 8),
+                                  expanded=expand is not None, checkpoint=save_checkpoint if checkpoint else None,
+                                  checkpoint_every=checkpoint_every)
+        visited = engine.run(node['@odata.id'], resume=resume)
+        fetched = engine.fetched
+        notfound = engine.notfound
+        logger.info(f"attempted to fetch {len(fetched)} URIs, the agent did not return {len(notfound)} of them")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"attempted to fetch the following URIs: {sorted(fetched)}")
+            logger.debug(f"Agent did not return objects for the following URIs: {sorted(notfound)}")
+
+        if sync is not None:
+            sync.save()
+            logger.info(f"{len(affected)} resources new or changed since the last inspection")
+        # the links are rewritten while no other agent is renaming its resources or redirecting the links
+        with self.cross_agent_lock:
+            if sync is None:
+                # now need to revisit all uploaded objects and update any links renamed after
+                # the uploaded object was written
+                RedfishEventHandler.updateAllAliasedLinks(self,aggregation_source)
+                # now we need to re-direct any boundary port link references
+                # this needs to be done on ALL agents, not just the one we just uploaded
+                RedfishEventHandler.updateAllAgentsRedirectedLinks(self)
+            else:
+                # only the objects just written can contain links to rename or to redirect
+                if affected:
+                    RedfishEventHandler.updateAllAliasedLinks(self, aggregation_source, list(affected))
+                if any(affected.values()):
+                    RedfishEventHandler.updateAllAgentsRedirectedLinks(self)
+        if checkpoint is not None:
+            checkpoint.clear()
 
         return visited  
 
+    def agentExpandQuery(self, aggregation_source, levels):
+        # returns the $expand query supported by the agent, None if the agent does not support it
+        # the capability is detected once per agent, the following inspections reuse it
+        key = (aggregation_source["@odata.id"], aggregation_source["HostName"], levels)
+        expand_queries = self.event_handler.expand_queries
+        if key in expand_queries:
+            return expand_queries[key]
+        service_root = aggregation_source["HostName"] + self.conf["redfish_root"]
+        try:
+            response = requests.get(service_root)
+            if response.status_code == 200:
+                expand_queries[key] = expand_query(response.json(), levels)
+                return expand_queries[key]
+        except (requests.exceptions.RequestException, ValueError):
+            logger.debug(f"cannot read the ProtocolFeaturesSupported of {service_root}")
+        return None
+
     def create_uploaded_object(self, path: str, payload: dict):
         # before to add the ID and to call the methods there should be the json validation
 
@@ -443,41 +557,21 @@ class RedfishEventHandler(EventHandlerInterface):
                 return response
         return
     
-    def handleEntryIfNotVisited(self,entry, visited, queue):
-        if entry not in visited:
-            visited.append(entry)
-            queue.append(entry)
-
-    def fetchResourceAndTree(self, id, aggregation_source, visited, queue, fetched): # if have no parent dirs
-        path_nodes = id.split("/")
-        need_parent_prefetch = False
-        for node_position in range(4, len(path_nodes) - 1):
-            redfish_path = f'/redfish/v1/{"/".join(path_nodes[3:node_position + 1])}'
-            logger.info(f"Checking redfish path: {redfish_path}")
-            if redfish_path not in visited:  
-                need_parent_prefetch = True
-                logger.info(f"Inspect redfish path: {redfish_path}")
-                queue.append(redfish_path)
-                visited.append(redfish_path)
-        if need_parent_prefetch:  # requeue this id and return 'None'
-            queue.append(id)
-        else:  # all grand-parent objects have been visited
-            # go get this object from the aggregation_source
-            # fetchResource() will also create the Sunfish copy, if appropriate
-            redfish_obj = RedfishEventHandler.fetchResource(self, id, aggregation_source)
-            fetched.append(id)
-            return redfish_obj
-    
-    def fetchResource(self, obj_id, aggregation_source):
+    def fetchResource(self, obj_id, aggregation_source, fetched=None):
         # only called if all grand-parent objects have been put in queue, sorted, inspected, and already fetched.
         # The parent object, if not a collection, will also have already been fetched
         # this routine will also call create and/or merge the object into Sunfish database
-        resource_endpoint = aggregation_source["HostName"] + obj_id
-        logger.info(f"fetch: {resource_endpoint}")
-        response = requests.get(resource_endpoint)
-
-        if response.status_code == 200: # Agent must have returned this object
-            redfish_obj = response.json()
+        # fetched is the (status code, object) returned by the agent for obj_id if it was already requested
+        # (e.g., by the inspection engine)
+        if fetched is None:
+            resource_endpoint = aggregation_source["HostName"] + obj_id
+            logger.info(f"fetch: {resource_endpoint}")
+            with requests.get(resource_endpoint, stream=True) as response:
+                fetched = AgentResponse(response.status_code,
+                                        load_response(response) if response.status_code == 200 else None)
+        redfish_obj = fetched.body
+
+        if fetched.status_code == 200: # Agent must have returned this object
             # however, it must be a minimally valid object
             # This would be a great spot to insert a call to a Redfish schema validation function
             # that could return a grading of this new redfish_obj: [PASS, FAIL, CAUTIONS] 
@@ -486,8 +580,10 @@ class RedfishEventHandler(EventHandlerInterface):
             if '@odata.id' in redfish_obj and '@odata.type' in redfish_obj:
 
                 # now rename if necessary and copy object into Sunfish inventory
-                redfish_obj = RedfishEventHandler.createInspectedObject(self,redfish_obj, aggregation_source)
-                if redfish_obj['@odata.id'] not in aggregation_source["Links"]["ResourcesAccessed"]:
+                # the names, the aliases and the boundary ports are shared with the agents inspected concurrently
+                with self.cross_agent_lock:
+                    redfish_obj = RedfishEventHandler.createInspectedObject(self,redfish_obj, aggregation_source)
+                if self.resource_ownership.add_resource(aggregation_source, redfish_obj['@odata.id']):
                     aggregation_source["Links"]["ResourcesAccessed"].append(redfish_obj['@odata.id'])
                 return redfish_obj
             else:
@@ -496,10 +592,61 @@ class RedfishEventHandler(EventHandlerInterface):
         else: # Agent did not successfully return the obj_id sought
             # we still need to check the obj_id for an aliased parent segment
             # so we detect renamed navigation links 
-            sunfish_aliased_URI = RedfishEventHandler.xlateToSunfishPath(self, obj_id, aggregation_source)
-            if obj_id != sunfish_aliased_URI:
-                RedfishEventHandler.updateSunfishAliasDB(self, sunfish_aliased_URI, obj_id, aggregation_source)
+            with self.cross_agent_lock:
+                sunfish_aliased_URI = RedfishEventHandler.xlateToSunfishPath(self, obj_id, aggregation_source)
+                if obj_id != sunfish_aliased_URI:
+                    RedfishEventHandler.updateSunfishAliasDB(self, sunfish_aliased_URI, obj_id, aggregation_source)
+
+
+    def syncResource(self, obj_id, aggregation_source, fetched, fetch, sync, affected):
+        # incremental inspection: the resources not changed since the last inspection are skipped, only their
+        # links are followed. The resources written are recorded in affected.
+        agent_uri = aggregation_source["@odata.id"]
+        sunfish_uri = sync.sunfish_uri(obj_id)
+        stored = sunfish_uri is not None and self.resource_ownership.owns(agent_uri, sunfish_uri)
+        if stored and sync.unchanged(obj_id, fetched):
+            return sync.links_of(obj_id)
+        if fetched.status_code == 304:
+            # the Sunfish copy was removed in the meantime, the resource is needed again
+            fetched = fetch(obj_id, conditional=False)
+        if fetched.status_code != 200 or type(fetched.body) != dict:
+            sync.forget(obj_id)
+            return RedfishEventHandler.fetchResource(self, obj_id, aggregation_source, fetched=fetched)
+
+        body_hash = sync.content_hash(fetched.body)
+        if stored:
+            redfish_obj = RedfishEventHandler.updateInspectedObject(self, fetched.body, sunfish_uri, aggregation_source)
+        else:
+            redfish_obj = RedfishEventHandler.fetchResource(self, obj_id, aggregation_source, fetched=fetched)
+        if redfish_obj is not None:
+            sync.update(obj_id, fetched, body_hash, redfish_obj)
+            boundary_component = redfish_obj.get("Oem", {}).get("Sunfish_RM", {}).get("BoundaryComponent")
+            affected[redfish_obj['@odata.id']] = boundary_component == "BoundaryPort"
+        return redfish_obj
 
+    def updateInspectedObject(self, redfish_obj, sunfish_uri, aggregation_source):
+        # a resource uploaded by the agent changed since the last inspection: its Sunfish copy is replaced keeping
+        # the Sunfish name and the Sunfish_RM properties assigned when it was first uploaded
+        agent_redfish_URI = redfish_obj['@odata.id']
+        redfish_obj['@odata.id'] = sunfish_uri
+        if 'Id' in redfish_obj and redfish_obj['Id'] == agent_redfish_URI.split("/")[-1]:
+            redfish_obj['Id'] = sunfish_uri.split("/")[-1]
+        if 'Collection' in redfish_obj['@odata.type']:
+            # collections are not stored
+            return redfish_obj
+        with self.cross_agent_lock:
+            try:
+                existing_obj = self.storage_backend.read(sunfish_uri)
+            except ResourceNotFound:
+                existing_obj = {}
+            if managing_agent(existing_obj) != aggregation_source["@odata.id"]:
+                # e.g., a fabric shared with another agent, handled as a new upload
+                redfish_obj['@odata.id'] = agent_redfish_URI
+                return RedfishEventHandler.createInspectedObject(self, redfish_obj, aggregation_source)
+        redfish_obj.setdefault("Oem", {})["Sunfish_RM"] = existing_obj["Oem"]["Sunfish_RM"]
+        logger.info(f"updating object: {sunfish_uri}")
+        self.storage_backend.replace(redfish_obj)
+        return redfish_obj
 
     def createInspectedObject(self,redfish_obj, aggregation_source):
         if '@odata.id' in redfish_obj:
@@ -534,7 +681,7 @@ class RedfishEventHandler(EventHandlerInterface):
 
             if os.path.exists(fs_full_path):
                 uploading_agent_uri= aggregation_source["@odata.id"]
-                existing_obj = self.get_object(file_path)
+                existing_obj = self.storage_backend.read(file_path)
                 modified_existing_obj = False
                 existing_agent_uri = existing_obj["Oem"]["Sunfish_RM"]["ManagingAgent"]["@odata.id"]
                 logger.debug(f"managingAgent of Sunfish {obj_path} is {uploading_agent_uri}")
@@ -597,19 +744,7 @@ class RedfishEventHandler(EventHandlerInterface):
     def xlateToSunfishPath(self,agent_path, aggregation_source):
         # redfish_obj uses agent namespace
         # aggregation_source is an object in the Sunfish namespace
-        # will eventually replace file read & load of aliasDB with aliasDB passed in as arg
-        try:
-            uri_alias_file = os.path.join(os.getcwd(), self.conf["backend_conf"]["fs_private"], 'URI_aliases.json')
-            if os.path.exists(uri_alias_file):
-                with open(uri_alias_file, 'r') as data_json:
-                    uri_aliasDB = json.load(data_json)
-                    data_json.close()
-            else:
-                logger.error(f"alias file {uri_alias_file} not found")
-                raise Exception 
-
-        except:
-            raise Exception
+        uri_aliasDB = self.alias_db.data
 
         agentGiven_segments = agent_path.split("/")
         owning_agent_id = aggregation_source["@odata.id"].split("/")[-1]
@@ -631,19 +766,9 @@ class RedfishEventHandler(EventHandlerInterface):
             agent_path = agentFinal_obj_path
         return agent_path
 
-    def updateAllAliasedLinks(self,aggregation_source):
-        try:
-            uri_alias_file = os.path.join(os.getcwd(), self.conf["backend_conf"]["fs_private"], 'URI_aliases.json')
-            if os.path.exists(uri_alias_file):
-                with open(uri_alias_file, 'r') as data_json:
-                    uri_aliasDB = json.load(data_json)
-                    data_json.close()
-            else:
-                logger.error(f"alias file {uri_alias_file} not found")
-                raise Exception 
-
-        except:
-            raise Exception
+    def updateAllAliasedLinks(self,aggregation_source, uris=None):
+        # uris restricts the update to some of the objects uploaded by the agent
+        uri_aliasDB = self.alias_db.data
 
         
         owning_agent_id = aggregation_source["@odata.id"].split("/")[-1]
@@ -654,58 +779,29 @@ class RedfishEventHandler(EventHandlerInterface):
         if owning_agent_id in uri_aliasDB['Agents_xref_URIs']:
             # grab the k,v aliases structure and the list of URIs for owned objects
             if 'aliases' in uri_aliasDB['Agents_xref_URIs'][owning_agent_id]:
-                agent_aliases = uri_aliasDB['Agents_xref_URIs'][owning_agent_id]['aliases']
-                agent_uploads = aggregation_source["Links"]["ResourcesAccessed"] 
+                agent_uploads = aggregation_source["Links"]["ResourcesAccessed"] if uris is None else uris
 
+            translator = self.alias_db.translator(owning_agent_id)
             #  update all the objects
             for upload_obj_URI in agent_uploads:
                 logger.debug(f"updating links in obj: {upload_obj_URI}")
-                RedfishEventHandler.updateObjectAliasedLinks(self, upload_obj_URI, agent_aliases)
+                RedfishEventHandler.updateObjectAliasedLinks(self, upload_obj_URI, translator)
 
         return   
 
-    def updateObjectAliasedLinks(self, object_URI, agent_aliases):
-
-        def findNestedURIs(self, URI_to_match, URI_to_sub, obj, path_to_nested_URI):
-            #pdb.set_trace()
-            nestedPaths = []
-            if type(obj) == list:
-                i = 0;
-                for entry in obj:
-                    if type(entry) == list or type(entry) == dict:
-                        nestedPaths.extend( findNestedURIs(self, URI_to_match, URI_to_sub, entry, path_to_nested_URI+"["+str(i)+"]"))
-                    else:
-                        i=i+1
-            if type(obj) == dict:
-                for key,value in obj.items():
-                    if key == '@odata.id'and path_to_nested_URI != "":
-                        # check @odata.id: value for an alias
-                        if value == URI_to_match:
-                            logger.info(f"modifying {value} to {URI_to_sub}")
-                            obj[key] = URI_to_sub
-                            nestedPaths.append(path_to_nested_URI)
-                    elif key != "Sunfish_RM" and (type(value) == list or type(value) == dict):
-                        nestedPaths.extend(findNestedURIs(self, URI_to_match, URI_to_sub, value, path_to_nested_URI+"["+key+"]" ))
-            return nestedPaths
-
+    def updateObjectAliasedLinks(self, object_URI, translator):
+        # translator holds the aliases of the agent, every object is visited once whatever the number of aliases
         try:
             sunfish_obj = self.storage_backend.read( object_URI)
-            obj_type = redfish_obj["@odata.type"].split('.')[0]
+            obj_type = sunfish_obj["@odata.type"].split('.')[0]
             obj_type = obj_type.split("/")[-1]
             obj_type = obj_type.replace("#","") # #Évent -> Event 
             # should not do aliasing on the members of a Collection
             # since the members list should contain both original and aliased URIs
             if "Collection" not in obj_type :
-                aliasedNestedPaths=[]
-                obj_modified = False
-                for agent_URI, sunfish_URI in agent_aliases.items():
-                    # find all the references to the aliased agent_URI and replace it
-                    path_to_nested_URI=""
-                    aliasedNestedPaths= findNestedURIs(self, agent_URI, sunfish_URI, sunfish_obj, path_to_nested_URI )
-                    if aliasedNestedPaths:
-                        obj_modified = True
-                if obj_modified:
-                    logger.info(json.dumps(sunfish_obj, indent=2))
+                aliasedNestedPaths = translator.rewrite(sunfish_obj)
+                if aliasedNestedPaths:
+                    logger.info(f"updated the links of {object_URI} at {aliasedNestedPaths}")
                     self.storage_backend.replace(sunfish_obj)
 
         except:
@@ -713,19 +809,7 @@ class RedfishEventHandler(EventHandlerInterface):
 
     def updateAllAgentsRedirectedLinks(self ):
         # after renaming all links, need to redirect the placeholder links
-        # will eventually replace file read & load of aliasDB with aliasDB passed in as arg
-        try:
-            uri_alias_file = os.path.join(os.getcwd(), self.conf["backend_conf"]["fs_private"], 'URI_aliases.json')
-            if os.path.exists(uri_alias_file):
-                with open(uri_alias_file, 'r') as data_json:
-                    uri_aliasDB = json.load(data_json)
-                    data_json.close()
-            else:
-                logger.error(f"alias file {uri_alias_file} not found")
-                raise Exception 
-
-        except:
-            raise Exception
+        uri_aliasDB = self.alias_db.data
 
 
         modified_aliasDB = False
@@ -771,9 +855,7 @@ class RedfishEventHandler(EventHandlerInterface):
 
 
         if modified_aliasDB:
-            with open(uri_alias_file,'w') as data_json:
-                json.dump(uri_aliasDB, data_json, indent=4, sort_keys=True)
-                data_json.close()
+            self.alias_db.changed()
         return 
 
 
@@ -932,18 +1014,7 @@ class RedfishEventHandler(EventHandlerInterface):
         
 
     def updateSunfishAliasDB(self,sunfish_URI, agent_URI, aggregation_source):
-        try:
-            uri_alias_file = os.path.join(os.getcwd(), self.conf["backend_conf"]["fs_private"], 'URI_aliases.json')
-            if os.path.exists(uri_alias_file):
-                with open(uri_alias_file, 'r') as data_json:
-                    uri_aliasDB = json.load(data_json)
-                    data_json.close()
-            else:
-                logger.error(f"alias file {uri_alias_file} not found")
-                raise Exception 
-
-        except:
-            raise Exception
+        uri_aliasDB = self.alias_db.data
 
         owning_agent_id = aggregation_source["@odata.id"].split("/")[-1]
         logger.debug(f"updating aliases for : {owning_agent_id}")
@@ -961,9 +1032,7 @@ class RedfishEventHandler(EventHandlerInterface):
             uri_aliasDB["Sunfish_xref_URIs"]["aliases"][sunfish_URI].append(agent_URI)
 
         # now need to write aliasDB back to file
-        with open(uri_alias_file,'w') as data_json:
-            json.dump(uri_aliasDB, data_json, indent=4, sort_keys=True)
-            data_json.close()
+        self.alias_db.changed()
 
         return uri_aliasDB
 
@@ -1021,18 +1090,7 @@ class RedfishEventHandler(EventHandlerInterface):
         # redfish_obj uses agent namespace
         # aggregation_source is an object in the Sunfish namespace
         # this routine ONLY renames the @Odata.id and "id"
-        try:
-            uri_alias_file = os.path.join(os.getcwd(), self.conf["backend_conf"]["fs_private"], 'URI_aliases.json')
-            if os.path.exists(uri_alias_file):
-                with open(uri_alias_file, 'r') as data_json:
-                    uri_aliasDB = json.load(data_json)
-                    data_json.close()
-            else:
-                logger.error(f"alias file {uri_alias_file} not found")
-                raise Exception 
-
-        except:
-            raise Exception
+        uri_aliasDB = self.alias_db.data
 
         agentGiven_obj_path = redfish_obj['@odata.id']
         agentGiven_segments = agentGiven_obj_path.split("/")
@@ -1072,9 +1130,7 @@ class RedfishEventHandler(EventHandlerInterface):
             uri_aliasDB["Sunfish_xref_URIs"]["aliases"][sunfishGiven_obj_path].append(agentGiven_obj_path)
 
         # now need to write aliasDB back to file
-        with open(uri_alias_file,'w') as data_json:
-            json.dump(uri_aliasDB, data_json, indent=4, sort_keys=True)
-            data_json.close()
+        self.alias_db.changed()
 
         return redfish_obj
 
@@ -1146,18 +1202,7 @@ class RedfishEventHandler(EventHandlerInterface):
             "boundaryPorts":{}
             }
 
-        try:
-            uri_alias_file = os.path.join(os.getcwd(), self.conf["backend_conf"]["fs_private"], 'URI_aliases.json')
-            if os.path.exists(uri_alias_file):
-                with open(uri_alias_file, 'r') as data_json:
-                    uri_aliasDB = json.load(data_json)
-                    data_json.close()
-            else:
-                logger.error(f"alias file {uri_alias_file} not found")
-                raise Exception 
-
-        except:
-            raise Exception
+        uri_aliasDB = self.alias_db.data
 
 
         logger.info(f"---- now processing a boundary port")
@@ -1203,19 +1248,14 @@ class RedfishEventHandler(EventHandlerInterface):
                     uri_aliasDB["Agents_xref_URIs"][owning_agent_id]["boundaryPorts"][localPortURI]\
                                 ["RemotePortId"] = remote_port_id
                     
-                # now need to write aliasDB back to file
+                # the aliasDB is written back below
                 save_alias_file = True
-                with open(uri_alias_file,'w') as data_json:
-                    json.dump(uri_aliasDB, data_json, indent=4, sort_keys=True)
-                    data_json.close()
             else:  
                 logger.debug(f"---- CXL BoundaryPort found, but not InterswitchPort, UpstreamPort, or DownstreamPort")
                 pass
         matching_ports = RedfishEventHandler.match_boundary_port(self, owning_agent_id, localPortURI, uri_aliasDB)
         if matching_ports or save_alias_file:
-            with open(uri_alias_file,'w') as data_json:
-                json.dump(uri_aliasDB, data_json, indent=4, sort_keys=True)
-                data_json.close()
+            self.alias_db.changed()
         logger.debug(f"----- boundary ports matched {matching_ports}")
         return
                     
@@ -20,13 +20,30 @@ class RedfishObjectHandlersTable:
 
     @classmethod
     def EventDestination(cls, core: 'sunfish.lib.core.Core', path: str, operation: SunfishRequestType, payload: dict):
+        # the subscription handler keeps the subscriptions used for routing the events, it must be kept in sync
+        # with the subscriptions stored
+        id = path.rstrip("/").split("/")[-1]
         if operation == SunfishRequestType.CREATE:
             core.subscription_handler.new_subscription(payload)
         elif operation == SunfishRequestType.REPLACE or operation == SunfishRequestType.PATCH:
-            core.subscription_handler.delete_subscription(payload)
-            core.subscription_handler.new_subscription(payload)
+            stored = core.storage_backend.read(path)
+            subscription = dict(payload)
+            if operation == SunfishRequestType.PATCH:
+                # a patch carries only the properties to be modified
+                subscription = dict(stored)
+                subscription.update(payload)
+            subscription.setdefault("Id", id)
+            if subscription["Id"] != id:
+                core.subscription_handler.delete_subscription(id)
+            # the new version replaces the one registered with the same Id
+            core.subscription_handler.new_subscription(subscription)
+            suspended = ["Disabled", "StandbyOffline"]
+            if stored.get("Status", {}).get("State") in suspended and \
+                    subscription.get("Status", {}).get("State") not in suspended:
+                # the subscription enabled again is not suspended because its destination was unreachable before
+                core.event_handler.reset_destination(subscription["Destination"])
         elif operation == SunfishRequestType.DELETE:
-            core.subscription_handler.delete_subscription(path)
+            core.subscription_handler.delete_subscription(id)
 
 
 class RedfishObjectHandler(ObjectHandlerInterface):
@@ -10,6 +10,7 @@ import string
 import requests
 
 from sunfish.lib.exceptions import AgentForwardingFailure
+from sunfish.lib.json_stream import load_response
 from sunfish.models.types import *
 import sunfish
 import pdb
@@ -30,6 +31,8 @@ class Agent:
         self.redfish_path: string = redfish_path
         self.sunfish_core: 'sunfish.lib.core.Core' = sunfish_core
         self.aggregation_source: dict = self.sunfish_core.storage_backend.read(redfish_path)
+        # seconds to wait for the agent, so requests to an unreachable agent don't hang
+        self.timeout = self.sunfish_core.conf.get("agent_forwarding", {}).get("timeout", 10)
 
     def get_id(self) -> string:
         return self.aggregation_source["@odata.id"]
@@ -38,61 +41,67 @@ class Agent:
     def is_agent_managed(cls, sunfish_core: 'sunfish.lib.core.Core', path: string):
         # if this is a top level resource, there's no need to check for the agent as no agent can own top level ones.
         # Example of top levels is Systems, Chassis, etc...
-        path_to_owner = (path.replace(sunfish_core.conf["redfish_root"], "").split("/"))
-        level = len(path_to_owner)
-        if level == 1:
+        # Collections are generally not marked with the managing agent, they inherit the one of their parent.
+        logger.debug(f"Checking if the object {path} is managed by an Agent")
+        agent_path = sunfish_core.resource_ownership.resolve(path)
+        if agent_path is None:
             return None
-
-        # path passed in is to parent object, which is usually a collection
-        collection = sunfish_core.storage_backend.read(path)
-        if 'Collection' in collection["@odata.type"]:
-            print(f"parent obj {path} is a Collection.")
-            new_path = os.path.join('/'.join(path_to_owner[:-1]))
-            print(f"grandparent obj at {new_path}")
-            collection = sunfish_core.storage_backend.read(new_path)
-            logger.debug(f"Checking if the object {new_path} is managed by an Agent")
-            if "Oem" in collection and "Sunfish_RM" in collection["Oem"] and "ManagingAgent" in collection["Oem"]["Sunfish_RM"]:
-                agent_path = collection["Oem"]["Sunfish_RM"]["ManagingAgent"]["@odata.id"]
-                return Agent(sunfish_core, agent_path)
-        else:
-            #
-            logger.debug(f"Checking if the object {path} is managed by an Agent")
-            if "Oem" in collection and "Sunfish_RM" in collection["Oem"] and "ManagingAgent" in collection["Oem"]["Sunfish_RM"]:
-                agent_path = collection["Oem"]["Sunfish_RM"]["ManagingAgent"]["@odata.id"]
-                return Agent(sunfish_core, agent_path)
-
-
-        return None
+        return Agent(sunfish_core, agent_path)
 
     def _forward_get_request(self, path: string) -> dict:
         resource_uri = str(self.aggregation_source["HostName"]) + "/" + path
 
         logger.debug(f"Forwarding resource GET request {resource_uri}")
         try:
-            r = requests.get(resource_uri, headers=self.agent_request_headers)
-            if r.status_code == 200:
-                logger.debug(f"GET request was successful. status code: {r.status_code}, reason {r.reason}")
-                logger.debug(f"Response payload:\n {json.dumps(r.json(), indent=2)}")
-                return r.json()
-            else:
-                logger.debug(f"GET request was unsuccessful. status code: {r.status_code}, reason {r.reason}")
-                raise AgentForwardingFailure(f"creating object {resource_uri} ", r.status_code, r.reason)
+            with requests.get(resource_uri, headers=self.agent_request_headers, timeout=self.timeout,
+                              stream=True) as r:
+                if r.status_code == 200:
+                    logger.debug(f"GET request was successful. status code: {r.status_code}, reason {r.reason}")
+                    payload = load_response(r)
+                    logger.debug("Response payload: %s", payload)
+                    return payload
+                else:
+                    logger.debug(f"GET request was unsuccessful. status code: {r.status_code}, reason {r.reason}")
+                    raise AgentForwardingFailure(f"creating object {resource_uri} ", r.status_code, r.reason)
         except requests.exceptions.RequestException as e:
             logger.error("RequestException")
             logger.error(e)
             raise e
 
+    def get_resource(self, path: string, etag: string = None) -> tuple:
+        """Reads a resource from the agent, revalidating the copy identified by etag if any.
+
+        Returns:
+            tuple: (resource, ETag), resource is None if the copy identified by etag is still valid.
+        Raises:
+            AgentForwardingFailure: if the agent does not return the resource.
+        """
+        resource_uri = str(self.aggregation_source["HostName"]) + "/" + path
+        headers = dict(self.agent_request_headers)
+        if etag:
+            headers["If-None-Match"] = etag
+
+        logger.debug(f"Reading resource {resource_uri}")
+        with requests.get(resource_uri, headers=headers, timeout=self.timeout, stream=True) as r:
+            if r.status_code == 304:
+                return None, etag
+            if r.status_code == 200:
+                return load_response(r), r.headers.get("ETag")
+        logger.debug(f"GET request was unsuccessful. status code: {r.status_code}, reason {r.reason}")
+        raise AgentForwardingFailure(f"reading object {resource_uri} ", r.status_code, r.reason)
+
     def _forward_create_request(self, path: string, payload: dict) -> dict:
         #pdb.set_trace()
         resource_uri = str(self.aggregation_source["HostName"]) + "/" + path
 
         logger.debug(f"Forwarding resource CREATE request {resource_uri}")
         try:
-            r = requests.post(resource_uri, headers=self.agent_request_headers, data=json.dumps(payload))
+            r = requests.post(resource_uri, headers=self.agent_request_headers, data=json.dumps(payload), timeout=self.timeout)
             if r.status_code == 200:
                 logger.debug(f"CREATE request was successful. status code: {r.status_code}, reason {r.reason}")
-                logger.debug(f"Response payload:\n {json.dumps(r.json(), indent=2)}")
-                return r.json()
+                payload = r.json()
+                logger.debug("Response payload: %s", payload)
+                return payload
             else:
                 logger.debug(f"CREATE request was unsuccessful. status code: {r.status_code}, reason {r.reason}")
                 raise AgentForwardingFailure(f"creating object {resource_uri} ", r.status_code, r.reason)
@@ -106,7 +115,7 @@ class Agent:
 
         logger.debug(f"Forwarding resource DELETE request {resource_uri}")
         try:
-            r = requests.delete(resource_uri, headers=self.agent_request_headers)
+            r = requests.delete(resource_uri, headers=self.agent_request_headers, timeout=self.timeout)
             if r.status_code in [200, 202, 204]:
                 logger.debug(f"DELETE request was successful. status code: {r.status_code}, reason {r.reason}")
                 return {}
@@ -122,11 +131,12 @@ class Agent:
 
         logger.debug(f"Forwarding resource PATCH request {resource_uri}")
         try:
-            r = requests.patch(resource_uri, headers=self.agent_request_headers, data=json.dumps(payload))
+            r = requests.patch(resource_uri, headers=self.agent_request_headers, data=json.dumps(payload), timeout=self.timeout)
             if r.status_code == 200:
                 logger.debug(f"PATCH request was successful. status code: {r.status_code}, reason {r.reason}")
-                logger.debug(f"Response payload:\n {json.dumps(r.json(), indent=2)}")
-                return r.json()
+                payload = r.json()
+                logger.debug("Response payload: %s", payload)
+                return payload
             elif r.status_code == 204:
                 logger.debug(f"PATCH request was successful. status code: {r.status_code}, reason {r.reason}")
                 return {}
@@ -142,11 +152,12 @@ class Agent:
 
         logger.debug(f"Forwarding resource REPLACE request {resource_uri}")
         try:
-            r = requests.patch(resource_uri, headers=self.agent_request_headers, data=json.dumps(payload))
+            r = requests.patch(resource_uri, headers=self.agent_request_headers, data=json.dumps(payload), timeout=self.timeout)
             if r.status_code == 200:
                 logger.debug(f"REPLACE request was successful. status code: {r.status_code}, reason {r.reason}")
-                logger.debug(f"Response payload:\n {json.dumps(r.json(), indent=2)}")
-                return r.json()
+                payload = r.json()
+                logger.debug("Response payload: %s", payload)
+                return payload
             else:
                 logger.debug(f"REPLACE request was unsuccessful. status code: {r.status_code}, reason {r.reason}")
                 raise AgentForwardingFailure(f"replacing object {resource_uri} ", r.status_code, r.reason)
@@ -5,8 +5,9 @@ import logging
 import string
 from typing import Optional
 import pdb
-import os
-import json
+import threading
+
+import requests
 
 import sunfish.lib.core
 from sunfish_plugins.objects_managers.sunfish_agent.agents_management import Agent
@@ -21,6 +22,75 @@ class SunfishAgentManager(ObjectManagerInterface):
 
     def __init__(self, core: 'sunfish.lib.core.Core'):
         self.core = core
+        # Agent instances, keyed by the @odata.id of their AggregationSource
+        self._agents = {}
+        self._agents_lock = threading.Lock()
+        # an Agent is created again when its AggregationSource is modified
+        core.resource_ownership.add_listener(self._forget_agent)
+
+    def get_agent(self, agent_path: string) -> Agent:
+        with self._agents_lock:
+            agent = self._agents.get(agent_path)
+        if agent is None:
+            agent = Agent(self.core, agent_path)
+            with self._agents_lock:
+                agent = self._agents.setdefault(agent_path, agent)
+            self.core.agent_health.track(agent_path, agent.aggregation_source["HostName"])
+        return agent
+
+    def read_through(self, agent: Agent, path: string) -> dict:
+        """Reads an agent managed resource through the read-through cache.
+        Cached copies are served until their time to live expires, then they are revalidated with the agent.
+        """
+        cache = self.core.read_through_cache
+        cached, etag, fresh = cache.lookup(path)
+        if fresh:
+            return cached
+        # the agent may know the resource with a different URI
+        lookup = {"@odata.id": path, "Id": path.rstrip("/").split("/")[-1]}
+        self.xlateToAgentURIs(lookup)
+        resource, etag = self.core.agent_forwarding.run(agent.get_id(), self._forward, agent, agent.get_resource,
+                                                        lookup["@odata.id"], etag=etag if cached else None)
+        if resource is None:
+            # not modified
+            cache.refresh(path)
+            return cached
+        resource.setdefault("Oem", {}).setdefault("Sunfish_RM", {})["ManagingAgent"] = {"@odata.id": agent.get_id()}
+        self.xlateToSunfishURIs(resource)
+        cache.store(path, resource, etag)
+        return resource
+
+    def _forget_agent(self, path: string):
+        with self._agents_lock:
+            self._agents.pop(path, None)
+
+    def _forward(self, agent: Agent, function, *args, **kwargs):
+        # requests to an agent known to be down fail immediately
+        agent_health = self.core.agent_health
+        agent_health.check(agent.get_id())
+        recorded = False
+        try:
+            response = function(*args, **kwargs)
+            agent_health.record_success(agent.get_id())
+            recorded = True
+        except requests.exceptions.RequestException:
+            agent_health.record_failure(agent.get_id())
+            recorded = True
+            raise
+        except AgentForwardingFailure as e:
+            if e.error_code >= 500:
+                agent_health.record_failure(agent.get_id())
+                recorded = True
+            elif e.error_code >= 0:
+                # the agent answered
+                agent_health.record_success(agent.get_id())
+                recorded = True
+            raise
+        finally:
+            if not recorded:
+                # e.g., the request failed before reaching the agent, the breaker must not wait for its outcome
+                agent_health.release_probe(agent.get_id())
+        return response
 
     def forward_to_manager(self, request_type: 'sunfish.models.types.SunfishRequestType', path: string, payload: dict = None) -> Optional[dict]:
         uri_aliasDB = {}
@@ -47,7 +117,10 @@ class SunfishAgentManager(ObjectManagerInterface):
             path_to_check = "".join(f"/{e}" for e in path_elems)
             # get the parent path
         logger.debug(f"Checking managing agent for path: {path_to_check}")
-        agent = Agent.is_agent_managed(self.core, path_to_check)
+        agent_path = self.core.resource_ownership.resolve(path_to_check)
+        agent = self.get_agent(agent_path) if agent_path else None
+        if agent and request_type == SunfishRequestType.GET and self.core.read_through_cache is not None:
+            return self.read_through(agent, path)
         if agent:
             logger.debug(f"{path} is managed by an agent, forwarding the request")
             # if no payload, cannot xlateToAgent
@@ -58,7 +131,10 @@ class SunfishAgentManager(ObjectManagerInterface):
             else:
                 restored_path = path
             try:
-                agent_response = agent.forward_request(request_type, restored_path, payload=payload)
+                # the number of requests in flight to the same agent is limited
+                agent_response = self.core.agent_forwarding.run(agent.get_id(), self._forward, agent,
+                                                                agent.forward_request, request_type, restored_path,
+                                                                payload=payload)
             except AgentForwardingFailure as e:
                 raise e
 
@@ -96,169 +172,31 @@ class SunfishAgentManager(ObjectManagerInterface):
         return agent_response
 
     def xlateToAgentURIs(self, sunfish_obj ):
-
-        def findNestedURIs(self, URI_to_match, URI_to_sub, obj, path_to_nested_URI):
-            nestedPaths = []
-            if type(obj) == list:
-                i = 0;
-                for entry in obj:
-                    if type(entry) == list or type(entry) == dict:
-                        nestedPaths.extend( findNestedURIs(self, URI_to_match, URI_to_sub, entry, path_to_nested_URI+"["+str(i)+"]"))
-                    else:
-                        i=i+1
-            if type(obj) == dict:
-                for key,value in obj.items():
-                    if key == '@odata.id'and path_to_nested_URI != "":
-                        # check @odata.id: value for an alias
-                        if value == URI_to_match:
-                            print(f"---- modifying {value} to {URI_to_sub}")
-                            obj[key] = URI_to_sub
-                            nestedPaths.append(path_to_nested_URI)
-                    elif key != "Sunfish_RM" and (type(value) == list or type(value) == dict):
-                        nestedPaths.extend(findNestedURIs(self, URI_to_match, URI_to_sub, value, path_to_nested_URI+"["+key+"]" ))
-            return nestedPaths
-
-
-        try:
-            uri_alias_file = os.path.join(os.getcwd(), self.core.conf["backend_conf"]["fs_private"], 'URI_aliases.json')
-            if os.path.exists(uri_alias_file):
-                logging.debug(f"reading alias file {uri_alias_file}")
-                with open(uri_alias_file, 'r') as data_json:
-                    uri_aliasDB = json.load(data_json)
-                    data_json.close()
-            else:
-                logging.debug(f"alias file {uri_alias_file} not found")
-                #no alias file, so we are done, no modifications done
-                return False
-
-        except:
-            raise Exception
-
-
-        try:
-            sunfish_aliases = uri_aliasDB["Sunfish_xref_URIs"]["aliases"]
-            #pdb.set_trace()
-            object_URI = sunfish_obj["@odata.id"]
-            aliasedNestedPaths=[]
-            obj_modified = False
-            # check the obj ID and initial @odata.id
-            if  object_URI in sunfish_aliases:
-                sunfish_obj["@odata.id"] = sunfish_aliases[object_URI][0]
-                obj_modified = True
-                if sunfish_obj["Id"] == object_URI.split("/")[-1]:
-                    sunfish_obj["Id"] = sunfish_aliases[object_URI][0].split("/")[-1]
-            # now find the nested @odata.id URIs and check them
-            for sunfish_URI, agent_URI in sunfish_aliases.items():
-                # find all the references to the aliased sunfish_URI and replace it
-                path_to_nested_URI=""
-                # TODO agent_URI structure is a list, not a simple text string, v hence this index!
-                aliasedNestedPaths= findNestedURIs(self, sunfish_URI, agent_URI[0], sunfish_obj, path_to_nested_URI )
-                if aliasedNestedPaths:
-                    obj_modified = True
-                for path in aliasedNestedPaths:
-                    print(f"---- replaced {sunfish_URI} with {agent_URI} at {path}")
-            print(f"---- aliasedNestedPaths is {aliasedNestedPaths}")
-            if obj_modified:
-                logger.debug(f"---- object modified")
-                print(f"---- final updated object")
-                print(json.dumps(sunfish_obj, indent=2))
-                pass
-
-            if "Oem" in sunfish_obj and "Sunfish_RM" in sunfish_obj["Oem"] and \
-                    "BoundaryComponent" in sunfish_obj["Oem"]["Sunfish_RM"]:
-                if sunfish_obj["Oem"]["Sunfish_RM"]["BoundaryComponent"] == "BoundaryPort":
-                    # need to check for boundary port redirected links
-                    # TODO
-                    print(f"------ checking for redirected boundary link")
-                    pass
-
-        except:
-            logger.error(f"could not update links in object {object_URI}")
-
-        #return sunfish_obj
-        return obj_modified
-
+        # the Sunfish URIs given to the resources renamed while uploaded are restored to the agent ones
+        return self._xlateURIs(sunfish_obj, self.core.alias_db.translator())
 
     def xlateToSunfishURIs(self, agent_obj ):
-
-        def findNestedURIs(self, URI_to_match, URI_to_sub, obj, path_to_nested_URI):
-            nestedPaths = []
-            if type(obj) == list:
-                i = 0;
-                for entry in obj:
-                    if type(entry) == list or type(entry) == dict:
-                        nestedPaths.extend( findNestedURIs(self, URI_to_match, URI_to_sub, entry, path_to_nested_URI+"["+str(i)+"]"))
-                    else:
-                        i=i+1
-            if type(obj) == dict:
-                for key,value in obj.items():
-                    if key == '@odata.id'and path_to_nested_URI != "":
-                        # check @odata.id: value for an alias
-                        if value == URI_to_match:
-                            print(f"---- modifying {value} to {URI_to_sub}")
-                            obj[key] = URI_to_sub
-                            nestedPaths.append(path_to_nested_URI)
-                    elif key != "Sunfish_RM" and (type(value) == list or type(value) == dict):
-                        nestedPaths.extend(findNestedURIs(self, URI_to_match, URI_to_sub, value, path_to_nested_URI+"["+key+"]" ))
-            return nestedPaths
-
-
-        try:
-            uri_alias_file = os.path.join(os.getcwd(), self.core.conf["backend_conf"]["fs_private"], 'URI_aliases.json')
-            if os.path.exists(uri_alias_file):
-                print(f"reading alias file {uri_alias_file}")
-                with open(uri_alias_file, 'r') as data_json:
-                    uri_aliasDB = json.load(data_json)
-                    data_json.close()
-            else:
-                print(f"alias file {uri_alias_file} not found")
-                return False
-
-        except:
-            raise Exception
-
-
         try:
-            #pdb.set_trace()
             owning_agent_id = agent_obj["Oem"]["Sunfish_RM"]["ManagingAgent"]["@odata.id"].split("/")[-1]
-            agent_aliases = uri_aliasDB["Agents_xref_URIs"][owning_agent_id]["aliases"]
-            object_URI = agent_obj["@odata.id"]
-            aliasedNestedPaths=[]
-            obj_modified = False
-            # check the obj ID and initial @odata.id
-            if  object_URI in agent_aliases:
-                agent_obj["@odata.id"] = agent_aliases[object_URI]
+        except (KeyError, TypeError):
+            logger.debug(f"no managing agent in object {agent_obj.get('@odata.id')}")
+            return False
+        return self._xlateURIs(agent_obj, self.core.alias_db.translator(owning_agent_id))
+
+    @staticmethod
+    def _xlateURIs(obj, translator) -> bool:
+        # translates the @odata.id and Id of the object, then all its nested links in a single pass
+        object_URI = obj.get("@odata.id")
+        obj_modified = False
+        if object_URI is not None:
+            translated_URI = translator.translate(object_URI)
+            if translated_URI != object_URI:
+                obj["@odata.id"] = translated_URI
                 obj_modified = True
-                if agent_obj["Id"] == object_URI.split("/")[-1]:
-                    agent_obj["Id"] = agent_aliases[object_URI].split("/")[-1]
-            # now find the nested @odata.id URIs and check them
-            for agent_URI,sunfish_URI in agent_aliases.items():
-                # find all the references to the aliased sunfish_URI and replace it
-                path_to_nested_URI=""
-                # TODO agent_URI structure is a list, not a simple text string, v hence this index!
-                aliasedNestedPaths= findNestedURIs(self, agent_URI, sunfish_URI, agent_obj, path_to_nested_URI )
-                if aliasedNestedPaths:
-                    obj_modified = True
-                for path in aliasedNestedPaths:
-                    print(f"---- replaced {agent_URI } with {sunfish_URI} at {path}")
-            if obj_modified:
-                logger.debug(f"---- object modified")
-                print(f"---- final updated object")
-                print(json.dumps(agent_obj, indent=2))
-                pass
-
-            if "Oem" in agent_obj and "Sunfish_RM" in agent_obj["Oem"] and \
-                    "BoundaryComponent" in agent_obj["Oem"]["Sunfish_RM"]:
-                if agent_obj["Oem"]["Sunfish_RM"]["BoundaryComponent"] == "BoundaryPort":
-                    # need to check for boundary port redirected links
-                    # TODO
-                    print(f"------ checking for redirected boundary link")
-                    pass
-
-        except:
-            logger.error(f"could not update links in object {object_URI}")
-
-        #return sunfish_obj
-        return obj_modified
-
-
+                if obj.get("Id") == object_URI.split("/")[-1]:
+                    obj["Id"] = translated_URI.split("/")[-1]
+        aliasedNestedPaths = translator.rewrite(obj)
+        if aliasedNestedPaths:
+            logger.debug(f"translated the links of {object_URI} at {aliasedNestedPaths}")
+        # TODO: check for boundary port redirected links
+        return obj_modified or bool(aliasedNestedPaths)
@@ -207,6 +207,7 @@ class BackendFS(BackendInterface):
         # it is the only required required property that other objects doesnt have
 
         logging.info('BackendFS: [POST] success')
+        self._notify(payload['@odata.id'], payload)
         return payload
 
     def replace(self, payload: dict):
@@ -276,6 +277,7 @@ class BackendFS(BackendInterface):
             raise ResourceNotFound(resource_id)
 
         result: str = self.read(payload["@odata.id"])
+        self._notify(result["@odata.id"], result)
 
         return result
 
@@ -295,6 +297,55 @@ class BackendFS(BackendInterface):
         # code that removes a file
         logging.info('BackendFS: remove called')
 
+        removed = []
+        resource_id = self._remove_resource(path, removed)
+        # check links
+        self._remove_links({os.path.join(self.redfish_root, resource_id)})
+        for uri in removed:
+            self._notify(uri)
+
+        return "DELETE: file removed."
+
+    def remove_many(self, paths: list):
+        """Deletes several objects, scanning the dir tree only once for deleting the links to them.
+        The objects contained in another object being deleted are deleted together with it.
+
+        Args:
+            paths (list): reference paths of the resources that should be removed.
+
+        Raises:
+            ActionNotAllowed: it is not possible to remove the whole file system.
+
+        Returns:
+            list: the paths of the resources removed, including the ones contained in the resources requested.
+        """
+        logging.info('BackendFS: remove_many called')
+
+        length = len(self.redfish_root)
+        removed = []
+        removed_uris = set()
+        last_removed = None
+        for path in sorted(paths):
+            resource_id = path[length:].strip('/')
+            uri = os.path.join(self.redfish_root, resource_id)
+            removed_uris.add(uri)
+            if last_removed is not None and (uri + '/').startswith(last_removed + '/'):
+                # already deleted together with its parent
+                continue
+            try:
+                self._remove_resource(path, removed)
+            except ResourceNotFound:
+                continue
+            last_removed = uri
+        removed_uris.update(removed)
+        self._remove_links(removed_uris)
+        for uri in removed:
+            self._notify(uri)
+        return removed
+
+    def _remove_resource(self, path: str, removed: list = None) -> str:
+        # deletes the object directory and its reference from the parent collection, the paths of the object and
+        # of the objects contained in it are appended to removed
         length = len(self.redfish_root)
         resource_id = path[length:]
 
@@ -308,6 +359,11 @@ class BackendFS(BackendInterface):
 
         parent_path = os.path.dirname(full_path)
         json_path = os.path.join(parent_path, 'index.json')
+        if removed is not None:
+            for path, directories, files in os.walk(full_path):
+                if 'index.json' in files:
+                    relative = os.path.relpath(path, full_path)
+                    removed.append(os.path.normpath(os.path.join(self.redfish_root, resource_id.strip('/'), relative)))
         shutil.rmtree(full_path)
 
         try:
@@ -331,10 +387,11 @@ class BackendFS(BackendInterface):
 
         except FileNotFoundError as e:
             raise ResourceNotFound(resource_id)
+        return resource_id
 
-        # check links
+    def _remove_links(self, removed_uris: set):
+        # scans all the dir tree and deletes the links to the removed resources
         to_replace = False
-        first = False
 
         for path, directories, files in os.walk(os.path.join(os.getcwd(), self.root)):
             if 'index.json' in files:
@@ -347,20 +404,20 @@ class BackendFS(BackendInterface):
                     link_list = pdata['Links']
                     to_del = []
                     for link in link_list:
-                        for x in link_list[link]:
+                        for x in list(link_list[link]):
                             if isinstance(link_list[link], list):
                                 to_compare = ""
                                 if type(x) is dict and "@odata.id" in x:
                                     to_compare = x['@odata.id']
                                 elif type(x) is str:
                                     to_compare = x
-                                if to_compare == os.path.join(self.redfish_root, resource_id):
+                                if to_compare in removed_uris:
                                     to_replace = True
                                     link_list[link].remove(x)
                                     if len(link_list[link]) == 0:
                                         to_del.append(link)
                             elif isinstance(link_list[link], dict):
-                                if x == os.path.join(self.redfish_root, resource_id):
+                                if x in removed_uris:
                                     to_del.append(link)
                                     to_replace = True
                     if to_del:
@@ -370,8 +427,8 @@ class BackendFS(BackendInterface):
                         with open(file_path, "w") as file:
                             json.dump(pdata, file, indent=4, sort_keys=True)
                         to_replace = False
-
-        return "DELETE: file removed."
+                        if '@odata.id' in pdata:
+                            self._notify(pdata['@odata.id'], pdata)
 
 
 
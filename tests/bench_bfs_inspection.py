@@ -0,0 +1,83 @@
+# Copyright IBM Corp. 2024
+# This software is available to you under a BSD 3-Clause License.
+# The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
+
+"""CPU cost of the BFS inspection of an agent, without any I/O.
+
+Usage: python -m tests.bench_bfs_inspection [number of resources ...]
+"""
+import sys
+import time
+
+from sunfish_plugins.events_handlers.redfish.inspection import AgentResponse, InspectionEngine, missing_ancestors, \
+    nested_links
+
+
+def synthetic_tree(resources: int) -> dict:
+    """Builds a fabric with switches of 32 ports each, for a total of about the given number of resources."""
+    fabric = "/redfish/v1/Fabrics/CXL"
+    tree = {fabric: {"@odata.id": fabric, "Switches": {"@odata.id": f"{fabric}/Switches"}}}
+    switches = {"@odata.id": f"{fabric}/Switches", "Members": []}
+    tree[switches["@odata.id"]] = switches
+    for switch in range(max(1, resources // 34)):
+        switch_path = f"{fabric}/Switches/{switch}"
+        switches["Members"].append({"@odata.id": switch_path})
+        tree[switch_path] = {"@odata.id": switch_path, "Ports": {"@odata.id": f"{switch_path}/Ports"}}
+        ports = {"@odata.id": f"{switch_path}/Ports", "Members": []}
+        tree[ports["@odata.id"]] = ports
+        for port in range(32):
+            port_path = f"{switch_path}/Ports/{port}"
+            ports["Members"].append({"@odata.id": port_path})
+            tree[port_path] = {"@odata.id": port_path, "Links": {"ConnectedSwitches": [{"@odata.id": switch_path}]}}
+    return tree
+
+
+def legacy_inspection(tree: dict, root_id: str) -> list:
+    """The sorted list frontier used by bfsInspection before the InspectionEngine, for comparison."""
+    queue = [root_id]
+    visited = [root_id]
+    processed = []
+    while queue:
+        queue = sorted(queue)
+        id = queue.pop(0)
+        missing = missing_ancestors(id, visited)
+        if missing:
+            visited.extend(missing)
+            queue.extend(missing)
+            queue.append(id)
+            continue
+        processed.append(id)
+        for link in nested_links(tree.get(id, {})):
+            if link not in visited:
+                visited.append(link)
+                queue.append(link)
+    return processed
+
+
+def bench(resources: int, legacy_limit: int = 20000):
+    tree = synthetic_tree(resources)
+    root_id = "/redfish/v1/Fabrics/CXL"
+    processed = []
+
+    def fetch(uri):
+        return AgentResponse(200, tree[uri]) if uri in tree else AgentResponse(404, None)
+
+    def process(uri, response):
+        processed.append(uri)
+        return response.body
+
+    start = time.process_time()
+    InspectionEngine(fetch, process, workers=1).run(root_id)
+    elapsed = time.process_time() - start
+    result = f"{len(tree):>7} resources: engine {elapsed:8.3f}s"
+    if len(tree) <= legacy_limit:
+        start = time.process_time()
+        legacy = legacy_inspection(tree, root_id)
+        result += f", sorted list {time.process_time() - start:8.3f}s"
+        assert legacy == processed, "the processing order changed"
+    print(result)
+
+
+if __name__ == "__main__":
+    for size in [int(arg) for arg in sys.argv[1:]] or [10000, 20000, 50000, 100000]:
+        bench(size)
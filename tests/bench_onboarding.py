@@ -0,0 +1,61 @@
+# Copyright IBM Corp. 2024
+# This software is available to you under a BSD 3-Clause License.
+# The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
+
+"""Wall clock time of the onboarding of a fleet of simulated agents, through the asynchronous events pipeline.
+
+The pipeline workers are threads, so onboarding several agents at once hides the latency of the agents, while
+the processing of the resources is not spread over several cores.
+
+Usage: python -m tests.bench_onboarding [agents] [switches] [ports] [latency in ms]
+"""
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from sunfish.lib.core import Core
+from tests.simulated_agent import SimulatedFleet
+
+
+def temporary_core(directory: str, workers: int) -> Core:
+    with open(os.path.join(os.path.dirname(__file__), "conf.json")) as f:
+        conf = json.load(f)
+    conf["backend_conf"]["fs_root"] = os.path.join(directory, "Resources")
+    conf["backend_conf"]["fs_private"] = os.path.join(directory, "SunfishPrivate")
+    conf["agent_health"] = {"probe_period": 0}
+    conf["event_pipeline"] = {"workers": workers}
+    os.makedirs(conf["backend_conf"]["fs_private"])
+    with open(os.path.join(conf["backend_conf"]["fs_private"], "URI_aliases.json"), "w") as f:
+        json.dump({"Agents_xref_URIs": {}, "Sunfish_xref_URIs": {"aliases": {}}}, f)
+    return Core(conf)
+
+
+def bench(agents: int, switches: int, ports: int, latency: float, workers: int):
+    with tempfile.TemporaryDirectory() as directory, \
+            SimulatedFleet(agents=agents, switches=switches, ports=ports, latency=latency) as fleet:
+        core = temporary_core(directory, workers)
+        for agent in fleet:
+            core.submit_event(agent.discovered_event())
+        core.event_pipeline.join()
+        start = time.monotonic()
+        for agent in fleet:
+            core.submit_event(agent.created_event())
+        core.event_pipeline.join()
+        elapsed = time.monotonic() - start
+        core.shutdown()
+        metrics = core.get_event_pipeline_metrics()
+        resources = sum(len(agent.resources) for agent in fleet)
+        print(f"{agents:>3} agents, {resources:>6} resources, {workers:>2} workers: {elapsed:8.3f}s"
+              f"{', FAILED ' + str(metrics['failed']) if metrics['failed'] else ''}")
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+    args = [float(arg) for arg in sys.argv[1:]]
+    agents, switches, ports, latency = args + [4, 4, 16, 2][len(args):]
+    agents, switches, ports, latency = int(agents), int(switches), int(ports), latency / 1000
+    for workers in sorted({1, agents}):
+        bench(agents, switches, ports, latency, workers)
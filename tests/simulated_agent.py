@@ -0,0 +1,296 @@
+# Copyright IBM Corp. 2024
+# This software is available to you under a BSD 3-Clause License.
+# The full license terms are available here: https://github.com/OpenFabrics/sunfish_library_reference/blob/main/LICENSE
+
+"""Simulated Redfish agents serving synthetic CXL fabrics, for exercising the onboarding of agents without hardware.
+
+Example:
+    with SimulatedFleet(agents=4, switches=2, ports=16, latency=0.002) as fleet:
+        for agent in fleet:
+            core.handle_event(agent.discovered_event())
+            core.handle_event(agent.created_event())
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+REDFISH_ROOT = "/redfish/v1"
+
+
+def _collection(uri: str, collection_type: str, members: list) -> dict:
+    return {"@odata.id": uri, "@odata.type": f"#{collection_type}.{collection_type}", "Name": collection_type,
+            "Members": [{"@odata.id": member} for member in members], "Members@odata.count": len(members)}
+
+
+def cxl_fabric(agent: int = 0, agents: int = 1, switches: int = 2, ports: int = 8, endpoints: int = 4,
+               fabric_id: str = "CXL", fabric_uuid: str = None) -> dict:
+    """Generates the resources served by one of the agents of a fleet.
+
+    The fabric has switches with ports; the first endpoints ports of the first switch are DownstreamPorts
+    connected to as many Endpoints, the other ports are InterswitchPorts connecting the switches in a chain.
+    When the fleet has more than one agent, the first switch of every agent has two more InterswitchPorts, marked
+    as BoundaryPorts, linked to the previous and to the next agent of the ring: their CXL LinkPartner ids let
+    Sunfish match them and their links point to placeholders in the agent namespace.
+
+    Args:
+        agent (int): index of the agent in the fleet.
+        agents (int): number of agents in the fleet.
+        switches (int): switches of the fabric.
+        ports (int): ports of every switch, besides the boundary ports.
+        endpoints (int): endpoints of the fabric, at most ports.
+        fabric_id (str): Id of the fabric, the same for all the agents by default so their fabrics conflict.
+        fabric_uuid (str): UUID of the fabric, agents sharing it upload the same (merged) fabric.
+
+    Returns:
+        dict: "@odata.id": resource, including the collections.
+    """
+    fabric = f"{REDFISH_ROOT}/Fabrics/{fabric_id}"
+    endpoints = min(endpoints, ports)
+    resources = {}
+    fabric_obj = {"@odata.id": fabric, "@odata.type": "#Fabric.v1_3_0.Fabric", "Id": fabric_id,
+                  "Name": f"CXL fabric of agent {agent}", "FabricType": "CXL",
+                  "Switches": {"@odata.id": f"{fabric}/Switches"},
+                  "Endpoints": {"@odata.id": f"{fabric}/Endpoints"}}
+    if fabric_uuid:
+        fabric_obj["UUID"] = fabric_uuid
+    resources[fabric] = fabric_obj
+    resources[f"{fabric}/Switches"] = _collection(f"{fabric}/Switches", "SwitchCollection",
+                                                  [f"{fabric}/Switches/{switch}" for switch in range(switches)])
+    resources[f"{fabric}/Endpoints"] = _collection(f"{fabric}/Endpoints", "EndpointCollection",
+                                                   [f"{fabric}/Endpoints/{endpoint}" for endpoint in range(endpoints)])
+
+    for switch in range(switches):
+        switch_uri = f"{fabric}/Switches/{switch}"
+        port_ids = [str(port) for port in range(ports)]
+        if switch == 0 and agents > 1:
+            port_ids += ["Previous", "Next"]
+        resources[switch_uri] = {"@odata.id": switch_uri, "@odata.type": "#Switch.v1_9_0.Switch", "Id": str(switch),
+                                 "Name": f"Switch {switch}", "SwitchType": "CXL",
+                                 "Ports": {"@odata.id": f"{switch_uri}/Ports"},
+                                 "Status": {"State": "Enabled", "Health": "OK"}}
+        resources[f"{switch_uri}/Ports"] = _collection(f"{switch_uri}/Ports", "PortCollection",
+                                                       [f"{switch_uri}/Ports/{port}" for port in port_ids])
+        for port in port_ids:
+            port_uri = f"{switch_uri}/Ports/{port}"
+            port_obj = {"@odata.id": port_uri, "@odata.type": "#Port.v1_7_0.Port", "Id": port,
+                        "Name": f"Port {port}", "PortProtocol": "CXL", "PortType": "InterswitchPort",
+                        "Status": {"State": "Enabled", "Health": "OK"}, "Links": {}}
+            if port in ("Previous", "Next"):
+                # the peer port of Next is the Previous port of the next agent, and vice versa
+                peer_agent = (agent + (1 if port == "Next" else -1)) % agents
+                peer_port = "Previous" if port == "Next" else "Next"
+                port_obj["Oem"] = {"Sunfish_RM": {"BoundaryComponent": "BoundaryPort"}}
+                port_obj["CXL"] = {
+                    "LinkPartnerTransmit": {"LinkPartnerId": f"agent-{agent}-switch-0", "PortId": port},
+                    "LinkPartnerReceive": {"LinkPartnerId": f"agent-{peer_agent}-switch-0", "PortId": peer_port}
+                }
+                # placeholders, redirected by Sunfish to the resources of the peer agent
+                port_obj["Links"]["ConnectedSwitches"] = [{"@odata.id": f"{fabric}/Switches/Peer"}]
+                port_obj["Links"]["ConnectedSwitchPorts"] = [{"@odata.id": f"{fabric}/Switches/Peer/Ports/0"}]
+            elif switch == 0 and int(port) < endpoints:
+                port_obj["PortType"] = "DownstreamPort"
+                port_obj["Links"]["AssociatedEndpoints"] = [{"@odata.id": f"{fabric}/Endpoints/{port}"}]
+            elif switches > 1:
+                peer_switch = (switch + 1) % switches
+                port_obj["Links"]["ConnectedSwitches"] = [{"@odata.id": f"{fabric}/Switches/{peer_switch}"}]
+                port_obj["Links"]["ConnectedSwitchPorts"] = [
+                    {"@odata.id": f"{fabric}/Switches/{peer_switch}/Ports/{port}"}]
+            resources[port_uri] = port_obj
+
+    for endpoint in range(endpoints):
+        endpoint_uri = f"{fabric}/Endpoints/{endpoint}"
+        resources[endpoint_uri] = {"@odata.id": endpoint_uri, "@odata.type": "#Endpoint.v1_8_0.Endpoint",
+                                   "Id": str(endpoint), "Name": f"Endpoint {endpoint}", "EndpointProtocol": "CXL",
+                                   "Links": {"ConnectedPorts": [{"@odata.id": f"{fabric}/Switches/0/Ports/{endpoint}"}]}}
+    return resources
+
+
+class SimulatedAgent:
+    """Local HTTP server answering as a Redfish agent with a set of resources.
+
+    Besides the resources, the agent serves its service root, the ConnectionMethod read when it is discovered
+    and the Sunfish subscription patched with the Context assigned to the agent. GETs support If-None-Match
+    (with ETags computed from the resources) and, if expand is set, $expand of the collection members.
+    """
+
+    def __init__(self, resources: dict, latency: float = 0.0, error_rate: float = 0.0, errors: dict = None,
+                 expand: bool = False, seed: int = 0, connection_method: str = "CXL"):
+        """
+        Args:
+            resources (dict): "@odata.id": resource served, can be changed while the agent runs.
+            latency (float): seconds waited before answering every request.
+            error_rate (float): fraction of the GETs of resources answered with 503, chosen at random.
+            errors (dict): "@odata.id": HTTP status always returned for the resource.
+            expand (bool): advertise and support $expand.
+            seed (int): seed of the random errors, for reproducible runs.
+            connection_method (str): Id of the ConnectionMethod of the agent, unique in a fleet.
+        """
+        self.resources = resources
+        self.latency = latency
+        self.error_rate = error_rate
+        self.errors = errors or {}
+        self.expand = expand
+        self.connection_method = f"{REDFISH_ROOT}/AggregationService/ConnectionMethods/{connection_method}"
+        self.context = None
+        # paths requested, in order
+        self.requests = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        agent = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                agent._handle(self, "GET")
+
+            def do_PATCH(self):
+                agent._handle(self, "PATCH")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="simulated-agent", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def discovered_event(self) -> dict:
+        """AggregationSourceDiscovered event announcing the agent."""
+        return {"@odata.type": "#Event.v1_7_0.Event", "Name": "AggregationSourceDiscovered", "Context": "",
+                "Events": [{"EventType": "Other", "MessageId": "Sunfish.1.0.AggregationSourceDiscovered",
+                            "MessageArgs": ["Redfish", self.url],
+                            "OriginOfCondition": {"@odata.id": self.connection_method}}]}
+
+    def created_event(self, uri: str = None) -> dict:
+        """ResourceCreated event for a resource of the agent (the first fabric by default), sent after the agent
+        received its Context."""
+        if uri is None:
+            uri = min(uri for uri in self.resources if uri.startswith(f"{REDFISH_ROOT}/Fabrics/"))
+        return {"@odata.type": "#Event.v1_7_0.Event", "Name": "ResourceCreated", "Context": self.context,
+                "Events": [{"EventType": "Other", "MessageId": "ResourceEvent.1.0.ResourceCreated",
+                            "MessageArgs": [], "OriginOfCondition": {"@odata.id": uri}}]}
+
+    def _handle(self, request: BaseHTTPRequestHandler, method: str):
+        url = urlsplit(request.path)
+        path = re.sub("/+", "/", url.path).rstrip("/") or "/"
+        body = request.rfile.read(int(request.headers.get("Content-Length") or 0))
+        with self._lock:
+            self.requests.append(path)
+            failed = self.error_rate and self._random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+
+        if method == "PATCH":
+            if path.startswith(f"{REDFISH_ROOT}/EventService/Subscriptions/"):
+                self.context = json.loads(body or b"{}").get("Context")
+                return self._respond(request, 200, {"@odata.id": path, "Context": self.context})
+            return self._respond(request, 405, None)
+
+        if path == REDFISH_ROOT:
+            service_root = {"@odata.id": REDFISH_ROOT, "@odata.type": "#ServiceRoot.v1_15_0.ServiceRoot",
+                            "Fabrics": {"@odata.id": f"{REDFISH_ROOT}/Fabrics"}}
+            if self.expand:
+                service_root["ProtocolFeaturesSupported"] = {"ExpandQuery": {"NoLinks": True, "Levels": True,
+                                                                             "MaxLevels": 1}}
+            return self._respond(request, 200, service_root)
+        if path == self.connection_method:
+            return self._respond(request, 200, {"@odata.id": self.connection_method,
+                                                "@odata.type": "#ConnectionMethod.v1_1_0.ConnectionMethod",
+                                                "Id": self.connection_method.split("/")[-1],
+                                                "ConnectionMethodType": "Redfish"})
+        if path in self.errors:
+            return self._respond(request, self.errors[path], None)
+        if failed:
+            return self._respond(request, 503, None)
+        resource = self.resources.get(path)
+        if resource is None:
+            return self._respond(request, 404, None)
+
+        if self.expand and "$expand" in url.query and "Members" in resource:
+            resource = dict(resource, Members=[self.resources.get(member["@odata.id"], member)
+                                               for member in resource["Members"]])
+        text = json.dumps(resource).encode()
+        etag = f'"{hashlib.sha1(text).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            return self._respond(request, 304, None, etag=etag)
+        return self._respond(request, 200, text, etag=etag)
+
+    @staticmethod
+    def _respond(request: BaseHTTPRequestHandler, status: int, body, etag: str = None):
+        if body is not None and not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        request.send_response(status)
+        if etag:
+            request.send_header("ETag", etag)
+        if body is not None:
+            request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(body or b"")))
+        request.end_headers()
+        if body:
+            request.wfile.write(body)
+
+
+class SimulatedFleet:
+    """A ring of SimulatedAgents serving cxl_fabric resources, the neighbour agents share a pair of boundary ports.
+
+    The keyword arguments not used by cxl_fabric (latency, error_rate, errors, expand, seed) are passed to every
+    SimulatedAgent.
+    """
+
+    def __init__(self, agents: int = 2, **kwargs):
+        fabric_args = {key: kwargs.pop(key) for key in ["switches", "ports", "endpoints", "fabric_id", "fabric_uuid"]
+                       if key in kwargs}
+        self.agents = [SimulatedAgent(cxl_fabric(agent, agents, **fabric_args), connection_method=f"CXL-{agent}",
+                                      **kwargs) for agent in range(agents)]
+
+    def __iter__(self):
+        return iter(self.agents)
+
+    def __len__(self):
+        return len(self.agents)
+
+    def __getitem__(self, index):
+        return self.agents[index]
+
+    def start(self):
+        for agent in self.agents:
+            agent.start()
+        return self
+
+    def stop(self):
+        for agent in self.agents:
+            agent.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -4,14 +4,49 @@
 
 from genericpath import isdir
 # from http.server import BaseHTTPRequestHandler
+import asyncio
+import gc
 import json
 import os
 import logging
+import shutil
+import threading
+import weakref
 import pytest
 from pytest_httpserver import HTTPServer
 from sunfish.lib.core import Core
+from sunfish.events.redfish_subscription_handler import SubscriptionRoutingTable, SubscriptionRegistry, \
+    SharedSubscriptionRegistry
+from sunfish.events.event_journal import EventJournal
+from sunfish.events.event_pipeline import EventIngestionPipeline
+from sunfish.lib.circuit_breaker import CircuitBreaker
+from sunfish.lib.resource_ownership import ResourceOwnershipIndex
+from sunfish.lib.alias_db import AliasDB
+from sunfish.lib.uri_translator import URITranslator
+from sunfish.lib.agent_forwarding import AgentForwardingExecutor, AgentLimiter
+from sunfish.lib.agent_health import AgentHealthMonitor
 from sunfish.lib.exceptions import *
+from sunfish.lib.json_stream import load_json_stream
+from sunfish_plugins.events_handlers.redfish.inspection import AgentResponse, InspectionEngine, expand_query
+from sunfish_plugins.events_handlers.redfish.redfish_event_handler import RedfishEventHandler
 from tests import test_utils, tests_template
+from tests.simulated_agent import SimulatedFleet
+
+
+@pytest.fixture
+def conf(tmp_path):
+    """The test configuration with the resources and the private files of Sunfish in tmp_path."""
+    with open(os.path.join(os.getcwd(), 'tests', 'conf.json')) as f:
+        conf = json.load(f)
+    conf["backend_conf"]["fs_root"] = str(tmp_path / "Resources")
+    conf["backend_conf"]["fs_private"] = str(tmp_path / "SunfishPrivate")
+    conf["agent_health"] = {"probe_period": 0}
+    os.makedirs(conf["backend_conf"]["fs_private"])
+    with open(os.path.join(conf["backend_conf"]["fs_private"], "URI_aliases.json"), "w") as f:
+        json.dump({"Agents_xref_URIs": {}, "Sunfish_xref_URIs": {"aliases": {}}}, f)
+    return conf
+
+
 class TestSunfishcoreLibrary():
     @classmethod
     def setup_class(cls):
@@ -134,6 +169,16 @@ class TestSunfishcoreLibrary():
         assert self.core.create_object(path, tests_template.sub2)
         assert self.core.create_object(path, tests_template.sub3)
 
+    def test_subscription_patch(self):
+        sub_id = tests_template.sub1["Id"]
+        path = os.path.join(self.conf['redfish_root'], self.conf["backend_conf"]["subscribers_root"], sub_id)
+        self.core.patch_object(path, {"Context": "PatchedContext"})
+        record = self.core.subscription_handler.get_subscription(sub_id)
+        assert record["Context"] == "PatchedContext"
+        assert self.core.subscription_handler.find_destination_context(record["Destination"])
+        # the patch does not change the events the subscription receives
+        assert sub_id in self.core.subscription_handler.routing_table
+
     @pytest.fixture(scope="session")
     def httpserver_listen_address(self):
         return ("localhost", 8080)
@@ -149,6 +194,8 @@ class TestSunfishcoreLibrary():
         assert self.core.create_object(path, tests_template.wrong_sub)
         resp = self.core.handle_event(tests_template.event)
         assert len(resp) == 0
+        health = self.core.get_event_delivery_health()
+        assert health[tests_template.wrong_sub["Destination"]]["RecentFailures"] == 1
 
     def test_event_forwarding_2(self, httpserver: HTTPServer):
         httpserver.expect_request("/").respond_with_data("OK")
@@ -156,6 +203,40 @@ class TestSunfishcoreLibrary():
         #print('RESP ', resp)
         assert len(resp) == 1
 
+    def test_event_forwarding_multiple_events(self, httpserver: HTTPServer):
+        httpserver.expect_request("/").respond_with_data("OK")
+        payload = dict(tests_template.task_event_cancelled)
+        payload["Events"] = tests_template.task_event_cancelled["Events"] + \
+            tests_template.event_resource_type_system["Events"]
+        resp = self.core.handle_event(payload)
+        assert len(resp) == 2
+        # every subscriber receives only the events it is subscribed to
+        for request, _ in httpserver.log:
+            assert len(request.get_json()["Events"]) == 1
+
+    def test_event_stream(self):
+        path = os.path.join(self.conf['redfish_root'], self.conf["backend_conf"]["subscribers_root"])
+        sub = self.core.create_object(path, dict(tests_template.sse_sub))
+        stream = self.core.stream_events(subscription_id=sub["Id"], timeout=0)
+        # SSE subscribers are not forwarded the events with a POST
+        assert self.core.handle_event(tests_template.sse_event) == []
+        event_id, payload = next(stream)
+        assert payload["Events"] == tests_template.sse_event["Events"]
+        # resuming from the Last-Event-ID returns the events that followed it
+        assert list(self.core.stream_events(subscription_id=sub["Id"], last_event_id=event_id - 1,
+                                            timeout=0)) == [(event_id, payload)]
+
+    def test_submit_event(self, httpserver: HTTPServer):
+        httpserver.expect_request("/").respond_with_data("OK")
+        assert self.core.submit_event(tests_template.task_event_cancelled)
+        # redelivered events are dropped
+        assert not self.core.submit_event(tests_template.task_event_cancelled)
+        assert self.core.event_pipeline.join(timeout=10)
+        metrics = self.core.get_event_pipeline_metrics()
+        assert metrics["processed"] == 1
+        assert metrics["duplicates"] == 1
+        assert metrics["queue_depth"] == 0
+
     def test_resource_created_event_no_context_exception(self):
         with pytest.raises(PropertyNotFound):
             resp = self.core.handle_event(tests_template.resource_event_no_context)
@@ -188,6 +269,24 @@ class TestSunfishcoreLibrary():
 
         assert resp == f"Object {connection_path} deleted"
 
+    def test_remove_agent_resources(self):
+        agent_path = tests_template.aggregation_source["@odata.id"]
+        fabric_path = tests_template.test_fabric["@odata.id"]
+        aggregation_source = self.core.get_object(agent_path)
+        self.core.agent_health.record_success(agent_path)
+        assert self.core.resource_ownership.add_resource(aggregation_source, fabric_path)
+        assert not self.core.resource_ownership.add_resource(aggregation_source, fabric_path)
+        assert self.core.get_agent_resources(agent_path) == [fabric_path]
+
+        # the resources contained in the fabric are removed and reported too
+        assert self.core.remove_agent_resources(agent_path) == [fabric_path, f"{fabric_path}/Connections"]
+        with pytest.raises(ResourceNotFound):
+            self.core.get_object(fabric_path)
+        assert self.core.get_object(agent_path)["Links"]["ResourcesAccessed"] == []
+        assert self.core.get_agent_resources(agent_path) == []
+        # the removed agent is not probed anymore
+        assert agent_path not in self.core.get_agent_health()
+
     # deletes all the subscriptions
     @pytest.mark.order("last")
     def test_clean_up(self):
@@ -198,3 +297,737 @@ class TestSunfishcoreLibrary():
             if os.path.isdir(os.path.join(path, sub)):
                 path_sub = os.path.join(self.conf["redfish_root"], self.conf["backend_conf"]["subscribers_root"], sub)
                 self.core.delete_object(path_sub)
+
+
+class TestSubscriptionRoutingTable():
+    def test_routing_table_match(self):
+        table = SubscriptionRoutingTable()
+        table.add("sub1", tests_template.sub1)
+        table.add("sub2", tests_template.sub2)
+        table.add("sub3", tests_template.sub3)
+        mask = table.match("TaskEvent.1.0.TaskCancelled")
+        assert table.ids(mask) == ["sub2"]
+        mask = table.match("Power.1.0.CircuitPoweredOn", resource_type="ComputerSystem",
+                           origin="/redfish/v1/Systems/1/Memory/1")
+        assert table.ids(mask) == ["sub3"]
+
+    def test_routing_table_remove(self):
+        table = SubscriptionRoutingTable()
+        table.add("sub1", tests_template.sub1)
+        table.add("sub2", tests_template.sub2)
+        table.remove("sub2")
+        assert table.ids(table.match("TaskEvent.1.0.TaskCancelled")) == []
+        assert table.message_ids["TaskEvent.1.0.TaskCancelled"] == [0, 1]
+        table.add("sub4", tests_template.sub2)
+        assert table.ids(table.match("TaskEvent.1.0.TaskCancelled")) == ["sub4"]
+
+    def test_routing_table_update(self):
+        table = SubscriptionRoutingTable()
+        table.add("sub2", tests_template.sub2)
+        table.add("sub2", dict(tests_template.sub2, MessageIds=["TaskEvent.1.0.TaskCompletedOK"]))
+        assert table.ids(table.match("TaskEvent.1.0.TaskCompletedOK")) == ["sub2"]
+        assert "TaskEvent.1.0.TaskCancelled" not in table.message_ids
+        table.remove("sub2")
+        assert table.registry_prefixes == {} and table.message_ids == {} and len(table) == 0
+
+
+class TestSubscriptionRegistry():
+    def test_registries_are_isolated(self):
+        registry = SubscriptionRegistry()
+        other_registry = SubscriptionRegistry()
+        registry.add(dict(tests_template.sub2, Id="sub2"))
+        assert registry.match("TaskEvent.1.0.TaskCancelled") == ["sub2"]
+        assert other_registry.match("TaskEvent.1.0.TaskCancelled") == []
+
+    def test_shared_registry(self, tmp_path):
+        path = str(tmp_path / "registry.json")
+        registry = SharedSubscriptionRegistry(path)
+        other_registry = SharedSubscriptionRegistry(path)
+        registry.add(dict(tests_template.sub2, Id="sub2"))
+        assert other_registry.match("TaskEvent.1.0.TaskCancelled") == ["sub2"]
+        other_registry.suspend("sub2", {"State": "StandbyOffline"})
+        assert registry.match("TaskEvent.1.0.TaskCancelled") == []
+        assert registry.get("sub2")["Status"] == {"State": "StandbyOffline"}
+        registry.remove("sub2")
+        assert "sub2" not in other_registry
+
+
+class TestSubscriptionLoading():
+    def write_subscription(self, path, payload):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'index.json'), 'w') as f:
+            json.dump(payload, f)
+
+    def test_load_subscriptions_snapshot(self, conf):
+        path = os.path.join(conf["backend_conf"]["fs_root"], conf["backend_conf"]["subscribers_root"])
+        self.write_subscription(os.path.join(path, "sub1"), dict(tests_template.sub1, Id="sub1"))
+        self.write_subscription(os.path.join(path, "sub2"), dict(tests_template.sub2, Id="sub2"))
+
+        handler = Core(conf).subscription_handler
+        assert len(handler.registry) == 2
+        with open(handler.snapshot_path) as f:
+            assert sorted(json.load(f)) == ["sub1", "sub2"]
+
+        # only the modified subscription is parsed again
+        self.write_subscription(os.path.join(path, "sub2"),
+                                dict(tests_template.sub2, Id="sub2", MessageIds=["TaskEvent.1.0.TaskPaused"]))
+        handler = Core(conf).subscription_handler
+        assert handler.registry.get("sub2")["MessageIds"] == ["TaskEvent.1.0.TaskPaused"]
+        assert handler.route("TaskEvent.1.0.TaskCancelled") == []
+
+    def test_load_subscriptions_same_mtime(self, conf):
+        path = os.path.join(conf["backend_conf"]["fs_root"], conf["backend_conf"]["subscribers_root"], "sub2")
+        self.write_subscription(path, dict(tests_template.sub2, Id="sub2"))
+        stat = os.stat(os.path.join(path, 'index.json'))
+        assert Core(conf).subscription_handler.route("TaskEvent.1.0.TaskCancelled") == ["sub2"]
+
+        # rewritten with the same size and, as on a filesystem with a coarse mtime granularity, the same mtime
+        self.write_subscription(path, dict(tests_template.sub2, Id="sub2", MessageIds=["TaskEvent.1.0.TaskCompleted"]))
+        os.utime(os.path.join(path, 'index.json'), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert os.stat(os.path.join(path, 'index.json')).st_size == stat.st_size
+        handler = Core(conf).subscription_handler
+        assert handler.route("TaskEvent.1.0.TaskCancelled") == []
+        assert handler.route("TaskEvent.1.0.TaskCompleted") == ["sub2"]
+
+    def test_stale_shared_registry(self, conf):
+        conf["subscription_registry"] = {"shared": True}
+        path = os.path.join(conf["backend_conf"]["fs_root"], conf["backend_conf"]["subscribers_root"])
+        self.write_subscription(os.path.join(path, "sub1"), dict(tests_template.sub1, Id="sub1"))
+        self.write_subscription(os.path.join(path, "sub2"), dict(tests_template.sub2, Id="sub2"))
+        assert len(Core(conf).subscription_handler.registry) == 2
+
+        # the subscription is deleted while the service is down
+        shutil.rmtree(os.path.join(path, "sub2"))
+        handler = Core(conf).subscription_handler
+        assert "sub2" not in handler.registry
+        assert handler.route("TaskEvent.1.0.TaskCancelled") == []
+
+
+class TestResourceOwnershipIndex():
+    class Storage:
+        def __init__(self, objects):
+            self.objects = objects
+            self.reads = 0
+
+        def read(self, path):
+            self.reads += 1
+            if path not in self.objects:
+                raise ResourceNotFound(path)
+            return self.objects[path]
+
+        def replace(self, obj):
+            self.objects[obj["@odata.id"]] = obj
+
+    def test_resolve(self):
+        agent = "/redfish/v1/AggregationService/AggregationSources/agent1"
+        storage = self.Storage({
+            "/redfish/v1/Fabrics/CXL": {"Oem": {"Sunfish_RM": {"ManagingAgent": {"@odata.id": agent}}}},
+            "/redfish/v1/Systems/1": {"Id": "1"}
+        })
+        index = ResourceOwnershipIndex(storage, "/redfish/v1/")
+        assert index.resolve("/redfish/v1/Fabrics/CXL/Connections") == agent
+        assert index.resolve("/redfish/v1/Fabrics/CXL/Connections") == agent
+        assert index.resolve("/redfish/v1/Systems/1") is None
+        assert index.resolve("/redfish/v1/Systems/1") is None
+        assert index.resolve("/redfish/v1/Fabrics") is None
+        # the missing Connections is read again, the resources stored are read once
+        assert storage.reads == 4
+
+        index.storage_changed("/redfish/v1/Systems/1", {"@odata.id": "/redfish/v1/Systems/1",
+                              "Oem": {"Sunfish_RM": {"ManagingAgent": {"@odata.id": agent}}}})
+        assert index.resolve("/redfish/v1/Systems/1/Memory") == agent
+        index.forget("/redfish/v1/Fabrics", subtree=True)
+        assert index.resolve("/redfish/v1/Fabrics/CXL") == agent
+        assert storage.reads == 6
+        index.storage_changed("/redfish/v1/Systems/1")
+        assert index.resolve("/redfish/v1/Systems/1") is None
+
+    def test_resolve_missing(self):
+        agent = "/redfish/v1/AggregationService/AggregationSources/agent1"
+        storage = self.Storage({})
+        index = ResourceOwnershipIndex(storage, "/redfish/v1/")
+        # a resource not stored is not managed, rather than raising ResourceNotFound
+        assert index.resolve("/redfish/v1/Fabrics/CXL/Switches/1") is None
+        # the absence of the fabric is not cached, it is found once stored together with one of its switches
+        storage.objects["/redfish/v1/Fabrics/CXL"] = {"Oem": {"Sunfish_RM": {"ManagingAgent": {"@odata.id": agent}}}}
+        index.record({"@odata.id": "/redfish/v1/Fabrics/CXL/Switches/1"})
+        assert index._owners == {"/redfish/v1/Fabrics/CXL/Switches/1": None}
+        assert index.resolve("/redfish/v1/Fabrics/CXL/Switches/1") == agent
+        assert index.resolve("/redfish/v1/Fabrics/CXL/Switches/2") == agent
+
+    def test_resource_moved_to_another_agent(self):
+        agent1 = "/redfish/v1/AggregationService/AggregationSources/agent1"
+        agent2 = "/redfish/v1/AggregationService/AggregationSources/agent2"
+        fabric = "/redfish/v1/Fabrics/CXL"
+        storage = self.Storage({
+            agent1: {"@odata.id": agent1, "Links": {"ResourcesAccessed": [fabric]}},
+            agent2: {"@odata.id": agent2, "Links": {"ResourcesAccessed": []}}
+        })
+        index = ResourceOwnershipIndex(storage, "/redfish/v1/")
+        assert index.owns(agent1, fabric)
+        assert index.add_resource(storage.objects[agent2], fabric)
+        assert index.resources(agent1) == [] and index.resources(agent2) == [fabric]
+        # the previous agent doesn't own the resource anymore after a restart either
+        assert storage.objects[agent1]["Links"]["ResourcesAccessed"] == []
+
+
+class TestAgentForwardingExecutor():
+    def test_per_agent_limit(self):
+        executor = AgentForwardingExecutor(max_concurrent=1, max_queued=1)
+        release = threading.Event()
+        first = executor.submit("agent1", release.wait, 5)
+        second = executor.submit("agent1", lambda: "second")
+        with pytest.raises(AgentForwardingFailure):
+            executor.submit("agent1", lambda: "third")
+        # the other agents are not affected
+        assert executor.submit("agent2", lambda: "other").result(5) == "other"
+        assert executor.status()["agent1"] == {"Active": 1, "Queued": 1}
+        release.set()
+        assert first.result(5) is True
+        assert second.result(5) == "second"
+        assert asyncio.run(executor.run_async("agent1", lambda: "async")) == "async"
+        executor.shutdown()
+
+    def test_rate_limit(self):
+        now = [0.0]
+        delays = []
+        limiter = AgentLimiter(max_concurrent=10, rate=2, burst=2, clock=lambda: now[0], sleep=delays.append)
+        for _ in range(4):
+            limiter.acquire()
+            limiter.release()
+        assert delays == [0.5, 1.0]
+
+
+class TestAgentHealthMonitor():
+    def test_fail_fast_and_recovery(self, httpserver: HTTPServer):
+        httpserver.expect_request("/redfish/v1/").respond_with_json({})
+        monitor = AgentHealthMonitor(failure_threshold=2, probe_interval=60, probe_period=0)
+        monitor.track("agent1", httpserver.url_for("/").rstrip("/"))
+        monitor.record_failure("agent1")
+        monitor.check("agent1")
+        monitor.record_failure("agent1")
+        with pytest.raises(AgentForwardingFailure):
+            monitor.check("agent1")
+        assert monitor.status()["agent1"]["State"] == "Open"
+
+        # the agent is back, the active probe closes the breaker
+        assert monitor.probe("agent1")
+        monitor.check("agent1")
+        assert monitor.status()["agent1"]["State"] == "Closed"
+
+    def test_probe_released(self):
+        monitor = AgentHealthMonitor(failure_threshold=1, probe_interval=0, probe_period=0)
+        monitor.record_failure("agent1")
+        # the probe fails before reaching the agent, so its outcome is not recorded
+        monitor.check("agent1")
+        with pytest.raises(AgentForwardingFailure):
+            monitor.check("agent1")
+        monitor.release_probe("agent1")
+        monitor.check("agent1")
+        monitor.untrack("agent1")
+        assert "agent1" not in monitor.status()
+        monitor.stop()
+
+
+class TestAgentReadThrough():
+    def test_read_through(self, conf, httpserver: HTTPServer):
+        conf["agent_read_through"] = {"enabled": True, "ttl": 60, "ttl_per_type": {"Fabric": 0}}
+        core = Core(conf)
+        aggregation_source = dict(tests_template.aggregation_source, HostName=httpserver.url_for("/").rstrip("/"))
+        agent = {"@odata.id": aggregation_source["@odata.id"]}
+        core.storage_backend.write(aggregation_source)
+        fabric_path = tests_template.test_fabric["@odata.id"]
+        core.storage_backend.write(dict(tests_template.test_fabric, Description="stored",
+                                        Oem={"Sunfish_RM": {"ManagingAgent": agent}}))
+
+        httpserver.expect_oneshot_request(fabric_path, method="GET").respond_with_json(
+            dict(tests_template.test_fabric, Description="live"), headers={"ETag": "v1"})
+        fabric = core.get_object(fabric_path)
+        assert fabric["Description"] == "live"
+        assert fabric["Oem"]["Sunfish_RM"]["ManagingAgent"] == agent
+
+        # the cached copy is revalidated with its ETag
+        httpserver.expect_request(fabric_path, method="GET", headers={"If-None-Match": "v1"}).respond_with_data(
+            "", status=304)
+        assert core.get_object(fabric_path)["Description"] == "live"
+
+        # the stored copy is served when the agent fails
+        httpserver.clear()
+        assert core.get_object(fabric_path)["Description"] == "stored"
+
+
+class TestInspectionEngine():
+    def agent_tree(self):
+        fabric = "/redfish/v1/Fabrics/CXL"
+        tree = {fabric: {"@odata.id": fabric, "Switches": {"@odata.id": f"{fabric}/Switches"}}}
+        tree[f"{fabric}/Switches"] = {"@odata.id": f"{fabric}/Switches", "Members": []}
+        for switch in range(4):
+            switch_path = f"{fabric}/Switches/{switch}"
+            tree[f"{fabric}/Switches"]["Members"].append({"@odata.id": switch_path})
+            # the ports are linked before their collection is discovered
+            tree[switch_path] = {"@odata.id": switch_path, "Links": {"Ports": [
+                {"@odata.id": f"{switch_path}/Ports/{port}"} for port in range(4)]}}
+            tree[f"{switch_path}/Ports"] = {"@odata.id": f"{switch_path}/Ports", "Members": []}
+            for port in range(4):
+                tree[f"{switch_path}/Ports"]["Members"].append({"@odata.id": f"{switch_path}/Ports/{port}"})
+                tree[f"{switch_path}/Ports/{port}"] = {"@odata.id": f"{switch_path}/Ports/{port}"}
+        return tree
+
+    def test_parallel_inspection(self):
+        tree = self.agent_tree()
+        in_flight = [0, 0]
+        lock = threading.Lock()
+        processed = []
+
+        def fetch(uri):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            threading.Event().wait(0.01)
+            with lock:
+                in_flight[0] -= 1
+            return AgentResponse(200, tree[uri])
+
+        def process(uri, response):
+            # the resources are processed by the calling thread, parents first
+            assert threading.current_thread() is threading.main_thread()
+            assert all(parent in processed for parent in tree if uri.startswith(parent + "/"))
+            processed.append(uri)
+            return response.body
+
+        engine = InspectionEngine(fetch, process, workers=4)
+        visited = engine.run("/redfish/v1/Fabrics/CXL")
+        assert sorted(visited) == sorted(tree)
+        assert processed == sorted(tree)
+        assert engine.notfound == []
+        assert in_flight[1] > 1
+
+    def test_expanded_inspection(self):
+        tree = self.agent_tree()
+        for obj in tree.values():
+            obj["@odata.type"] = "#Collection" if "Members" in obj else "#Resource"
+        requested = []
+
+        def expand(uri, levels):
+            # the resource with its subordinate resources (not the Links) inline
+            obj = json.loads(json.dumps(tree[uri]))
+            if levels:
+                for key, value in obj.items():
+                    if key == "Members":
+                        obj[key] = [expand(member["@odata.id"], levels - 1) for member in value]
+                    elif type(value) == dict and "@odata.id" in value:
+                        obj[key] = expand(value["@odata.id"], levels - 1)
+            return obj
+
+        def fetch(uri):
+            requested.append(uri)
+            return AgentResponse(200, expand(uri, 1))
+
+        processed = {}
+
+        def process(uri, response):
+            processed[uri] = response.body
+            return response.body
+
+        engine = InspectionEngine(fetch, process, workers=2, expanded=True)
+        engine.run("/redfish/v1/Fabrics/CXL")
+        # the members are received with their collection, the expanded resources are processed on their own
+        assert sorted(processed) == sorted(tree)
+        assert processed == {uri: obj for uri, obj in tree.items()}
+        assert sorted(requested) == sorted([uri for uri, obj in tree.items() if "Members" in obj] +
+                                           ["/redfish/v1/Fabrics/CXL"])
+
+    def test_resume_inspection(self):
+        tree = self.agent_tree()
+        failing = "/redfish/v1/Fabrics/CXL/Switches/2"
+        checkpoints = []
+        processed = []
+
+        def fetch(uri):
+            if uri == failing:
+                raise ConnectionError(uri)
+            return AgentResponse(200, tree[uri])
+
+        def process(uri, response):
+            processed.append(uri)
+            return response.body
+
+        engine = InspectionEngine(fetch, process, workers=2, checkpoint=checkpoints.append, checkpoint_every=5)
+        with pytest.raises(ConnectionError):
+            engine.run("/redfish/v1/Fabrics/CXL")
+        # periodic checkpoints, then the one saved when the agent failed
+        assert len(checkpoints) > 1
+        state = json.loads(json.dumps(checkpoints[-1]))
+        assert failing in state["Frontier"]
+        assert state["Fetched"] == processed
+
+        done = list(processed)
+        processed.clear()
+        failing = None
+        InspectionEngine(fetch, process, workers=2).run("/redfish/v1/Fabrics/CXL", resume=state)
+        # nothing is processed twice
+        assert sorted(done + processed) == sorted(tree)
+
+    def test_expand_query(self):
+        assert expand_query({}) is None
+        assert expand_query({"ProtocolFeaturesSupported": {"ExpandQuery": {"ExpandAll": True}}}) is None
+        assert expand_query({"ProtocolFeaturesSupported": {"ExpandQuery": {"NoLinks": True}}}) == "$expand=."
+        assert expand_query({"ProtocolFeaturesSupported": {"ExpandQuery": {
+            "NoLinks": True, "Levels": True, "MaxLevels": 3}}}, levels=5) == "$expand=.($levels=3)"
+
+
+class TestIncrementalInspection():
+    def agent(self, httpserver, resources, etags={}):
+        httpserver.clear()
+        httpserver.expect_request("/redfish/v1/").respond_with_json({})
+        for uri, obj in resources.items():
+            if uri in etags:
+                httpserver.expect_request(uri, headers={"If-None-Match": etags[uri]}).respond_with_data("", status=304)
+            httpserver.expect_request(uri).respond_with_json(obj, headers={"ETag": etags.get(uri, "")})
+
+    def test_incremental_inspection(self, conf, httpserver: HTTPServer):
+        conf["inspection"] = {"incremental": True, "workers": 2}
+        core = Core(conf)
+        aggregation_source = dict(tests_template.aggregation_source, HostName=httpserver.url_for("/").rstrip("/"))
+        aggregation_source["Links"] = {"ResourcesAccessed": []}
+        core.storage_backend.write(aggregation_source)
+
+        fabric = "/redfish/v1/Fabrics/CXL"
+        resources = {
+            fabric: {"@odata.id": fabric, "@odata.type": "#Fabric.v1_3_0.Fabric", "Id": "CXL",
+                     "Switches": {"@odata.id": f"{fabric}/Switches"}},
+            f"{fabric}/Switches": {"@odata.id": f"{fabric}/Switches",
+                                   "@odata.type": "#SwitchCollection.SwitchCollection",
+                                   "Members": [{"@odata.id": f"{fabric}/Switches/1"}]},
+            f"{fabric}/Switches/1": {"@odata.id": f"{fabric}/Switches/1", "@odata.type": "#Switch.v1_9_0.Switch",
+                                     "Id": "1", "Description": "first"}
+        }
+        self.agent(httpserver, resources)
+        RedfishEventHandler.bfsInspection(core, resources[fabric], aggregation_source)
+        assert core.get_object(f"{fabric}/Switches/1")["Description"] == "first"
+
+        written = []
+        for method in ["write", "replace"]:
+            original = getattr(core.storage_backend, method)
+            setattr(core.storage_backend, method,
+                    lambda obj, original=original: written.append(obj["@odata.id"]) or original(obj))
+
+        # nothing changed, nothing is written
+        RedfishEventHandler.bfsInspection(core, resources[fabric], aggregation_source)
+        assert written == []
+
+        # only the resource changed is updated, keeping its Sunfish properties
+        resources[f"{fabric}/Switches/1"]["Description"] = "second"
+        self.agent(httpserver, resources, etags={f"{fabric}/Switches/1": "v2"})
+        RedfishEventHandler.bfsInspection(core, resources[fabric], aggregation_source)
+        assert written == [f"{fabric}/Switches/1"]
+        switch = core.get_object(f"{fabric}/Switches/1")
+        assert switch["Description"] == "second"
+        assert switch["Oem"]["Sunfish_RM"]["ManagingAgent"]["@odata.id"] == aggregation_source["@odata.id"]
+
+        # the agent answers 304 to If-None-Match
+        RedfishEventHandler.bfsInspection(core, resources[fabric], aggregation_source)
+        assert written == [f"{fabric}/Switches/1"]
+
+        # the checkpoints are opt-in and removed once the inspection completes
+        state_dir = os.path.join(conf["backend_conf"]["fs_private"], "InspectionState")
+        assert not [name for name in os.listdir(state_dir) if name.endswith(".checkpoint.json")]
+        core.conf["inspection"]["checkpoint_every"] = 1
+        RedfishEventHandler.bfsInspection(core, resources[fabric], aggregation_source)
+        assert not [name for name in os.listdir(state_dir) if name.endswith(".checkpoint.json")]
+
+
+class TestJsonStream():
+    def test_chunked_decode(self):
+        doc = {"@odata.id": "/redfish/v1/Fabrics/CXL/Switches", "Name": "\"Members\": [ \\ ] }",
+               "Oem": {"Members": [1, 2]},
+               "Members": [{"@odata.id": f"/redfish/v1/Fabrics/CXL/Switches/{i}", "Name": "é ] \" ["} for i in range(20)]
+                          + [1234567, None, [], "text"],
+               "Members@odata.count": 24}
+        text = json.dumps(doc, ensure_ascii=False, indent=2).encode()
+        for size in [1, 3, 64, len(text)]:
+            members = []
+
+            def on_member(member):
+                members.append(member)
+                return member["@odata.id"] if type(member) == dict else member
+            obj = load_json_stream([text[i:i + size] for i in range(0, len(text), size)], on_member)
+            assert members == doc["Members"]
+            assert obj == dict(doc, Members=[m["@odata.id"] if type(m) == dict else m for m in doc["Members"]])
+
+    def test_long_string(self):
+        # a string spanning many chunks, with escapes split between them, is scanned once
+        doc = {"Description": "\\\"é" * 100000, "Members": [{"@odata.id": "/redfish/v1/Fabrics/CXL"}]}
+        text = json.dumps(doc, ensure_ascii=False).encode()
+        assert load_json_stream([text[i:i + 1000] for i in range(0, len(text), 1000)]) == doc
+
+    def test_invalid_document(self):
+        for text in [b'{"Members": [{"@odata.id": "/a"},', b'{"Members": [{"a":}]}', b'{"Name": "a']:
+            with pytest.raises(ValueError):
+                load_json_stream([text])
+
+
+class TestEventIngestionPipeline():
+    def test_concurrent_agents(self):
+        # each agent waits for the other one, the test only ends if they are onboarded in parallel
+        barrier = threading.Barrier(2, timeout=10)
+        handled = []
+
+        def handler(payload):
+            if payload["Events"][0]["EventId"] == "1":
+                barrier.wait()
+            handled.append((payload["Context"], payload["Events"][0]["EventId"]))
+
+        pipeline = EventIngestionPipeline(handler, workers=2)
+        for context in ["agent-a", "agent-b"]:
+            for event_id in ["1", "2", "3"]:
+                assert pipeline.submit({"Context": context, "Events": [{"EventId": event_id}]})
+        assert pipeline.join(timeout=10)
+        pipeline.stop()
+        assert pipeline.metrics()["failed"] == 0
+        # the events of every agent are still processed in order
+        for context in ["agent-a", "agent-b"]:
+            assert [event for agent, event in handled if agent == context] == ["1", "2", "3"]
+
+    def test_redelivery_after_failure(self):
+        attempts = []
+
+        def handler(payload):
+            attempts.append(payload["Events"][0]["EventId"])
+            if len(attempts) == 1:
+                raise RuntimeError("handler failure")
+
+        pipeline = EventIngestionPipeline(handler, workers=1)
+        payload = {"Context": "agent-a", "Events": [{"EventId": "1"}]}
+        assert pipeline.submit(payload)
+        assert pipeline.join(timeout=10)
+        # the event failed, so its redelivery is processed
+        assert pipeline.submit(payload)
+        assert pipeline.join(timeout=10)
+        # the event succeeded, so its redelivery is dropped
+        assert not pipeline.submit(payload)
+        pipeline.stop()
+        assert attempts == ["1", "1"]
+        assert pipeline.metrics()["failed"] == 1
+
+
+class TestSimulatedFleet():
+    def test_concurrent_onboarding(self, conf):
+        conf["event_pipeline"] = {"workers": 3}
+        core = Core(conf)
+
+        failing_port = "/redfish/v1/Fabrics/CXL/Switches/1/Ports/3"
+        with SimulatedFleet(agents=3, switches=2, ports=4, endpoints=2, latency=0.001,
+                            errors={failing_port: 500}) as fleet:
+            for agent in fleet:
+                core.submit_event(agent.discovered_event())
+            assert core.event_pipeline.join(timeout=30)
+            for agent in fleet:
+                core.submit_event(agent.created_event())
+            assert core.event_pipeline.join(timeout=60)
+        core.event_pipeline.stop()
+        assert core.get_event_pipeline_metrics()["failed"] == 0
+
+        boundary_ports = {port: details for agent in core.alias_db.data["Agents_xref_URIs"].values()
+                          for port, details in agent.get("boundaryPorts", {}).items()}
+        # every agent has a boundary port towards each of its two neighbours of the ring
+        assert len(boundary_ports) == 6
+        for port, details in boundary_ports.items():
+            assert boundary_ports[details["PeerPortURI"]]["PeerPortURI"] == port
+            assert core.get_object(port)["Links"]["ConnectedSwitchPorts"] == [{"@odata.id": details["PeerPortURI"]}]
+        # the links of the renamed fabrics point to the renamed resources
+        for fabric in {port.split("/Switches/")[0] for port in boundary_ports}:
+            links = core.get_object(f"{fabric}/Switches/1/Ports/0")["Links"]
+            assert links["ConnectedSwitches"] == [{"@odata.id": f"{fabric}/Switches/0"}]
+        # the agents failed to return the port
+        with pytest.raises(ResourceNotFound):
+            core.get_object(failing_port)
+
+    def test_expand_capability_cached(self, conf):
+        core = Core(conf)
+        with SimulatedFleet(agents=1, switches=1, ports=2, endpoints=1, expand=True) as fleet:
+            aggregation_source = dict(tests_template.aggregation_source, HostName=fleet[0].url)
+            for _ in range(2):
+                assert RedfishEventHandler.agentExpandQuery(core, aggregation_source, 1) == "$expand=.($levels=1)"
+        # the service root is read by the first inspection only
+        assert fleet[0].requests.count("/redfish/v1") == 1
+
+    def test_agent_cache_invalidated(self, conf):
+        core = Core(conf)
+        with SimulatedFleet(agents=1, switches=1, ports=2, endpoints=1) as fleet:
+            core.handle_event(fleet[0].discovered_event())
+            collection = core.get_object("/redfish/v1/AggregationService/AggregationSources")
+            agent_path = collection["Members"][0]["@odata.id"]
+            agent = core.objects_manager.get_agent(agent_path)
+            assert agent.aggregation_source["Links"]["ResourcesAccessed"] == []
+            core.handle_event(fleet[0].created_event())
+        # the Agent is created again from the AggregationSource patched with the resources uploaded
+        resources = core.objects_manager.get_agent(agent_path).aggregation_source["Links"]["ResourcesAccessed"]
+        assert resources == core.get_agent_resources(agent_path) != []
+
+
+class TestAliasDB():
+    def test_write_behind(self, tmp_path):
+        path = str(tmp_path / "URI_aliases.json")
+        alias_db = AliasDB(path, flush_interval=60)
+        assert alias_db.data == {"Agents_xref_URIs": {}, "Sunfish_xref_URIs": {"aliases": {}}}
+        with alias_db.lock:
+            alias_db.data["Agents_xref_URIs"]["agent"] = {"aliases": {"/redfish/v1/Fabrics/CXL": "/redfish/v1/Fabrics/A"}}
+            alias_db.changed()
+        # the changes are batched in memory
+        assert not os.path.exists(path)
+        alias_db.flush()
+        assert AliasDB(path).data == alias_db.data
+        # without flush_interval every change is written immediately
+        alias_db = AliasDB(path, flush_interval=0)
+        alias_db.data["Sunfish_xref_URIs"]["aliases"]["/redfish/v1/Fabrics/A"] = ["/redfish/v1/Fabrics/CXL"]
+        alias_db.changed()
+        assert AliasDB(path).data == alias_db.data
+        assert os.listdir(tmp_path) == ["URI_aliases.json"]
+
+    def test_single_process(self, tmp_path, caplog):
+        path = str(tmp_path / "URI_aliases.json")
+        alias_db = AliasDB(path, flush_interval=0)
+        # the changes written by another process are detected when they are overwritten
+        other = AliasDB(path, flush_interval=0)
+        other.data["Agents_xref_URIs"]["other"] = {"aliases": {}}
+        other.changed()
+        alias_db.data["Agents_xref_URIs"]["agent"] = {"aliases": {}}
+        alias_db.changed()
+        assert "modified by another process" in caplog.text
+        # the databases are not kept alive to be written at exit
+        alias_db.close()
+        closed = weakref.ref(alias_db)
+        unused = weakref.ref(other)
+        del alias_db, other
+        gc.collect()
+        assert closed() is None and unused() is None
+
+
+class TestURITranslator():
+    def test_rewrite(self):
+        translator = URITranslator({"/redfish/v1/Fabrics/CXL": "/redfish/v1/Fabrics/A_CXL",
+                                    "/redfish/v1/Fabrics/CXL/Switches/1": "/redfish/v1/Fabrics/A_CXL/Switches/B_1"})
+        obj = {"@odata.id": "/redfish/v1/Fabrics/CXL/Switches/1/Ports/0",
+               "Links": {"ConnectedSwitches": [{"@odata.id": "/redfish/v1/Fabrics/CXL/Switches/2"}],
+                         "ConnectedSwitchPorts": [{"@odata.id": "/redfish/v1/Fabrics/CXLX/Switches/1/Ports/0"},
+                                                  {"@odata.id": "/redfish/v1/Fabrics/CXL/Switches/1/Ports/1"}]},
+               "Oem": {"Sunfish_RM": {"ManagingAgent": {"@odata.id": "/redfish/v1/Fabrics/CXL"}}}}
+        assert translator.rewrite(obj) == ["[Links][ConnectedSwitches][0]", "[Links][ConnectedSwitchPorts][1]"]
+        # the object itself and the Sunfish_RM properties are not translated
+        assert obj["@odata.id"] == "/redfish/v1/Fabrics/CXL/Switches/1/Ports/0"
+        assert obj["Oem"]["Sunfish_RM"]["ManagingAgent"]["@odata.id"] == "/redfish/v1/Fabrics/CXL"
+        # the longest aliased prefix wins, only at segment boundaries
+        assert obj["Links"]["ConnectedSwitches"][0]["@odata.id"] == "/redfish/v1/Fabrics/A_CXL/Switches/2"
+        assert [link["@odata.id"] for link in obj["Links"]["ConnectedSwitchPorts"]] == [
+            "/redfish/v1/Fabrics/CXLX/Switches/1/Ports/0", "/redfish/v1/Fabrics/A_CXL/Switches/B_1/Ports/1"]
+        assert URITranslator(translator.aliases, prefixes=False).translate(
+            "/redfish/v1/Fabrics/CXL/Switches/2") == "/redfish/v1/Fabrics/CXL/Switches/2"
+
+
+class TestEventStream():
+    def test_stream_without_readers(self, conf):
+        core = Core(conf)
+        # nobody can read the events, they are not buffered
+        assert core.handle_event(tests_template.sse_event) == []
+        assert core.event_stream.last_id == 0
+
+        stream = core.stream_events(timeout=0)
+        assert core.event_stream.readers == 1
+        core.handle_event(tests_template.sse_event)
+        event_id, payload = next(stream)
+        assert payload["Events"] == tests_template.sse_event["Events"]
+        del stream
+        gc.collect()
+        assert core.event_stream.readers == 0
+
+        path = os.path.join(conf['redfish_root'], conf["backend_conf"]["subscribers_root"])
+        core.create_object(path, dict(tests_template.sse_sub))
+        core.handle_event(tests_template.sse_event)
+        assert core.event_stream.last_id == event_id + 1
+
+
+class TestSubscriptionSuspension():
+    def test_enabled_again(self, conf):
+        conf["event_delivery"] = {"failure_threshold": 2, "suspend_after": 0, "timeout": 1}
+        core = Core(conf)
+        path = os.path.join(conf['redfish_root'], conf["backend_conf"]["subscribers_root"])
+        sub = core.create_object(path, dict(tests_template.wrong_sub))
+        sub_path = os.path.join(path, sub["Id"])
+        for _ in range(2):
+            core.handle_event(tests_template.event)
+        assert core.get_object(sub_path)["Status"]["State"] == "StandbyOffline"
+        assert core.subscription_handler.route("ResourceEvent.1.0.Prova") == []
+
+        core.patch_object(sub_path, {"Status": {"State": "Enabled", "Health": "OK"}})
+        assert core.get_event_delivery_health()[sub["Destination"]]["State"] == CircuitBreaker.CLOSED
+        # a single failure does not suspend the subscription again
+        core.handle_event(tests_template.event)
+        assert core.get_object(sub_path)["Status"]["State"] == "Enabled"
+        assert core.subscription_handler.route("ResourceEvent.1.0.Prova") == [sub["Id"]]
+
+
+class TestEventJournal():
+    def test_journal_replay(self, tmp_path):
+        journal = EventJournal(str(tmp_path), segment_bytes=1, max_bytes=1024 * 1024)
+        journal.append(tests_template.task_event_cancelled)
+        journal.append(tests_template.event)
+        journal.append(tests_template.event_resource_type_system)
+        assert [seq for seq, _ in journal.replay()] == [1, 2, 3]
+        seq, payload = list(journal.replay(from_sequence=1))[0]
+        assert seq == 2 and payload["Events"] == tests_template.event["Events"]
+        assert payload["Context"] == tests_template.event["Context"]
+        table = SubscriptionRoutingTable()
+        table.add("sub2", tests_template.sub2)
+        replayed = journal.replay(event_filter=lambda event: table.match(event["MessageId"]) != 0)
+        assert [seq for seq, _ in replayed] == [1]
+        # sequence numbers survive a restart
+        assert EventJournal(str(tmp_path)).append(tests_template.event) == [4]
+
+    def test_journal_retention(self, tmp_path):
+        journal = EventJournal(str(tmp_path), segment_bytes=1, max_bytes=1)
+        for _ in range(3):
+            journal.append(tests_template.event)
+        assert [seq for seq, _ in journal.replay()] == [3]
+
+        # the size limit holds also when the segments are never rotated because of their size
+        journal = EventJournal(str(tmp_path / "large"), segment_bytes=1 << 30, max_bytes=1)
+        for _ in range(3):
+            journal.append(tests_template.event)
+        assert [seq for seq, _ in journal.replay()] == [3]
+
+    def test_journal_truncated_event(self, tmp_path):
+        journal = EventJournal(str(tmp_path))
+        journal.append(tests_template.event)
+        journal.append(tests_template.event)
+        segment_path = journal._segments()[-1][1]
+        # a crash while appending the second event
+        with open(segment_path, 'r+') as segment:
+            segment.truncate(os.path.getsize(segment_path) - 10)
+        journal = EventJournal(str(tmp_path))
+        assert [seq for seq, _ in journal.replay()] == [1]
+        assert journal.append(tests_template.event) == [2]
+        assert [seq for seq, _ in journal.replay()] == [1, 2]
+
+
+class TestCircuitBreaker():
+    def test_circuit_breaker_states(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=2, error_window=10, probe_interval=5, clock=lambda: now[0])
+        breaker.record_failure()
+        assert breaker.allow_request()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow_request()
+        now[0] = 6.0
+        # a single probe is allowed once the probe interval elapsed
+        assert breaker.allow_request()
+        assert not breaker.allow_request()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.open_for() == 6.0
+        now[0] = 12.0
+        assert breaker.allow_request()
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.open_for() == 0.0
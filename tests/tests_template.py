@@ -260,6 +260,32 @@ wrong_sub = {
     ]
 }
 
+sse_sub = {
+    "@odata.type": "#EventDestination.v1_13_2.EventDestination",
+    "Destination": "",
+    "SubscriptionType": "SSE",
+    "EventFormatType": "Event",
+    "RegistryPrefixes": [
+        "Streaming"
+    ]
+}
+
+sse_event = {
+    "@odata.type": "#Event.v1_7_0.Event",
+    "Name": "Streamed Event",
+    "Context": "ContosoWebClient",
+    "Events": [
+        {
+            "EventId": "5001",
+            "Severity": "OK",
+            "Message": "Event delivered through Server-Sent Events.",
+            "MessageId": "Streaming.1.0.Test",
+            "MessageArgs": [
+            ]
+        }
+    ]
+}
+
 event = {
     "@odata.type": "#Event.v1_7_0.Event",
     "Name": "Event Array",